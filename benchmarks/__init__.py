@@ -0,0 +1,4 @@
+import os
+
+# Benchmarks print machine-readable results, which the pygame greeting would break
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
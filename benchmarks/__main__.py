@@ -0,0 +1,96 @@
+"""Runs the engine microbenchmarks and prints their results as JSON.
+Run from the repository root: python -m benchmarks [--size N] [--entities N,N] [--output file.json] [--save]
+Saved results can be compared between revisions with benchmarks.compare"""
+from typing import Dict, Any, List
+
+from contextlib import redirect_stdout
+
+import argparse
+import platform
+import json
+import time
+import sys
+
+from .harness import BenchmarkResult
+from .suite import BenchmarkContext, get_benchmark_names, run_benchmarks
+from .store import ResultStore
+
+
+def parse_arguments(args: List[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Runs the engine microbenchmarks")
+    parser.add_argument("names", nargs="*", help="benchmarks to run, all of them by default")
+    parser.add_argument("--size", type=int, default=256, help="width and height of the generated world in tiles")
+    parser.add_argument("--entities", default="10,50,200",
+                        help="comma separated amounts of entities for the collision benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5, help="measurements of each benchmark")
+    parser.add_argument("--output", help="file to write the JSON results to, instead of the standard output")
+    parser.add_argument("--save", action="store_true",
+                        help="save the results to the results store, keyed by the checked out revision")
+    parser.add_argument("--list", action="store_true", help="print names of the benchmarks and exit")
+    return parser.parse_args(args)
+
+
+def get_environment() -> Dict[str, Any]:
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    import pygame
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "pygame": pygame.version.ver,
+        "numpy": numpy_version,
+    }
+
+
+def print_result(result: BenchmarkResult):
+    # Human readable progress goes to stderr, so the JSON on stdout can be piped
+    print(f"{result.get_key():60} {result.get_median() * 1e9:12.1f} ns/op "
+          f"(min {result.get_min() * 1e9:.1f}, {result.number}x{result.operations} ops)", file=sys.stderr)
+
+
+def main(args: List[str] | None = None) -> int:
+    arguments = parse_arguments(args)
+    if arguments.list:
+        print("\n".join(get_benchmark_names()))
+        return 0
+
+    unknown = [name for name in arguments.names if name not in get_benchmark_names()]
+    if unknown:
+        print(f"benchmarks: unknown benchmark(s) {', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    context = BenchmarkContext(arguments.size, [int(value) for value in arguments.entities.split(",")],
+                               arguments.seed)
+    # The engine prints its messages, which must not get into the JSON
+    try:
+        with redirect_stdout(sys.stderr):
+            results = run_benchmarks(context, arguments.names or None, arguments.repeat, print_result)
+    finally:
+        context.close()
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": get_environment(),
+        "params": {"size": arguments.size, "entities": context.entities, "seed": arguments.seed,
+                   "repeat": arguments.repeat},
+        "results": [result.to_dict() for result in results],
+    }
+
+    if arguments.save:
+        path = ResultStore().save(report)
+        print(f"benchmarks: saved {len(results)} result(s) to {path}", file=sys.stderr)
+    if arguments.output:
+        with open(arguments.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=4)
+        print(f"benchmarks: saved {len(results)} result(s) to {arguments.output}", file=sys.stderr)
+    else:
+        json.dump(report, sys.stdout, indent=4)
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+"""Stores benchmark results and compares them between revisions. Exits with 1 if any benchmark regressed.
+Run from the repository root:
+    python -m benchmarks.compare save results.json [--revision REV]
+    python -m benchmarks.compare list
+    python -m benchmarks.compare compare BASE [CURRENT | --file results.json] [--threshold 0.1]
+Saving several runs of a revision lets the comparison account for the noise between runs"""
+from typing import Dict, Any, List
+
+import statistics
+import argparse
+import sys
+
+from .store import ResultStore, get_git_revision, load_report
+
+DEFAULT_THRESHOLD = 0.10
+# The threshold of a noisy benchmark is raised to this many times its relative noise
+NOISE_FACTOR = 2.0
+
+
+class Comparison:
+    REGRESSION = "regression"
+    IMPROVEMENT = "improvement"
+    UNCHANGED = "unchanged"
+    NEW = "new"
+    MISSING = "missing"
+
+    def __init__(self, key: str, baseline: float | None, current: float | None, threshold: float, status: str):
+        self.key = key
+        # Median time in nanoseconds
+        self.baseline = baseline
+        self.current = current
+        self.threshold = threshold
+        self.status = status
+
+    def get_delta(self) -> float | None:
+        if not self.baseline or self.current is None:
+            return None
+        return self.current / self.baseline - 1
+
+
+def collect_samples(runs: List[Dict[str, Any]]) -> Dict[str, List[List[float]]]:
+    """Returns times of every benchmark in all repeats, for each run"""
+    samples: Dict[str, List[List[float]]] = {}
+    for run in runs:
+        for result in run.get("results", []):
+            key = result.get("key", result["name"])
+            samples.setdefault(key, []).append(result.get("times_ns") or [result["median_ns"]])
+    return samples
+
+
+def get_median(runs: List[List[float]]) -> float:
+    return statistics.median(value for samples in runs for value in samples)
+
+
+def get_run_noise(runs: List[List[float]]) -> float:
+    """Returns the relative noise of the benchmark. It's the largest of the noise between repeats of each run,
+    and the noise between medians of the runs, which is usually larger since the machine state changes"""
+    noise = max(get_noise(samples) for samples in runs)
+    if len(runs) > 1:
+        noise = max(noise, get_noise([statistics.median(samples) for samples in runs]))
+    return noise
+
+
+def get_noise(samples: List[float]) -> float:
+    """Returns the relative spread of the samples, based on the median absolute deviation,
+    which isn't affected by a single slow repeat"""
+    if len(samples) < 2:
+        return 0.0
+    median = statistics.median(samples)
+    if median == 0:
+        return 0.0
+    # Scaled, so it matches the standard deviation of normally distributed samples
+    return 1.4826 * statistics.median(abs(value - median) for value in samples) / median
+
+
+def compare(baseline_runs: List[Dict[str, Any]],
+            current_runs: List[Dict[str, Any]],
+            threshold: float = DEFAULT_THRESHOLD) -> List[Comparison]:
+    baseline_samples = collect_samples(baseline_runs)
+    current_samples = collect_samples(current_runs)
+    comparisons = []
+    for key in list(baseline_samples.keys()) + [key for key in current_samples.keys() if key not in baseline_samples]:
+        if key not in current_samples:
+            comparisons.append(Comparison(key, get_median(baseline_samples[key]), None, threshold,
+                                          Comparison.MISSING))
+            continue
+        if key not in baseline_samples:
+            comparisons.append(Comparison(key, None, get_median(current_samples[key]), threshold,
+                                          Comparison.NEW))
+            continue
+
+        baseline = get_median(baseline_samples[key])
+        current = get_median(current_samples[key])
+        noise = max(get_run_noise(baseline_samples[key]), get_run_noise(current_samples[key]))
+        limit = max(threshold, NOISE_FACTOR * noise)
+        delta = current / baseline - 1 if baseline else 0
+        if delta > limit:
+            status = Comparison.REGRESSION
+        elif delta < -limit:
+            status = Comparison.IMPROVEMENT
+        else:
+            status = Comparison.UNCHANGED
+        comparisons.append(Comparison(key, baseline, current, limit, status))
+    return comparisons
+
+
+def print_comparisons(comparisons: List[Comparison]):
+    print(f"{'benchmark':60} {'baseline':>14} {'current':>14} {'delta':>8} {'limit':>7}  status")
+    for comparison in comparisons:
+        baseline = f"{comparison.baseline:.1f}" if comparison.baseline is not None else "-"
+        current = f"{comparison.current:.1f}" if comparison.current is not None else "-"
+        delta = comparison.get_delta()
+        delta = f"{delta * 100:+.1f}%" if delta is not None else "-"
+        print(f"{comparison.key:60} {baseline:>14} {current:>14} {delta:>8} {comparison.threshold * 100:6.1f}%"
+              f"  {comparison.status}")
+
+
+def parse_arguments(args: List[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.compare",
+                                     description="Stores benchmark results and compares them between revisions")
+    parser.add_argument("--store", help="directory of the results store")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    save = commands.add_parser("save", help="save results of a benchmark run or a metrics summary")
+    save.add_argument("file")
+    save.add_argument("--revision", help="revision to save the results as, the checked out one by default")
+
+    commands.add_parser("list", help="list stored revisions of this machine")
+
+    compare_command = commands.add_parser("compare", help="compare results of two revisions")
+    compare_command.add_argument("baseline", help="revision to compare with")
+    compare_command.add_argument("current", nargs="?", help="revision to compare, the checked out one by default")
+    compare_command.add_argument("--file", help="compare results from the file instead of a stored revision")
+    compare_command.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                                 help="relative slowdown which counts as a regression, 0.1 by default")
+    return parser.parse_args(args)
+
+
+def main(args: List[str] | None = None) -> int:
+    arguments = parse_arguments(args)
+    store = ResultStore(arguments.store) if arguments.store else ResultStore()
+
+    if arguments.command == "save":
+        path = store.save(load_report(arguments.file), arguments.revision)
+        print(f"benchmarks: saved the results to {path}")
+        return 0
+
+    if arguments.command == "list":
+        for revision in store.get_revisions():
+            print(f"{revision}: {len(store.load_runs(revision))} run(s)")
+        return 0
+
+    baseline = store.find_revision(arguments.baseline)
+    if baseline is None:
+        print(f"benchmarks: no results of {arguments.baseline} on machine {store.get_fingerprint()}")
+        return 2
+    if arguments.file:
+        current_runs = [load_report(arguments.file)]
+        current = arguments.file
+    else:
+        current = store.find_revision(arguments.current or get_git_revision())
+        if current is None:
+            print(f"benchmarks: no results of {arguments.current or get_git_revision()} "
+                  f"on machine {store.get_fingerprint()}")
+            return 2
+        current_runs = store.load_runs(current)
+
+    comparisons = compare(store.load_runs(baseline), current_runs, arguments.threshold)
+    print(f"comparing {current} with {baseline}, times in ns")
+    print_comparisons(comparisons)
+    regressions = [comparison for comparison in comparisons if comparison.status == Comparison.REGRESSION]
+    if regressions:
+        print(f"benchmarks: {len(regressions)} regression(s)")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""Renders deterministic scenes headless and compares them pixel by pixel with the stored golden frames.
+Frames which differ are saved together with an image of the differences. Exits with 1 if any frame differs.
+Run from the repository root: python -m benchmarks.golden [scene ...] [--update] [--output directory]
+Golden frames depend on the pygame and SDL versions, so they should be updated after upgrading them"""
+from typing import Callable, List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+
+import multiprocessing
+import argparse
+import tempfile
+import random
+import sys
+import os
+
+from .world import ROOT_DIRECTORY, BenchmarkGame, init_pygame
+
+GOLDEN_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+FRAME_SIZE = (640, 360)
+# Updates done before the frame is drawn, with the fixed time step
+WARMUP_FRAMES = 30
+TIME_STEP = 1 / 60
+
+# Each scene is its name and the function which draws it with the game and returns the frame
+SCENES: List[Tuple[str, Callable]] = []
+
+
+def scene(name: str):
+    def register(function: Callable):
+        SCENES.append((name, function))
+        return function
+    return register
+
+
+def draw_level(game: BenchmarkGame, level, frames: int = WARMUP_FRAMES):
+    """Shows the level and updates it for some frames, then draws it the same way the game does"""
+    # Without the budget the same entities think during each frame, however fast the machine is
+    level.get_think_scheduler().set_budget(None)
+    level.prepare(game)
+    level.shown(game)
+    for _ in range(frames):
+        level.update(game, TIME_STEP)
+    game.get_surface().fill(level.get_bg_color())
+    level.draw(game)
+    return game.get_surface()
+
+
+@scene("main_menu")
+def draw_main_menu():
+    from game import MainMenu
+    return draw_level(BenchmarkGame(FRAME_SIZE), MainMenu())
+
+
+@scene("main_level")
+def draw_main_level():
+    from game import MainLevel
+    return draw_level(BenchmarkGame(FRAME_SIZE), MainLevel())
+
+
+@scene("main_level_debug")
+def draw_main_level_debug():
+    from game import MainLevel
+    return draw_level(BenchmarkGame(FRAME_SIZE, debug=True), MainLevel())
+
+
+@scene("entities")
+def draw_entities():
+    """Enemies, a fireball and an explosion next to the player, one of the enemies is blinking"""
+    from engine import Tile
+    from game import MainLevel
+    from game.enemies import RobotEnemy, FlyEnemy
+    from game.weapon import Fireball, Explosion
+    game = BenchmarkGame(FRAME_SIZE)
+    level = MainLevel()
+    level.prepare(game)
+    x, y = level.get_spawn_point()
+
+    robot = RobotEnemy()
+    robot.set_position([x + 3 * Tile.TILE_SIZE, y + Tile.TILE_SIZE])
+    robot.enable_ai = False
+    fly = FlyEnemy()
+    fly.set_position([x - 3 * Tile.TILE_SIZE, y + 2 * Tile.TILE_SIZE])
+    fly.enable_ai = False
+    fly.get_sprite().blink((255, 0, 0))
+    for entity in [robot, fly,
+                   Fireball(level.get_player(), [x + Tile.TILE_SIZE, y + 2 * Tile.TILE_SIZE], (4, 0)),
+                   Explosion(None, [x - 5 * Tile.TILE_SIZE, y + 3 * Tile.TILE_SIZE])]:
+        level.add_entity(entity)
+    # The explosion is drawn in the middle of its animation, and the fly while it's tinted
+    return draw_level(game, level, frames=12)
+
+
+@scene("generated_level")
+def draw_generated_level():
+    """A generated level with the stress scenario, which covers tiles and entities the main level doesn't have"""
+    from game import MainLevel, Scenario
+    from game.level_generator import LevelGenerator
+    filepath = os.path.join(tempfile.mkdtemp(prefix="golden_"), "generated.level")
+    LevelGenerator(96, 48, seed=1, platform_density=0.1, mines=6, coins=6).write(filepath)
+    level = MainLevel()
+    level.set_scenario(Scenario(filepath, robots=4, flies=4, fireballs=4, radius=6, seed=1))
+    return draw_level(BenchmarkGame(FRAME_SIZE), level)
+
+
+def render_scene(name: str) -> Tuple[Tuple[int, int], bytes]:
+    """Renders the scene and returns the size and the RGBA pixels of the frame. Scenes are rendered
+    in separate processes, so the state left by other scenes (caches, shared sprites) can't change them"""
+    os.chdir(ROOT_DIRECTORY)
+    init_pygame()
+    import pygame
+    from engine import misc
+    random.seed(name)
+    misc.FORMAT_CACHE = {}
+    function = dict(SCENES)[name]
+    frame = function()
+    return frame.get_size(), pygame.image.tobytes(frame, "RGBA")
+
+
+def compare_frames(golden, frame) -> int:
+    """Returns the amount of pixels which differ"""
+    import pygame
+    if golden.get_size() != frame.get_size():
+        return frame.get_width() * frame.get_height()
+    golden_pixels = pygame.image.tobytes(golden, "RGBA")
+    frame_pixels = pygame.image.tobytes(frame, "RGBA")
+    if golden_pixels == frame_pixels:
+        return 0
+    try:
+        import numpy
+    except ImportError:
+        return sum(golden_pixels[idx:idx + 4] != frame_pixels[idx:idx + 4] for idx in range(0, len(frame_pixels), 4))
+    difference = numpy.frombuffer(golden_pixels, numpy.uint8) != numpy.frombuffer(frame_pixels, numpy.uint8)
+    return int(difference.reshape(-1, 4).any(axis=1).sum())
+
+
+def make_diff_image(golden, frame):
+    """Returns the golden frame, the rendered frame and the dimmed frame with different pixels in red, side by side"""
+    import pygame
+    width, height = frame.get_size()
+    image = pygame.Surface((width * 3, height), pygame.SRCALPHA)
+    image.blit(golden, (0, 0))
+    image.blit(frame, (width, 0))
+
+    diff = frame.copy()
+    shade = pygame.Surface(frame.get_size(), pygame.SRCALPHA)
+    shade.fill((0, 0, 0, 180))
+    diff.blit(shade, (0, 0))
+    if golden.get_size() == frame.get_size():
+        for y in range(height):
+            for x in range(width):
+                if golden.get_at((x, y)) != frame.get_at((x, y)):
+                    diff.set_at((x, y), (255, 0, 0, 255))
+    image.blit(diff, (width * 2, 0))
+    return image
+
+
+def main(args: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.golden",
+                                     description="Compares rendered scenes with the golden frames")
+    parser.add_argument("names", nargs="*", help="scenes to render, all of them by default")
+    parser.add_argument("--update", action="store_true", help="save the rendered frames as the golden ones")
+    parser.add_argument("--output", default="golden_failures", help="directory for frames which differ")
+    parser.add_argument("--list", action="store_true", help="print names of the scenes and exit")
+    arguments = parser.parse_args(args)
+    names = [name for name, _ in SCENES]
+    if arguments.list:
+        print("\n".join(names))
+        return 0
+    unknown = [name for name in arguments.names if name not in names]
+    if unknown:
+        print(f"golden: unknown scene(s) {', '.join(unknown)}")
+        return 2
+    names = arguments.names or names
+
+    init_pygame()
+    import pygame
+    # Each scene gets a new process, since state left by the previous scene can change the frame
+    with ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn"), max_tasks_per_child=1) as executor:
+        frames = dict(zip(names, executor.map(render_scene, names)))
+
+    failed = 0
+    for name, (size, pixels) in frames.items():
+        frame = pygame.image.frombytes(pixels, size, "RGBA")
+        golden_path = os.path.join(GOLDEN_DIRECTORY, f"{name}.png")
+        if arguments.update:
+            os.makedirs(GOLDEN_DIRECTORY, exist_ok=True)
+            pygame.image.save(frame, golden_path)
+            print(f"{name}: updated")
+            continue
+        if not os.path.isfile(golden_path):
+            print(f"{name}: no golden frame, run with --update to create it")
+            failed += 1
+            continue
+
+        golden = pygame.image.load(golden_path)
+        different = compare_frames(golden, frame)
+        if different == 0:
+            print(f"{name}: ok")
+            continue
+        failed += 1
+        os.makedirs(arguments.output, exist_ok=True)
+        pygame.image.save(frame, os.path.join(arguments.output, f"{name}.png"))
+        pygame.image.save(make_diff_image(golden, frame), os.path.join(arguments.output, f"{name}.diff.png"))
+        print(f"{name}: {different} pixel(s) differ, saved to {arguments.output}")
+
+    if failed:
+        print(f"golden: {failed} of {len(frames)} scene(s) failed")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
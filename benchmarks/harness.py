@@ -0,0 +1,78 @@
+"""Times benchmark functions and keeps their results"""
+from typing import Dict, Any, Callable, List
+
+import statistics
+import time
+
+# Each repeat calls the function until it runs at least this long, so fast operations are measured precisely
+MIN_REPEAT_TIME = 0.05
+MAX_NUMBER = 1 << 20
+
+
+class BenchmarkResult:
+    def __init__(self, name: str, params: Dict[str, Any], operations: int, number: int, times: List[float]):
+        self.name = name
+        self.params = params
+        # Operations done by each call of the function, and calls in each repeat
+        self.operations = operations
+        self.number = number
+        # Time of one operation in seconds, for each repeat
+        self.times = times
+
+    def get_key(self) -> str:
+        """Returns the name with the parameters, which identifies the result between runs"""
+        if not self.params:
+            return self.name
+        return self.name + "[" + ",".join(f"{key}={value}" for key, value in sorted(self.params.items())) + "]"
+
+    def get_min(self) -> float:
+        return min(self.times)
+
+    def get_median(self) -> float:
+        return statistics.median(self.times)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "key": self.get_key(),
+            "params": self.params,
+            "operations": self.operations,
+            "number": self.number,
+            "repeat": len(self.times),
+            "min_ns": self.get_min() * 1e9,
+            "median_ns": self.get_median() * 1e9,
+            "mean_ns": statistics.mean(self.times) * 1e9,
+            "stdev_ns": (statistics.stdev(self.times) if len(self.times) > 1 else 0.0) * 1e9,
+            "times_ns": [value * 1e9 for value in self.times],
+        }
+
+
+def calibrate(function: Callable[[], Any], min_time: float = MIN_REPEAT_TIME) -> int:
+    """Returns how many times the function has to be called to run at least the minimal time"""
+    number = 1
+    while number < MAX_NUMBER:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        if time.perf_counter() - start >= min_time:
+            break
+        number *= 2
+    return number
+
+
+def measure(name: str,
+            function: Callable[[], Any],
+            operations: int = 1,
+            params: Dict[str, Any] | None = None,
+            repeat: int = 5,
+            min_time: float = MIN_REPEAT_TIME) -> BenchmarkResult:
+    """Calls the function in several repeats and returns the time of one operation in each repeat.
+    The calibration run also warms up caches, so the first repeat is not slower than the others"""
+    number = calibrate(function, min_time)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - start) / (number * operations))
+    return BenchmarkResult(name, params or {}, operations, number, times)
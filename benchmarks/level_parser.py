@@ -0,0 +1,136 @@
+"""Compares the vectorized level parser, with and without NumPy, with the character by character loader
+the engine had before it, on a synthetic level.
+Run from the repository root: python -m benchmarks.level_parser [size]"""
+from typing import Dict, List, Tuple
+
+from engine import Tile, Entity, Chunk, WorldObject
+from engine.level_parser import LevelParser
+from engine import level_parser
+
+from .world import make_objects_map, make_level
+
+import time
+import sys
+
+
+def split_by_characters(content: str) -> Dict[str, List[str]]:
+    """Splits the level file into layers of rows, the way the loader did before the vectorized parser"""
+    layers = {}
+    level_data = []
+    current_layer = None
+    content = content.replace("\t", "    ")
+    for line in content.split("\n"):
+        # Remove comments
+        if "#" in line:
+            line = line[0:line.find("#")]
+
+        if line.endswith(":"):
+            if current_layer is not None:
+                layers[current_layer] = level_data
+            level_data = []
+            current_layer = line[:-1]
+            continue
+
+        level_data.append(line)
+    if level_data and current_layer:
+        layers[current_layer] = level_data
+    return layers
+
+
+def parse_by_characters(source: bytes, objects_map: Dict[str, WorldObject], step: Tuple[int, int]):
+    """The text loader as it was before the vectorized parser, without creating chunk surfaces"""
+    chunks = {}
+    entities = []
+    position = [0, 0]
+    for layer_name, layer in split_by_characters(source.decode("utf-8")).items():
+        position = [0, 0]
+        for row in layer:
+            for obj_id in row:
+                if obj_id in ['0', ' ', 'P']:
+                    position[0] += step[0]
+                    continue
+
+                obj = objects_map.get(obj_id)
+                if isinstance(obj, Entity):
+                    entity = obj.__class__()
+                    entity.set_position(position)
+                    entities.append(entity)
+                elif isinstance(obj, Tile):
+                    tile = obj.get_flyweight() if obj.FLYWEIGHT else obj.__class__()
+                    tile_position = (int(position[0]), int(position[1]))
+                    chunk_position = Chunk.local_coords(
+                        (tile_position[0] // Tile.TILE_SIZE, tile_position[1] // Tile.TILE_SIZE))
+                    chunks.setdefault((layer_name, chunk_position), {})[tile_position] = tile
+                position[0] += step[0]
+            position[0] = 0
+            position[1] -= step[1]
+    return chunks, entities
+
+
+def parse_vectorized(source: bytes, objects_map: Dict[str, WorldObject], step: Tuple[int, int]):
+    parser = LevelParser(objects_map, (0, 0), step)
+    compiled_level = parser.parse(source)
+    chunks = {}
+    for layer in compiled_level.layers:
+        for chunk_position, batch in parser.bucket_cells(layer).items():
+            chunks[(layer.name, chunk_position)] = batch
+    return chunks, compiled_level.entities
+
+
+def expand_batches(chunks):
+    """Builds cells of every chunk from the batches, the same way the level does when chunks are added"""
+    return {key: dict(zip(batch.get_positions(), zip(batch.get_object_ids(), batch.get_variants())))
+            for key, batch in chunks.items()}
+
+
+def measure(function, *args, repeat: int = 3) -> Tuple[float, object]:
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    step = (Tile.TILE_SIZE, Tile.TILE_SIZE)
+    objects_map = make_objects_map()
+    source = make_level(size)
+
+    legacy_time, (legacy_chunks, legacy_entities) = measure(parse_by_characters, source, objects_map, step, repeat=1)
+    vectorized_time, (chunks, entities) = measure(parse_vectorized, source, objects_map, step)
+    expand_time, cells = measure(expand_batches, chunks)
+
+    # Without NumPy the cells are bucketed by chunks one by one
+    numpy_module, level_parser.numpy = level_parser.numpy, None
+    try:
+        fallback_time, (fallback_chunks, _) = measure(parse_vectorized, source, objects_map, step)
+        fallback_expand_time, fallback_cells = measure(expand_batches, fallback_chunks)
+    finally:
+        level_parser.numpy = numpy_module
+    assert fallback_cells == cells
+
+    # Both parsers must find the same cells
+    assert len(chunks) == len(legacy_chunks) and len(entities) == len(legacy_entities)
+    assert all(cells[key].keys() == legacy_chunks[key].keys() for key in cells.keys())
+    # The same level with Windows line endings must be parsed the same way
+    crlf_chunks, crlf_entities = parse_vectorized(source.replace(b"\n", b"\r\n"), objects_map, step)
+    assert expand_batches(crlf_chunks) == cells and crlf_entities == entities
+
+    cells_count = sum(len(chunk_cells) for chunk_cells in cells.values())
+    print(f"numpy: {'available' if level_parser.numpy is not None else 'not available'}")
+    print(f"level {size}x{size}: {cells_count} tiles in {len(chunks)} chunks, {len(entities)} entities")
+    print(f"by characters: {legacy_time * 1000:.1f} ms")
+    # The characters parser builds the chunk cells right away, so the vectorized one is compared with them
+    # together with expanding its batches into the cells, which the level does when the chunks are added
+    total_time = vectorized_time + expand_time
+    print(f"vectorized:    {total_time * 1000:.1f} ms (speedup {legacy_time / total_time:.1f}x)")
+    print(f"  parsing:                 {vectorized_time * 1000:.1f} ms")
+    print(f"  expanding chunk batches: {expand_time * 1000:.1f} ms")
+    fallback_total_time = fallback_time + fallback_expand_time
+    print(f"without numpy: {fallback_total_time * 1000:.1f} ms (speedup {legacy_time / fallback_total_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Steps two copies of the same world in lockstep, one with the reference collision path and one with a candidate
+path, and checks that positions, velocities and collisions of all entities are the same after every tick.
+Exits with 1 on the first tick where the worlds differ.
+Run from the repository root: python -m benchmarks.physics_diff [--candidate broadphase] [--ticks 600]"""
+from typing import List, Tuple
+
+import argparse
+import random
+import time
+import sys
+
+from engine import COLLISION_PATH_REFERENCE, COLLISION_PATHS, COLLISION_CHECKS, animation_clock
+from game import MainLevel, Scenario
+from .world import BenchmarkGame, init_pygame
+
+TIME_STEP = 1 / 60
+# Differences printed before the run stops
+MAX_DIFFERENCES = 10
+
+
+class PhysicsWorld:
+    """The main level with the stress scenario, stepped with the fixed time step and the collision log enabled"""
+    def __init__(self, path: str, level_file: str | None, robots: int, flies: int, fireballs: int, seed: int):
+        self._game = BenchmarkGame()
+        self._level = MainLevel()
+        self._level.set_scenario(Scenario(level_file, robots, flies, fireballs, radius=12, maintain=True, seed=seed))
+        self._level.set_collision_path(path)
+        self._log: List[tuple] = []
+        self._level.set_collision_log(self._log)
+        # Entities have to think during the same frames in both worlds
+        self._level.get_think_scheduler().set_budget(None)
+        self._time = 0.0
+        self._checks = 0
+        # Both worlds advance the shared animation clock, so each one keeps its own time of it
+        self._animation_time = 0.0
+
+        self._level.prepare(self._game)
+        self._level.shown(self._game)
+
+    def get_level(self):
+        return self._level
+
+    def get_time(self) -> float:
+        """Returns the time spent in updates of the level"""
+        return self._time
+
+    def get_checks(self) -> int:
+        """Returns the amount of narrow collision checks done during updates of the level"""
+        return self._checks
+
+    def step(self) -> Tuple[List[tuple], List[tuple]]:
+        """Updates the level once. Returns the state of all entities and collisions which happened during the tick"""
+        self._log.clear()
+        checks = COLLISION_CHECKS.value
+        animation_clock.set_time(self._animation_time)
+        start = time.perf_counter()
+        self._level.update(self._game, TIME_STEP)
+        self._time += time.perf_counter() - start
+        self._animation_time = animation_clock.get_time()
+        self._checks += COLLISION_CHECKS.value - checks
+        return get_state(self._level), list(self._log)
+
+
+def get_state(level) -> List[tuple]:
+    return [(entity.__class__.__name__, tuple(entity.get_rect()), tuple(entity.get_velocity()), entity.get_hp(),
+             entity.is_on_ground()) for entity in level.get_entities()]
+
+
+def find_differences(reference: List[tuple], candidate: List[tuple], kind: str) -> List[str]:
+    """Returns descriptions of items which differ. Items are matched by their order"""
+    differences = []
+    if len(reference) != len(candidate):
+        differences.append(f"{kind}: {len(reference)} in the reference world, {len(candidate)} in the candidate one")
+    for idx, (expected, actual) in enumerate(zip(reference, candidate)):
+        if expected != actual:
+            differences.append(f"{kind} {idx}: expected {expected}, got {actual}")
+    return differences
+
+
+def run(candidate_path: str, ticks: int, level_file: str | None, robots: int, flies: int, fireballs: int,
+        seed: int) -> int:
+    # Both worlds must consume the same random numbers, so each one is created and stepped from the same state
+    random.seed(seed)
+    state = random.getstate()
+    reference = PhysicsWorld(COLLISION_PATH_REFERENCE, level_file, robots, flies, fireballs, seed)
+    reference_state = random.getstate()
+    random.setstate(state)
+    candidate = PhysicsWorld(candidate_path, level_file, robots, flies, fireballs, seed)
+    differences = find_differences(get_state(reference.get_level()), get_state(candidate.get_level()), "entity")
+
+    collisions = 0
+    tick = 0
+    while not differences and tick < ticks:
+        tick += 1
+        state = reference_state
+        random.setstate(state)
+        reference_entities, reference_collisions = reference.step()
+        reference_state = random.getstate()
+        random.setstate(state)
+        candidate_entities, candidate_collisions = candidate.step()
+
+        collisions += len(reference_collisions)
+        differences = (find_differences(reference_entities, candidate_entities, "entity") +
+                       find_differences(reference_collisions, candidate_collisions, "collision"))
+        if not differences and random.getstate() != reference_state:
+            differences.append("random numbers: the worlds consumed different amount of them")
+
+    if differences:
+        print(f"physics_diff: {candidate_path} differs from the reference at tick {tick}")
+        for difference in differences[:MAX_DIFFERENCES]:
+            print(f"  {difference}")
+        if len(differences) > MAX_DIFFERENCES:
+            print(f"  ... {len(differences) - MAX_DIFFERENCES} more")
+        return 1
+
+    entities = len(reference.get_level().get_entities())
+    print(f"physics_diff: {candidate_path} matches the reference for {ticks} ticks, "
+          f"{entities} entities, {collisions} collisions")
+    for name, world in ((COLLISION_PATH_REFERENCE, reference), (candidate_path, candidate)):
+        print(f"  {name:12} {world.get_time() / ticks * 1000:8.3f} ms per tick, "
+              f"{world.get_checks() // ticks} collision checks per tick")
+    return 0
+
+
+def main(args: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.physics_diff",
+                                     description="Compares a collision path with the reference one")
+    parser.add_argument("--candidate", choices=COLLISION_PATHS, default=COLLISION_PATHS[-1])
+    parser.add_argument("--ticks", type=int, default=600)
+    parser.add_argument("--level", help="level file to load instead of the main level")
+    parser.add_argument("--robots", type=int, default=20)
+    parser.add_argument("--flies", type=int, default=20)
+    parser.add_argument("--fireballs", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args(args)
+
+    init_pygame()
+    return run(arguments.candidate, arguments.ticks, arguments.level, arguments.robots, arguments.flies,
+               arguments.fireballs, arguments.seed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""Local store of benchmark results. Runs are saved to JSON files keyed by the git revision
+and the fingerprint of the machine, since results of different machines can't be compared"""
+from typing import Dict, Any, List
+
+import subprocess
+import platform
+import hashlib
+import json
+import time
+import os
+
+STORE_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".benchmarks")
+
+
+def get_git_revision() -> str:
+    """Returns the short hash of the checked out commit, with the "-dirty" suffix if the tree has changes"""
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        changes = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                                 text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return revision + "-dirty" if changes else revision
+
+
+def get_machine() -> Dict[str, Any]:
+    return {
+        "system": platform.system(),
+        "release": platform.release(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+    }
+
+
+def get_machine_fingerprint(machine: Dict[str, Any] | None = None) -> str:
+    """Returns the short id of the machine, which is the same as long as its hardware and Python are the same"""
+    machine = machine or get_machine()
+    return hashlib.sha1(json.dumps(machine, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+def from_metrics_summary(summary: Dict[str, Any]) -> Dict[str, Any]:
+    """Converts the summary of a metrics recording (see MetricsRecorder) to a benchmark report,
+    so the frame times of a game run can be stored and compared the same way as benchmarks"""
+    results = []
+    for name in ("frame_ms", "tick_ms"):
+        for percentile, value in summary.get(name, {}).items():
+            results.append({
+                "name": f"game.{name}.p{percentile}",
+                "key": f"game.{name}.p{percentile}",
+                "params": {},
+                "median_ns": value * 1e6,
+                "min_ns": value * 1e6,
+                "times_ns": [value * 1e6],
+            })
+    return {"created": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "params": {"frames": summary.get("frames", 0)},
+            "results": results}
+
+
+def load_report(filepath: str) -> Dict[str, Any]:
+    """Reads the results of a benchmark run, or the summary of a metrics recording"""
+    with open(filepath, "r", encoding="utf-8") as file:
+        report = json.load(file)
+    if "results" not in report and "frame_ms" in report:
+        report = from_metrics_summary(report)
+    return report
+
+
+class ResultStore:
+    def __init__(self, directory: str = STORE_DIRECTORY, fingerprint: str | None = None):
+        self._directory = directory
+        self._fingerprint = fingerprint or get_machine_fingerprint()
+
+    def get_fingerprint(self) -> str:
+        return self._fingerprint
+
+    def get_path(self, revision: str) -> str:
+        return os.path.join(self._directory, self._fingerprint, f"{revision}.json")
+
+    def save(self, report: Dict[str, Any], revision: str | None = None) -> str:
+        """Adds the run to the runs of the revision. Returns the path of the file"""
+        revision = revision or get_git_revision()
+        path = self.get_path(revision)
+        entry = self._read(path) or {"revision": revision, "machine": get_machine(), "runs": []}
+        entry["runs"].append(report)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(entry, file, indent=4)
+        os.replace(path + ".tmp", path)
+        return path
+
+    def get_revisions(self) -> List[str]:
+        """Returns the stored revisions of this machine, from the oldest to the latest one"""
+        directory = os.path.join(self._directory, self._fingerprint)
+        if not os.path.isdir(directory):
+            return []
+        paths = sorted((os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".json")),
+                       key=os.path.getmtime)
+        return [os.path.basename(path)[:-len(".json")] for path in paths]
+
+    def find_revision(self, revision: str) -> str | None:
+        """Returns the stored revision which starts with the provided one"""
+        matches = [stored for stored in self.get_revisions() if stored.startswith(revision)]
+        return matches[-1] if matches else None
+
+    def load_runs(self, revision: str) -> List[Dict[str, Any]]:
+        entry = self._read(self.get_path(revision))
+        return entry["runs"] if entry is not None else []
+
+    @classmethod
+    def _read(cls, path: str) -> Dict[str, Any] | None:
+        if not os.path.isfile(path):
+            return None
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
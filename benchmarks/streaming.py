@@ -0,0 +1,147 @@
+"""Converts a wide level into a region world and streams it while the camera travels across it at the speed
+of the game, showing that the memory and the amount of loaded chunks and entities stay flat, and how often
+the chunks on the screen weren't loaded in time.
+Run from the repository root: python -m benchmarks.streaming [width] [height]"""
+from typing import Dict, List, Tuple
+
+from engine import Tile, Chunk, WorldObject, MetricsRecorder
+from engine.region import RegionWorld, RegionStreamer
+
+from .world import BenchmarkGame, BenchmarkLevel, init_pygame, make_objects_map
+
+import math
+import tempfile
+import random
+import shutil
+import time
+import sys
+import os
+
+# Pixels the camera moves each frame, about the speed of the running player
+CAMERA_SPEED = 64
+# Frames between the reports
+REPORT_FRAMES = 200
+FRAME_TIME = 1 / 60
+
+
+def write_wide_level(filepath: str, width: int, height: int, seed: int = 0):
+    """Writes the level row by row, so the level of any size can be written. The upper half is the air
+    with clouds and flies, the lower half is the ground with robots and mines on the grass"""
+    rng = random.Random(seed)
+    ground = height // 2
+    with open(filepath, "w", encoding="utf-8") as file:
+        file.write("layer0:\n")
+        for y in range(height):
+            if y < ground:
+                row = [" "] * width
+                for x in range(width):
+                    value = rng.random()
+                    if value < 0.01:
+                        row[x] = "O"
+                    elif value < 0.0105:
+                        row[x] = "F"
+                if y == ground - 1:
+                    for x in range(width):
+                        if rng.random() < 0.001:
+                            row[x] = rng.choice("RM")
+                    row[0] = "P"
+            elif y == ground:
+                row = ["G"] * width
+            else:
+                row = ["D"] * width
+            file.write("".join(row) + "\n")
+
+
+def get_visible_chunks(level, center: List[float]) -> List[Tuple[int, int]]:
+    """Returns positions of the chunks on the screen around the center"""
+    width, height = level.get_screen_size()
+    x0, y0 = Chunk.local_coords(((center[0] - width / 2) // Tile.TILE_SIZE, (center[1] - height / 2) // Tile.TILE_SIZE))
+    x1, y1 = Chunk.local_coords(((center[0] + width / 2) // Tile.TILE_SIZE, (center[1] + height / 2) // Tile.TILE_SIZE))
+    return [(x, y) for x in range(int(x0), int(x1) + 1) for y in range(int(y0), int(y1) + 1)]
+
+
+def stream(world: RegionWorld, objects_map: Dict[str, WorldObject], width: int):
+    game = BenchmarkGame()
+    level = BenchmarkLevel()
+    streamer = RegionStreamer(world, objects_map)
+    chunk_size = Tile.TILE_SIZE * Chunk.CHUNK_SIZE
+    # The camera flies along the ground, so both the ground and the air chunks are streamed
+    center = [0.0, float(world.spawn_point[1])]
+    end = width * Tile.TILE_SIZE
+    rng = random.Random(0)
+    # Chunks are read on the worker thread of the streamer, so the chunks which exist are looked up in another instance
+    source_world = RegionWorld(world.get_directory())
+
+    # The chunks around the spawn point are loaded right away, like when the level is loaded
+    streamer.update(level, center, blocking=True)
+
+    frame = 0
+    update_times = []
+    stalled_frames = 0
+    start = time.perf_counter()
+    # Tracing the memory would slow down the updates, so the resident memory of the process is reported
+    print(f"{'frame':>6} {'x':>8} {'chunks':>7} {'entities':>9} {'memory':>9} {'update max':>11}")
+    while center[0] < end:
+        frame_start = time.perf_counter()
+        streamer.update(level, center)
+        update_times.append(time.perf_counter() - frame_start)
+
+        # The frame stalls if a chunk of the world on the screen isn't loaded yet
+        if any(level.get_chunk(position, layer) is None and source_world.read_chunk(layer, position) is not None
+               for layer in world.layers for position in get_visible_chunks(level, center)):
+            stalled_frames += 1
+
+        # Timers and thinks of the unloaded entities are dropped once their time comes, as during the level update
+        level.get_timers().advance(frame * FRAME_TIME)
+        level.get_think_scheduler().update(game, level, frame * FRAME_TIME)
+        # Entities wander off their chunks, also to where there are no chunks
+        for entity in level.get_entities():
+            x, y = entity.get_position()
+            entity.set_position([x + rng.uniform(-1, 1) * chunk_size, y + rng.uniform(-1, 1) * chunk_size])
+
+        if frame % REPORT_FRAMES == 0:
+            chunks_count = sum(len(level.get_chunks(layer)) for layer in world.layers)
+            print(f"{frame:>6} {int(center[0]):>8} {chunks_count:>7} {len(level.get_entities()):>9} "
+                  f"{MetricsRecorder.get_rss():>7.1f}MB "
+                  f"{max(update_times[-REPORT_FRAMES:]) * 1000:>9.2f}ms")
+        center[0] += CAMERA_SPEED
+        frame += 1
+
+        # The worker thread reads the chunks while the game draws the frame
+        time.sleep(max(0.0, FRAME_TIME - (time.perf_counter() - frame_start)))
+    streamer.close()
+    source_world.close()
+
+    update_times.sort()
+    p99 = update_times[max(math.ceil(len(update_times) * 0.99) - 1, 0)]
+    print(f"streamed {frame} frames in {time.perf_counter() - start:.1f}s")
+    print(f"streamer update: max {update_times[-1] * 1000:.2f}ms, p99 {p99 * 1000:.2f}ms")
+    print(f"frames with chunks on the screen not loaded yet: {stalled_frames}")
+
+
+def main():
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    init_pygame()
+    objects_map = make_objects_map()
+
+    directory = tempfile.mkdtemp(prefix="benchmark_")
+    try:
+        filepath = os.path.join(directory, "wide.level")
+        write_wide_level(filepath, width, height)
+        print(f"level {width}x{height}: {os.path.getsize(filepath) / 1024 / 1024:.1f}MB")
+
+        # Converting keeps only the rows of one chunk row in the memory
+        start = time.perf_counter()
+        rss = MetricsRecorder.get_rss()
+        world = RegionWorld.convert_level(filepath, os.path.join(directory, "world"), objects_map)
+        print(f"converted in {time.perf_counter() - start:.1f}s, resident memory {rss:.0f}MB before, "
+              f"{MetricsRecorder.get_rss():.0f}MB after")
+
+        stream(world, objects_map, width)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
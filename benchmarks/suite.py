@@ -0,0 +1,307 @@
+"""Microbenchmarks of the engine hot paths. Each benchmark prepares its data and returns the timed function
+together with the amount of operations done by one call of it"""
+from pgzero.rect import Rect
+from typing import Dict, Any, Callable, List, Tuple
+
+from engine import Tile, Chunk, Entity, Sprite, ParticlesEngine, ParticleEmitter
+from engine import misc
+from game.tiles import DirtTile, GrassTile
+from game.enemies import RobotEnemy
+
+from .harness import BenchmarkResult, measure
+from .world import BenchmarkGame, BenchmarkLevel, init_pygame, write_level
+
+import random
+import shutil
+import os
+
+# Positions which are looked up by each call of the position based benchmarks
+POSITIONS_COUNT = 1024
+# Alive particles during the particles benchmark
+PARTICLE_COUNTS = [500, 4000]
+
+
+class BenchmarkContext:
+    """Parameters of the run and the world shared between benchmarks. The world is created on first use"""
+    def __init__(self, size: int = 256, entities: List[int] | None = None, seed: int = 0):
+        self.size = size
+        self.entities = entities or [50]
+        self.seed = seed
+        self._game: BenchmarkGame | None = None
+        self._level_file: str | None = None
+        self._world: BenchmarkLevel | None = None
+
+    def get_game(self) -> BenchmarkGame:
+        if self._game is None:
+            init_pygame()
+            self._game = BenchmarkGame()
+        return self._game
+
+    def get_level_file(self) -> str:
+        """Returns the generated level file. Entities are not included, benchmarks add them when needed"""
+        if self._level_file is None:
+            self._level_file = write_level(self.size, self.seed, entities=False)
+        return self._level_file
+
+    def get_world(self) -> BenchmarkLevel:
+        """Returns the loaded world, which benchmarks must leave as they found it"""
+        if self._world is None:
+            self._world = self.make_world()
+        return self._world
+
+    def make_world(self) -> BenchmarkLevel:
+        """Loads a new world from the generated level, the compiled level is used after the first load"""
+        level = BenchmarkLevel(self.get_level_file())
+        level.prepare(self.get_game())
+        return level
+
+    def close(self):
+        """Removes the generated level and its compiled level"""
+        if self._level_file is not None:
+            shutil.rmtree(os.path.dirname(self._level_file), ignore_errors=True)
+            self._level_file = None
+
+    def get_rng(self, name: str) -> random.Random:
+        return random.Random(f"{self.seed}_{name}")
+
+    def get_positions(self, name: str, count: int = POSITIONS_COUNT) -> List[Tuple[int, int]]:
+        """Returns random tile positions within the world"""
+        rng = self.get_rng(name)
+        return [(rng.randrange(self.size) * Tile.TILE_SIZE, -rng.randrange(self.size) * Tile.TILE_SIZE)
+                for _ in range(count)]
+
+    def get_cell_positions(self, name: str, type_id: int, count: int) -> List[Tuple[int, int]]:
+        """Returns random positions of flyweight cells of the tile type"""
+        positions = sorted(position for layer in self.get_world().get_layers()
+                           for chunk in self.get_world().get_chunks(layer)
+                           for position, (cell_type_id, _) in chunk.get_cells().items() if cell_type_id == type_id)
+        rng = self.get_rng(name)
+        return rng.sample(positions, min(count, len(positions)))
+
+
+# Each benchmark is its name and the function which receives the context and the parameters.
+# Benchmarks with several parameter sets are run once for each of them
+BENCHMARKS: List[Tuple[str, Callable]] = []
+
+
+def benchmark(name: str):
+    def register(function: Callable):
+        BENCHMARKS.append((name, function))
+        return function
+    return register
+
+
+# Benchmarks which don't depend on the world, so their results don't include its size
+WORLD_INDEPENDENT = ["chunk.local_coords", "sprite.draw", "misc.format_string.cached", "misc.format_string.uncached",
+                     "particles.update_draw"]
+
+
+def get_params(name: str, context: BenchmarkContext) -> List[Dict[str, Any]]:
+    if name == "particles.update_draw":
+        return [{"particles": count} for count in PARTICLE_COUNTS]
+    if name in WORLD_INDEPENDENT:
+        return [{}]
+    if name == "physics.compute_collision":
+        return [{"size": context.size, "entities": count} for count in context.entities]
+    return [{"size": context.size}]
+
+
+@benchmark("level.get_tile")
+def bench_get_tile(context: BenchmarkContext, params: Dict[str, Any]):
+    level = context.get_world()
+    positions = context.get_positions("get_tile")
+
+    def run():
+        for position in positions:
+            level.get_tile(position, "layer0")
+    return run, len(positions)
+
+
+@benchmark("level.set_tile")
+def bench_set_tile(context: BenchmarkContext, params: Dict[str, Any]):
+    level = context.make_world()
+    positions = context.get_positions("set_tile")
+    tiles = [DirtTile.get_flyweight(), GrassTile.get_flyweight()]
+
+    def run():
+        for idx, position in enumerate(positions):
+            level.set_tile(tiles[idx & 1], position, "layer0")
+    return run, len(positions)
+
+
+@benchmark("chunk.local_coords")
+def bench_local_coords(context: BenchmarkContext, params: Dict[str, Any]):
+    positions = [(x // Tile.TILE_SIZE, y // Tile.TILE_SIZE) for x, y in context.get_positions("local_coords")]
+
+    def run():
+        for position in positions:
+            Chunk.local_coords(position)
+    return run, len(positions)
+
+
+@benchmark("physics.compute_collision")
+def bench_compute_collision(context: BenchmarkContext, params: Dict[str, Any]):
+    game = context.get_game()
+    level = context.make_world()
+    rng = context.get_rng("compute_collision")
+
+    # Plain entities are used, so collisions don't trigger any game logic.
+    # They are spread over the middle rows, where the world has both air and ground
+    entities = []
+    for _ in range(params["entities"]):
+        entity = Entity([rng.randrange(context.size) * Tile.TILE_SIZE,
+                         -rng.randrange(context.size // 3, context.size * 2 // 3) * Tile.TILE_SIZE],
+                        [Tile.TILE_SIZE - 4, Tile.TILE_SIZE - 4])
+        entity.set_velocity(rng.uniform(-4, 4), rng.uniform(-8, 8))
+        entities.append(level.add_entity(entity))
+
+    def run():
+        for entity in entities:
+            entity._compute_collision(game, level)
+    return run, len(entities)
+
+
+@benchmark("tile.check_rule")
+def bench_check_rule(context: BenchmarkContext, params: Dict[str, Any]):
+    level = context.get_world()
+    tile = DirtTile.get_flyweight()
+    positions = context.get_cell_positions("check_rule", DirtTile.get_type_id(), 256)
+    rules = list(DirtTile.SPRITE_RULES.values())
+
+    def run():
+        for position in positions:
+            for rule in rules:
+                tile._tile_check_rule(level, rule, position, "layer0")
+    return run, len(positions) * len(rules)
+
+
+@benchmark("tile.update_sprite")
+def bench_update_sprite(context: BenchmarkContext, params: Dict[str, Any]):
+    game = context.get_game()
+    level = context.make_world()
+    positions = context.get_cell_positions("update_sprite", DirtTile.get_type_id(), 256)
+
+    # Tiles with their own instance, which resolve their sprite by themselves
+    tiles = [level.set_tile(DirtTile(), position, "layer0") for position in positions]
+
+    def run():
+        for tile in tiles:
+            tile._update_sprite(game, level)
+    return run, len(tiles)
+
+
+@benchmark("level.load_level.text")
+def bench_load_level_text(context: BenchmarkContext, params: Dict[str, Any]):
+    filepath = context.get_level_file()
+
+    def run():
+        level = BenchmarkLevel()
+        level.load_level(filepath, level.objects_map, step=(Tile.TILE_SIZE, Tile.TILE_SIZE), use_cache=False)
+    return run, 1
+
+
+@benchmark("level.load_level.cached")
+def bench_load_level_cached(context: BenchmarkContext, params: Dict[str, Any]):
+    filepath = context.get_level_file()
+    # Make sure the compiled level exists
+    context.get_world()
+
+    def run():
+        level = BenchmarkLevel()
+        level.load_level(filepath, level.objects_map, step=(Tile.TILE_SIZE, Tile.TILE_SIZE))
+    return run, 1
+
+
+@benchmark("chunk.prerender")
+def bench_prerender(context: BenchmarkContext, params: Dict[str, Any]):
+    game = context.get_game()
+    level = context.get_world()
+    chunk = max(level.get_chunks("layer0"), key=lambda item: (len(item.get_cells()), item.get_position()))
+    surface = game.get_surface()
+
+    def run():
+        chunk.mark_redraw()
+        chunk.draw(game, level, surface)
+    return run, 1
+
+
+@benchmark("sprite.draw")
+def bench_sprite_draw(context: BenchmarkContext, params: Dict[str, Any]):
+    game = context.get_game()
+    sprite: Sprite = RobotEnemy().get_sprite()
+    surface = game.get_surface()
+    rect = Rect(100, 100, Tile.TILE_SIZE, Tile.TILE_SIZE)
+
+    def run():
+        sprite.draw(game, rect, surface)
+    return run, 1
+
+
+@benchmark("misc.format_string.cached")
+def bench_format_string_cached(context: BenchmarkContext, params: Dict[str, Any]):
+    # The cache is filled up to its limit, as it is after the level is loaded
+    misc.FORMAT_CACHE = {}
+    for seed in range(1024):
+        misc.format_string("dirt_all_neighbours%0-1", seed=seed)
+
+    def run():
+        misc.format_string("dirt_all_neighbours%0-1", seed=1)
+    return run, 1
+
+
+@benchmark("misc.format_string.uncached")
+def bench_format_string_uncached(context: BenchmarkContext, params: Dict[str, Any]):
+    seeds = range(100)
+
+    def run():
+        # Every string is formatted again, the cache is reset so it won't grow between calls
+        misc.FORMAT_CACHE = {}
+        for seed in seeds:
+            misc.format_string("dirt_all_neighbours%0-1", seed=seed)
+    return run, len(seeds)
+
+
+@benchmark("particles.update_draw")
+def bench_particles(context: BenchmarkContext, params: Dict[str, Any]):
+    game = context.get_game()
+    level = BenchmarkLevel()
+    engine = ParticlesEngine(capacity=params["particles"])
+    rng = context.get_rng("particles")
+    surface = game.get_surface()
+    width, height = surface.get_size()
+
+    # Particles don't move and live longer than the benchmark, so all of them are drawn by every call
+    emitter = ParticleEmitter([(255, 200, 60), (255, 130, 30), (200, 60, 20)], speed=(0, 0), life=(1e6, 1e6),
+                              gravity=0)
+    for _ in range(params["particles"]):
+        engine.emit(emitter, (rng.uniform(-width / 2, width / 2), rng.uniform(-height / 2, height / 2)), 1)
+    engine.update(level, 0)
+
+    def run():
+        engine.update(level, 1 / 60)
+        engine.draw(game, level, surface)
+    return run, 1
+
+
+def get_benchmark_names() -> List[str]:
+    return [name for name, _ in BENCHMARKS]
+
+
+def run_benchmarks(context: BenchmarkContext,
+                   names: List[str] | None = None,
+                   repeat: int = 5,
+                   on_result: Callable[[BenchmarkResult], None] | None = None) -> List[BenchmarkResult]:
+    """Runs the benchmarks with the names, or all of them if no names are provided"""
+    results = []
+    for name, function in BENCHMARKS:
+        if names is not None and name not in names:
+            continue
+        for params in get_params(name, context):
+            # Entities and tiles pick their seeds randomly, which must be the same for every run
+            random.seed(f"{context.seed}_{name}")
+            run, operations = function(context, params)
+            result = measure(name, run, operations, params, repeat)
+            results.append(result)
+            if on_result is not None:
+                on_result(result)
+    return results
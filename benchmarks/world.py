@@ -0,0 +1,132 @@
+"""Synthetic worlds and a headless game which benchmarks run the engine with"""
+from typing import Dict, Tuple
+
+from engine import Level, WorldObject, FrameProfiler, Tracer
+from game.tiles import DirtTile, GrassTile, GrassBladeTile, CloudTile, MineTile, SmallTreeTile
+from game.enemies import RobotEnemy, FlyEnemy
+
+import tempfile
+import random
+import os
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCREEN_SIZE = (1280, 720)
+
+
+def init_pygame():
+    """Opens a hidden window, since images can't be loaded without the display mode set"""
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    import pygame
+    from pgzero import loaders
+    pygame.init()
+    if pygame.display.get_surface() is None:
+        pygame.display.set_mode(SCREEN_SIZE)
+    loaders.set_root(ROOT_DIRECTORY)
+
+
+class BenchmarkOptions:
+    def __init__(self, debug: bool = False):
+        self._debug = debug
+
+    def is_debug_enabled(self) -> bool:
+        return self._debug
+
+
+class BenchmarkSoundEngine:
+    def play(self, sound, volume: int = None, no_delay: bool = False):
+        pass
+
+
+class BenchmarkGame:
+    """Provides what the engine needs from the game, without the window, sounds and levels switching"""
+    def __init__(self, size: Tuple[int, int] = SCREEN_SIZE, debug: bool = False):
+        import pygame
+        from pgzero.screen import Screen
+        self._size = tuple(size)
+        self._surface = pygame.Surface(self._size, pygame.SRCALPHA)
+        self._screen = Screen(self._surface)
+        self._options = BenchmarkOptions(debug)
+        self._sound_engine = BenchmarkSoundEngine()
+        self._profiler = FrameProfiler()
+        self._tracer = Tracer()
+
+    def get_options(self) -> BenchmarkOptions:
+        return self._options
+
+    def get_sound_engine(self) -> BenchmarkSoundEngine:
+        return self._sound_engine
+
+    def get_profiler(self) -> FrameProfiler:
+        return self._profiler
+
+    def get_tracer(self) -> Tracer:
+        return self._tracer
+
+    def get_surface(self):
+        return self._surface
+
+    def get_screen(self):
+        return self._screen
+
+    def get_size(self) -> Tuple[int, int]:
+        return self._size
+
+    def get_keyboard(self):
+        from pgzero.keyboard import keyboard
+        return keyboard
+
+    def get_fps(self) -> float:
+        return 60
+
+    def exit(self, code: int = 0):
+        raise SystemExit(code)
+
+
+class BenchmarkLevel(Level):
+    def __init__(self, level_source: str | None = None):
+        super().__init__(level_source)
+        self.objects_map = make_objects_map()
+
+
+def make_objects_map() -> Dict[str, WorldObject]:
+    return {
+        "D": DirtTile(),
+        "G": GrassTile(),
+        "B": GrassBladeTile(),
+        "O": CloudTile(),
+        "T": SmallTreeTile(),
+        "M": MineTile(),
+        "R": RobotEnemy(),
+        "F": FlyEnemy(),
+    }
+
+
+def make_level(size: int, seed: int = 0, entities: bool = True) -> bytes:
+    """Generates a square level with mostly air at the top and mostly dirt at the bottom"""
+    rng = random.Random(seed)
+    rows = [b"layer0:"]
+    for y in range(size):
+        fill = y / size
+        row = bytearray(b" " * size)
+        for x in range(size):
+            value = rng.random()
+            if value < fill * 0.9:
+                row[x] = ord("D")
+            elif value < fill * 0.9 + 0.05:
+                row[x] = rng.choice(b"GBOT")
+            elif value > 0.9995:
+                row[x] = rng.choice(b"MRF" if entities else b"M")
+        rows.append(bytes(row))
+    rows[size // 2] = b"P" + rows[size // 2][1:] + b"  # spawn point"
+    return b"\n".join(rows)
+
+
+def write_level(size: int, seed: int = 0, entities: bool = True) -> str:
+    """Writes the generated level to a temporary directory and returns its path"""
+    directory = tempfile.mkdtemp(prefix="benchmark_")
+    filepath = os.path.join(directory, f"level_{size}_{seed}.level")
+    with open(filepath, "wb") as file:
+        file.write(make_level(size, seed, entities))
+    return filepath
+
@@ -2,8 +2,18 @@
 from .level import *
 from .level_objects import *
 from .particles import *
+from .draw_queue import *
+from .viewport import *
+from .timers import *
+from .think import *
 from .animation import *
 from .misc import *
 from .gui import *
 from .chunk import *
 from .sprite import Sprite
+from .profiler import *
+from .tracing import *
+from .hitch import *
+from .counters import *
+from .metrics import *
+from .memory import *
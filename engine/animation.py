@@ -9,14 +9,50 @@ class AnimationPresets(Enum):
     ZOOM: int = 1
 
 
+class AnimationClock:
+    """Shared timeline of all animations. Sprites and animation presets compute their frame or state from its
+    time when they're drawn, so they don't need to be updated, and the same animations stay in lockstep"""
+    def __init__(self):
+        self._time = 0.0
+
+    def advance(self, dt: float):
+        self._time += dt
+
+    def get_time(self) -> float:
+        return self._time
+
+    def set_time(self, time: float):
+        self._time = time
+
+
+# The clock is advanced by the level being updated, so animations stop while it's paused
+animation_clock = AnimationClock()
+# The clock of the gui, which keeps running while the level is paused
+gui_clock = AnimationClock()
+
+
 class AnimationProvider:
-    def __init__(self, preset: AnimationPresets = None, speed: float = 1.2):
+    # Pixels the floating animation moves the rect by at most
+    FLOATING_OFFSET = 10
+
+    def __init__(self,
+                 preset: AnimationPresets = None,
+                 speed: float = 1.2,
+                 clock: AnimationClock | None = None,
+                 phase: float = 0.0):
+        """Without the clock the state is advanced by update calls. With it, the state goes from 0 to 1
+        and back once per 1 / speed seconds of the clock time, shifted by the phase"""
         self._preset = preset
         self._speed = speed
         self._state = 0
         self._direction = 2
+        self._clock = clock
+        self._phase = phase
 
     def get_state(self) -> float:
+        if self._clock is not None:
+            state = (self._clock.get_time() * self._speed * 2 + self._phase) % 2
+            return state if state <= 1 else 2 - state
         return self._state
 
     def set_state(self, state: float):
@@ -24,13 +60,14 @@ class AnimationProvider:
         self._state = max(min(state, 1), 0)
 
     def animate_rect(self, rect: Rect) -> Rect:
+        state = self.get_state()
         match self._preset:
             case AnimationPresets.FLOATING:
-                rect.y += ease_in_out_circ(self._state) * 10
+                rect.y += ease_in_out_circ(state) * AnimationProvider.FLOATING_OFFSET
 
             case AnimationPresets.ZOOM:
-                rect.width *= ease_in_out_circ(self._state)
-                rect.height *= ease_in_out_circ(self._state)
+                rect.width *= ease_in_out_circ(state)
+                rect.height *= ease_in_out_circ(state)
                 rect.x -= rect.width // 2
                 rect.y -= rect.height // 2
 
@@ -1,17 +1,29 @@
 from pgzero.rect import Rect
 from typing import Dict, Tuple, Iterable, List
 
-from .level_objects import Tile
+from .level_objects import Tile, TileCell, MOUSE_EVENTS
 from .misc import Primitives
+from .counters import perf_counters
 
 import pygame
 
+PRERENDERS = perf_counters.register("chunk.prerenders", "Chunk frames rendered again")
+MARK_DIRTY_CALLS = perf_counters.register("chunk.mark_dirty", "Chunk.mark_dirty calls")
+
 
 class Chunk:
     CHUNK_SIZE = 8
 
     def __init__(self, layer: str, x: int, y: int):
         self._tiles: Dict[Tuple[int, int], Tile] = {}
+        # Cells of flyweight tiles. Each one stores only the tile type id and its sprite variant
+        self._cells: Dict[Tuple[int, int], Tuple[int, str | None]] = {}
+        # Positions of both tiles and cells in the order they were placed, which is the order they collide in
+        self._positions: Dict[Tuple[int, int], None] = {}
+        # Tiles which receive each mouse event, found again after tiles change
+        self._mouse_tiles: Dict[str, List[Tile]] | None = None
+        # Tiles which are updated every frame, found again after tiles change
+        self._active_tiles: List[Tile] | None = None
         self._rect: Rect = Rect(x, y, Chunk.CHUNK_SIZE, Chunk.CHUNK_SIZE)
         self._ticks = 0
         self._layer = layer
@@ -20,6 +32,7 @@ class Chunk:
         height = self._rect.height * Tile.TILE_SIZE
         self._is_dirty = True
         self._tiles_dirty = True
+        self._cells_dirty = False
         self._prerendered_frame: pygame.Surface = pygame.Surface(
             (width, height),
             pygame.SRCALPHA
@@ -33,21 +46,107 @@ class Chunk:
     
     def set_tile(self, tile: Tile, position: Tuple[int, int]):
         position = tuple(position)
+        self._cells.pop(position, None)
         if tile:
             self._tiles[position] = tile
+            self._positions[position] = None
         else:
-            self._tiles.pop(position)
+            self._tiles.pop(position, None)
+            self._positions.pop(position, None)
+        self._mouse_tiles = None
+        self._active_tiles = None
 
         # Render the frame again since changes were made to the chunk
         self.mark_dirty()
 
+    def set_cell(self, type_id: int, position: Tuple[int, int], variant: str | None = None):
+        """Places a flyweight tile of the type at the position. If the sprite variant is provided,
+        it's used as is, otherwise it will be resolved during next update"""
+        position = tuple(position)
+        if self._tiles.pop(position, None) is not None:
+            self._mouse_tiles = None
+            self._active_tiles = None
+        self._cells[position] = (type_id, variant)
+        self._positions[position] = None
+        if variant is None:
+            self.mark_dirty()
+        else:
+            self.mark_redraw()
+
+    def set_cells(self, cells: Dict[Tuple[int, int], Tuple[int, str]], resolved: bool = False):
+        """Places many flyweight cells at once, replacing any tiles at their positions.
+        If the sprite variants are not resolved yet, they will be resolved during next update"""
+        if self._tiles:
+            for position in cells.keys():
+                self._tiles.pop(position, None)
+            self._mouse_tiles = None
+            self._active_tiles = None
+        self._cells.update(cells)
+        self._positions.update(dict.fromkeys(cells))
+        if resolved:
+            self.mark_redraw()
+        else:
+            self.mark_dirty()
+
     def get_tile(self, position: Tuple[int, int]) -> Tile | None:
+        """Returns the tile at the position. For flyweight cells a view of the shared tile instance
+        at the cell's position is returned"""
         position = tuple(position)
-        return self._tiles.get(position)
+        if (tile := self._tiles.get(position)) is not None:
+            return tile
+        if (cell := self._cells.get(position)) is not None:
+            return TileCell(Tile.from_type_id(cell[0]), position, cell[1])
+        return None
 
     def get_tiles(self) -> List[Tile]:
+        """Returns all tiles which have their own instance (flyweight cells are not included)"""
         return list(self._tiles.values())
 
+    def get_active_tiles(self) -> List[Tile]:
+        """Returns tiles with their own instance which have per-frame behaviour (see Tile.is_active)"""
+        if self._active_tiles is None:
+            self._active_tiles = [tile for tile in self._tiles.values() if tile.is_active()]
+        return self._active_tiles
+
+    def activate_tile(self, tile: Tile):
+        """Starts updating the tile every frame, if it got per-frame behaviour after it was placed"""
+        if self._active_tiles is not None and tile not in self._active_tiles:
+            self._active_tiles.append(tile)
+
+    def get_prerendered_frame(self) -> pygame.Surface:
+        return self._prerendered_frame
+
+    def get_cells(self) -> Dict[Tuple[int, int], Tuple[int, str | None]]:
+        return self._cells
+
+    def get_positions(self) -> Iterable[Tuple[int, int]]:
+        """Returns the positions of all tiles and cells in the order they were placed"""
+        return self._positions.keys()
+
+    def get_collision_tiles(self) -> Iterable[Tuple[Tile, Rect | None]]:
+        """Yields all tiles in the chunk in the order they were placed, together with their rect,
+        or None if the tile has its own rect"""
+        for position in self._positions:
+            if (cell := self._cells.get(position)) is not None:
+                yield Tile.from_type_id(cell[0]), Rect(position[0], position[1], Tile.TILE_SIZE, Tile.TILE_SIZE)
+            else:
+                yield self._tiles[position], None
+
+    def get_collision_tiles_near(self, area: Rect) -> Iterable[Tuple[Tile, Rect | None]]:
+        """Yields the same tiles as get_collision_tiles and in the same order, but only flyweight cells which
+        intersect the area. Tiles with their own instance are yielded as long as the area intersects the chunk,
+        since their rect can be animated"""
+        size = Chunk.CHUNK_SIZE * Tile.TILE_SIZE
+        if not area.colliderect(Rect(self._rect.x * size, self._rect.y * size, size, size)):
+            return
+        left, right = area.left - Tile.TILE_SIZE, area.right
+        top, bottom = area.top - Tile.TILE_SIZE, area.bottom
+        for position in self._positions:
+            if (cell := self._cells.get(position)) is None:
+                yield self._tiles[position], None
+            elif left < position[0] < right and top < position[1] < bottom:
+                yield Tile.from_type_id(cell[0]), Rect(position[0], position[1], Tile.TILE_SIZE, Tile.TILE_SIZE)
+
     def draw(self, game, level, surface):
         translated_rect = Rect(self._rect)
         translated_rect.x = Chunk.world_coords(translated_rect.x) * Tile.TILE_SIZE
@@ -57,7 +156,18 @@ class Chunk:
         if self._is_dirty:
             # Prerender the frame, so we won't need to always render all tiles.
             # If the chunk contains animated tiles, we'd need to always render it render
+            game.get_tracer().begin("Chunk.prerender")
+            PRERENDERS.value += 1
             self._prerendered_frame.fill((0, 0, 0, 0))
+
+            for position, (type_id, variant) in self._cells.items():
+                tile = Tile.from_type_id(type_id)
+                tile._level = level
+                tile.draw_cell(game, level, self._prerendered_frame, position, variant)
+
+                # If the debug is enabled, render the bounding box of the object
+                if game.get_options().is_debug_enabled():
+                    self._render_tile_bondingbox(tile, self._prerendered_frame)
             
             for tile in self._tiles.values():
                 tile._level = level
@@ -67,6 +177,9 @@ class Chunk:
                 if game.get_options().is_debug_enabled():
                     self._render_tile_bondingbox(tile, self._prerendered_frame)
             self._is_dirty = False
+            tracer = game.get_tracer()
+            tracer.end({"layer": self._layer, "position": self.get_position(),
+                        "tiles": len(self._tiles) + len(self._cells)} if tracer.is_enabled() else None)
         position = level.translate_world_local(translated_rect)
         surface.blit(
             self._prerendered_frame, (position.x, position.y)
@@ -94,35 +207,60 @@ class Chunk:
     def update(self, game, level, dt):
         self._ticks += 1 * dt
 
-        for tile in self.get_tiles():
+        # Only active tiles are updated, inert ones only resolve their sprite again when neighbours change
+        for tile in self.get_active_tiles():
             tile._level = level
             tile.update(game, level, dt)
 
-            if self._tiles_dirty:
+        if self._tiles_dirty:
+            for tile in self.get_tiles():
+                tile._level = level
                 tile.update_tile(game, level)
 
+        # Flyweight cells are never updated, only their sprite variant is resolved again when neighbours change
+        if self._cells_dirty:
+            self.resolve_cells(level)
+
         self._tiles_dirty = False
 
+    def resolve_cells(self, level):
+        """Resolves sprite variants of all flyweight cells based on their neighbours"""
+        for position, (type_id, variant) in self._cells.items():
+            target_variant = Tile.from_type_id(type_id).resolve_sprite(
+                level, position, self._layer, Chunk.cell_seed(position))
+            if target_variant is not None and target_variant != variant:
+                self._cells[position] = (type_id, target_variant)
+                self._is_dirty = True
+        self._cells_dirty = False
+
     def mark_dirty(self):
         """Mark this chunk as a dirty one. The pre-rendered frame will be generated again during next draw call"""
+        MARK_DIRTY_CALLS.value += 1
         self._is_dirty = True
         self._tiles_dirty = True
+        self._cells_dirty = True
 
-    def on_mouse_down(self, game, level, pos, button):
-        for tile in self.get_tiles():
-            tile.on_mouse_down(game, level, pos, button)
+    def is_dirty(self) -> bool:
+        """Returns True if the pre-rendered frame will be generated again during next draw call"""
+        return self._is_dirty
 
-    def on_mouse_up(self, game, level, pos, button):
-        for tile in self.get_tiles():
-            tile.on_mouse_up(game, level, pos, button)
+    def mark_redraw(self):
+        """Only generate the pre-rendered frame again, without updating tiles' sprites"""
+        self._is_dirty = True
 
-    def on_mouse_move(self, game, level, pos):
-        for tile in self.get_tiles():
-            tile.on_mouse_move(game, level, pos)
-    
-    def on_mouse_pressed(self, game, level, pos, button):
-        for tile in self.get_tiles():
-            tile.on_mouse_pressed(game, level, pos, button)
+    def get_mouse_tiles(self, event: str) -> List[Tile]:
+        """Returns tiles with their own instance which receive the mouse event. Flyweight cells don't receive any"""
+        if self._mouse_tiles is None:
+            self._mouse_tiles = {name: [] for name in MOUSE_EVENTS}
+            for tile in self._tiles.values():
+                for name in tile.get_mouse_subscriptions():
+                    self._mouse_tiles[name].append(tile)
+        return self._mouse_tiles[event]
+
+    @classmethod
+    def cell_seed(cls, position: Tuple[int, int]) -> int:
+        """Flyweight cells don't have their own seed, so it's derived from the position"""
+        return hash(tuple(position)) & 0xfffffff
 
     @classmethod
     def local_coords(cls, v) -> Tuple[int, int] | int:
@@ -0,0 +1,117 @@
+from pgzero.rect import Rect
+from typing import Dict, List, Tuple
+from collections import deque
+
+import pygame
+
+
+class PerfCounter:
+    def __init__(self, name: str, description: str = ""):
+        self.name = name
+        self.description = description
+        # Value during the current frame. It's incremented directly in hot paths, so it has to stay a plain attribute
+        self.value = 0
+
+    def add(self, amount: int = 1):
+        self.value += amount
+
+
+class PerfCounters:
+    """Registry of engine-wide counters. Counters are registered once by name and incremented during the frame.
+    At the end of each frame the values are saved to a ring buffer of the last frames and reset"""
+    HISTORY_SIZE = 120
+    # How much of the collision heat is kept each frame
+    HEAT_DECAY = 0.95
+
+    def __init__(self, history_size: int = HISTORY_SIZE):
+        self._counters: Dict[str, PerfCounter] = {}
+        self._totals: Dict[str, int] = {}
+        self._frames: deque[Dict[str, int]] = deque(maxlen=history_size)
+        # Collision checks per chunk position during the current frame, and decayed over the last frames
+        self._collision_checks: Dict[Tuple[int, int], int] = {}
+        self._collision_heat: Dict[Tuple[int, int], float] = {}
+
+    def register(self, name: str, description: str = "") -> PerfCounter:
+        """Returns the counter with the name, creating it if it does not exist yet"""
+        if name not in self._counters:
+            self._counters[name] = PerfCounter(name, description)
+        return self._counters[name]
+
+    def get(self, name: str) -> PerfCounter | None:
+        return self._counters.get(name)
+
+    def get_counters(self) -> List[PerfCounter]:
+        return list(self._counters.values())
+
+    def add_collision_checks(self, chunk_position: Tuple[int, int], count: int):
+        self._collision_checks[chunk_position] = self._collision_checks.get(chunk_position, 0) + count
+
+    def end_frame(self):
+        frame = {}
+        for name, counter in self._counters.items():
+            frame[name] = counter.value
+            self._totals[name] = self._totals.get(name, 0) + counter.value
+            counter.value = 0
+        self._frames.append(frame)
+
+        for position in list(self._collision_heat.keys()):
+            self._collision_heat[position] *= PerfCounters.HEAT_DECAY
+            if self._collision_heat[position] < 1:
+                del self._collision_heat[position]
+        for position, count in self._collision_checks.items():
+            self._collision_heat[position] = self._collision_heat.get(position, 0) + count
+        self._collision_checks = {}
+
+    def get_frames(self) -> List[Dict[str, int]]:
+        return list(self._frames)
+
+    def get_totals(self) -> Dict[str, int]:
+        """Returns values of all counters summed over all finished frames"""
+        return dict(self._totals)
+
+    def get_averages(self) -> Dict[str, float]:
+        """Returns average values per frame over the history"""
+        averages = {name: 0.0 for name in self._counters.keys()}
+        for frame in self._frames:
+            for name, value in frame.items():
+                averages[name] += value
+        count = max(len(self._frames), 1)
+        return {name: value / count for name, value in averages.items()}
+
+    def get_collision_heat(self) -> Dict[Tuple[int, int], float]:
+        return dict(self._collision_heat)
+
+    def draw(self, game, surface: pygame.Surface, rect: Rect):
+        """Draws the values of the last frame and the averages over the history"""
+        last_frame = self._frames[-1] if self._frames else {}
+        averages = self.get_averages()
+        height = min(rect.height, 8 + 12 * len(averages))
+        background = pygame.Surface((rect.width, height), pygame.SRCALPHA)
+        background.fill((0, 0, 0, 160))
+        surface.blit(background, rect.topleft)
+
+        y = rect.y + 4
+        for name in sorted(averages.keys()):
+            if y + 12 > rect.bottom:
+                break
+            game.get_screen().draw.text(f"{name}: {last_frame.get(name, 0)} (avg {averages[name]:.1f})",
+                                        (rect.x + 4, y), fontsize=12, color=(255, 255, 255))
+            y += 12
+
+    def draw_heatmap(self, game, level, surface: pygame.Surface, chunk_size: int):
+        """Tints chunks by the amount of collision checks done with their tiles"""
+        if not self._collision_heat:
+            return
+        hottest = max(self._collision_heat.values())
+        overlay = pygame.Surface((chunk_size, chunk_size), pygame.SRCALPHA)
+        for (x, y), heat in self._collision_heat.items():
+            rect = level.translate_world_local(Rect(x * chunk_size, (y + 1) * chunk_size, chunk_size, chunk_size))
+            if not rect.colliderect(surface.get_rect()):
+                continue
+            overlay.fill((255, 0, 0, round(140 * heat / hottest)))
+            surface.blit(overlay, rect.topleft)
+            game.get_screen().draw.text(f"{heat:.0f}", (rect.x + 4, rect.y + 4), fontsize=12, color=(255, 255, 255))
+
+
+# Counters of the whole engine
+perf_counters = PerfCounters()
@@ -0,0 +1,108 @@
+from pgzero.rect import Rect
+from typing import Callable, Iterable, List, Tuple
+
+from .counters import perf_counters
+
+import pygame
+
+DRAW_COMMANDS = perf_counters.register("draw.commands", "Draw commands submitted to draw queues")
+DRAW_CULLED = perf_counters.register("draw.culled", "Draw commands culled outside of the screen")
+DRAW_CALLS = perf_counters.register("draw.calls", "Blit calls done by draw queues")
+
+
+class DrawQueue:
+    """Collects draw commands during the frame, sorts them by layer once and flushes them with as few calls
+    as possible: consecutive blits are done by a single fblits call. Blits outside of the target are culled.
+    The queue can be drawn to like a surface, so sprites and chunks don't need to know about it"""
+    LAYER_CHUNKS = 0
+    LAYER_ENTITIES = 100
+    LAYER_PARTICLES = 200
+
+    def __init__(self):
+        # Each command is its layer, and either the surface with its destination, or the function and None
+        self._commands: List[Tuple[int, pygame.Surface | Callable, Tuple[int, int] | None]] = []
+        self._layer = 0
+        self._size = (0, 0)
+        self._submitted = 0
+        self._culled = 0
+        self._calls = 0
+
+    def begin(self, size: Tuple[int, int]):
+        """Starts a new frame drawn to a target of the size, dropping commands which weren't flushed"""
+        self._commands.clear()
+        self._size = tuple(size)
+        self._layer = 0
+        self._submitted = 0
+        self._culled = 0
+        self._calls = 0
+
+    def set_layer(self, layer: int):
+        """Sets the layer of commands submitted without one. Commands of higher layers are drawn on top"""
+        self._layer = layer
+
+    def get_layer(self) -> int:
+        return self._layer
+
+    def get_size(self) -> Tuple[int, int]:
+        return self._size
+
+    def get_stats(self) -> Tuple[int, int, int]:
+        """Returns the amount of submitted commands, culled commands and draw calls of the last frame"""
+        return self._submitted, self._culled, self._calls
+
+    def submit(self, surface: pygame.Surface, dest: Tuple[int, int] | Rect, layer: int | None = None):
+        """Blits the surface to the destination during the flush, unless it's outside of the target"""
+        self._submitted += 1
+        x, y = dest[0], dest[1]
+        if x >= self._size[0] or y >= self._size[1] or x + surface.get_width() <= 0 or y + surface.get_height() <= 0:
+            self._culled += 1
+            return
+        self._commands.append((self._layer if layer is None else layer, surface, (x, y)))
+
+    def submit_call(self, function: Callable[[pygame.Surface], None], layer: int | None = None):
+        """Calls the function with the target during the flush, for everything which isn't a plain blit"""
+        self._submitted += 1
+        self._commands.append((self._layer if layer is None else layer, function, None))
+
+    def blit(self, source: pygame.Surface, dest, area: Rect | None = None, special_flags: int = 0):
+        if area is None and not special_flags:
+            self.submit(source, dest)
+        else:
+            self.submit_call(lambda target: target.blit(source, dest, area, special_flags))
+
+    def fblits(self, blits: Iterable[Tuple[pygame.Surface, Tuple[int, int]]]):
+        """Submits many blits at once. They're not culled, since callers of it cull them in bulk"""
+        start = len(self._commands)
+        layer = self._layer
+        self._commands.extend((layer, source, dest) for source, dest in blits)
+        self._submitted += len(self._commands) - start
+
+    def flush(self, target: pygame.Surface):
+        """Draws all commands to the target, from the lowest layer to the highest one.
+        Commands of the same layer are drawn in the order they were submitted"""
+        self._commands.sort(key=lambda command: command[0])
+        batch = []
+        for _, source, dest in self._commands:
+            if dest is not None:
+                batch.append((source, dest))
+                continue
+            if batch:
+                self._blits(target, batch)
+                batch = []
+            source(target)
+            self._calls += 1
+        if batch:
+            self._blits(target, batch)
+        self._commands.clear()
+
+        DRAW_COMMANDS.value += self._submitted
+        DRAW_CULLED.value += self._culled
+        DRAW_CALLS.value += self._calls
+
+    def _blits(self, target: pygame.Surface, batch: List[Tuple[pygame.Surface, Tuple[int, int]]]):
+        # Surface.fblits is only available in pygame-ce
+        if hasattr(target, "fblits"):
+            target.fblits(batch)
+        else:
+            target.blits(batch, doreturn=False)
+        self._calls += 1
@@ -1,8 +1,12 @@
 from pgzero.rect import Rect
 from .sprite import Sprite
+from .animation import gui_clock
+from .counters import perf_counters
 
 from typing import List, Callable, Tuple
 
+TEXT_RENDERS = perf_counters.register("gui.text_renders", "Texts drawn by the gui")
+
 
 class Alignment:
     CENTER: int = 1 << 0
@@ -242,15 +246,11 @@ class Image(GuiElement):
         super().__init__(rect)
         self._sprite = image
         if type(image) is str:
-            self._sprite = Sprite([image])
+            self._sprite = Sprite([image], clock=gui_clock)
     
     def draw(self, game):
         super().draw(game)
         self._sprite.draw(game, self.get_rect(), game.get_surface())
-    
-    def update(self, game, dt):
-        super().update(game, dt)
-        self._sprite.update(game, dt)
 
 
 class ImageButton(GuiElement):
@@ -262,13 +262,13 @@ class ImageButton(GuiElement):
         super().__init__(rect)
         self._icon = image
         if type(image) is str:
-            self._icon = Sprite([image])
+            self._icon = Sprite([image], clock=gui_clock)
         self._click_handler = handler
         self._is_toggle = is_toggle
         self._toggled_state = False
         self._hovered = False
         self._button_state = False
-        self._sprite = Sprite([f"button_small_unpressed"])
+        self._sprite = Sprite([f"button_small_unpressed"], clock=gui_clock)
         
         self._icon.enable_animation(False)
         self._unpressed_icon = None
@@ -305,8 +305,6 @@ class ImageButton(GuiElement):
     
     def update(self, game, dt):
         super().update(game, dt)
-        self._icon.update(game, dt)
-        self._sprite.update(game, dt)
         
         if not self._unpressed_icon and not self._pressed_icon:
             self._unpressed_icon = self._icon.get_image(0)
@@ -356,7 +354,7 @@ class Button(GuiElement):
         self._hovered = False
         self._button_state = False
         self._btn_type = btn_type
-        self._sprite = Sprite([f"button{self._btn_type}_unpressed"])
+        self._sprite = Sprite([f"button{self._btn_type}_unpressed"], clock=gui_clock)
     
     def get_state(self) -> bool:
         return self._toggled_state
@@ -414,7 +412,6 @@ class Button(GuiElement):
     
     def update(self, game, dt):
         super().update(game, dt)
-        self._sprite.update(game, dt)
         self._hovered = False
     
     def on_hover(self, game, pos):
@@ -466,6 +463,7 @@ class Gui:
         if outline:
             outline_width = 2
 
+        TEXT_RENDERS.value += 1
         screen = game.get_screen()
         screen.draw.text(
             text,
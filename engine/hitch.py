@@ -0,0 +1,185 @@
+from typing import Dict, List, Tuple
+
+import cProfile
+import threading
+import json
+import time
+import sys
+import os
+
+
+class HitchDetector:
+    """Profiles every frame and saves the profile of frames which exceed the time budget.
+    In the sampling mode a background thread samples the main thread stack a couple hundred times a second,
+    which costs about 2% of the frame time, so it can be kept armed.
+    In the cprofile mode each frame is profiled with cProfile, which is exact but slows the game down"""
+    MODES = ("sampling", "cprofile")
+    # Minimal time in seconds between two captures, so a slow period won't flood the directory
+    COOLDOWN = 1.0
+    # Seconds between two samples. Walking the stack holds the GIL for about 0.1 ms, and the busy main thread
+    # hands the GIL over only every switch interval (5 ms by default) anyway
+    SAMPLE_INTERVAL = 0.005
+
+    def __init__(self,
+                 directory: str = "hitches",
+                 budget: float = 0.05,
+                 mode: str = "sampling",
+                 max_captures: int = 20):
+        self._directory = directory
+        self._budget = budget
+        self._mode = mode if mode in HitchDetector.MODES else "sampling"
+        self._max_captures = max_captures
+        self._is_enabled = False
+
+        self._frame = 0
+        self._frame_start: float | None = None
+        self._last_capture = 0.0
+        self._dirty_chunks = 0
+        self._chunks = 0
+        self._profile: cProfile.Profile | None = None
+
+        # Stacks sampled during the current frame, shared with the sampling thread
+        self._samples: List[Tuple[str, ...]] = []
+        self._samples_lock = threading.Lock()
+        self._sampler: threading.Thread | None = None
+        self._main_thread_id = threading.main_thread().ident
+
+    def set_enabled(self, state: bool):
+        if state == self._is_enabled:
+            return
+        self._is_enabled = state
+        self._frame_start = None
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile = None
+        if state and self._mode == "sampling":
+            self._sampler = threading.Thread(target=self._sample_loop, name="hitch_sampler", daemon=True)
+            self._sampler.start()
+        elif not state and self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+
+    def is_enabled(self) -> bool:
+        return self._is_enabled
+
+    def set_budget(self, budget: float):
+        """Sets the frame time budget in seconds"""
+        self._budget = budget
+
+    def get_budget(self) -> float:
+        return self._budget
+
+    def begin_frame(self, level=None):
+        self._frame += 1
+        if not self._is_enabled:
+            return
+
+        # Count chunks which are going to be rendered again, it's not known anymore once they are drawn
+        self._dirty_chunks = 0
+        self._chunks = 0
+        if level is not None:
+            for layer in level.get_layers():
+                chunks = level.get_chunks(layer)
+                self._chunks += len(chunks)
+                self._dirty_chunks += sum(1 for chunk in chunks if chunk.is_dirty())
+
+        with self._samples_lock:
+            self._samples = []
+        if self._mode == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        self._frame_start = time.perf_counter()
+
+    def end_frame(self, level=None) -> str | None:
+        """Checks the frame time and saves the capture if the frame exceeded the budget.
+        Returns the directory of the capture, or None if the frame was not captured"""
+        if self._frame_start is None:
+            return None
+        duration = time.perf_counter() - self._frame_start
+        self._frame_start = None
+        if self._profile is not None:
+            self._profile.disable()
+
+        now = time.perf_counter()
+        if duration <= self._budget or now - self._last_capture < HitchDetector.COOLDOWN:
+            return None
+        self._last_capture = now
+        return self._save_capture(duration, level)
+
+    def _save_capture(self, duration: float, level) -> str | None:
+        path = os.path.join(self._directory, time.strftime("hitch_%Y%m%d_%H%M%S") + f"_{self._frame}")
+        info = {
+            "frame": self._frame,
+            "frame_time_ms": duration * 1000,
+            "budget_ms": self._budget * 1000,
+            "mode": self._mode,
+            "level": level.__class__.__name__ if level is not None else None,
+            "entities": 0,
+            "entities_by_class": {},
+            "chunks": self._chunks,
+            "dirty_chunks": self._dirty_chunks,
+            "camera_position": None,
+        }
+        if level is not None:
+            entities_by_class: Dict[str, int] = {}
+            for entity in level.get_entities():
+                name = entity.__class__.__name__
+                entities_by_class[name] = entities_by_class.get(name, 0) + 1
+            info["entities"] = sum(entities_by_class.values())
+            info["entities_by_class"] = entities_by_class
+            info["camera_position"] = list(level.get_camera_position())
+
+        try:
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, "info.json"), "w", encoding="utf-8") as file:
+                json.dump(info, file, indent=4)
+
+            if self._profile is not None:
+                # Can be opened with pstats or snakeviz
+                self._profile.dump_stats(os.path.join(path, "profile.prof"))
+            else:
+                # Collapsed stacks, which can be opened with speedscope or flamegraph.pl
+                with self._samples_lock:
+                    samples = self._samples
+                    self._samples = []
+                stacks: Dict[str, int] = {}
+                for stack in samples:
+                    key = ";".join(stack)
+                    stacks[key] = stacks.get(key, 0) + 1
+                with open(os.path.join(path, "samples.txt"), "w", encoding="utf-8") as file:
+                    for stack, count in sorted(stacks.items(), key=lambda item: -item[1]):
+                        file.write(f"{stack} {count}\n")
+        except OSError as e:
+            print(f"hitch: couldn't save the capture to {path}: {e}")
+            return None
+
+        print(f"hitch: frame {self._frame} took {duration * 1000:.1f} ms, saved to {path}")
+        self._remove_old_captures()
+        return path
+
+    def _remove_old_captures(self):
+        captures = sorted(
+            (os.path.join(self._directory, name) for name in os.listdir(self._directory)
+             if name.startswith("hitch_")),
+            key=os.path.getmtime)
+        for path in captures[:max(len(captures) - self._max_captures, 0)]:
+            for name in os.listdir(path):
+                os.remove(os.path.join(path, name))
+            os.rmdir(path)
+
+    def _sample_loop(self):
+        while self._is_enabled:
+            time.sleep(HitchDetector.SAMPLE_INTERVAL)
+            if self._frame_start is None:
+                continue
+
+            frame = sys._current_frames().get(self._main_thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            del frame
+            stack.reverse()
+            with self._samples_lock:
+                self._samples.append(tuple(stack))
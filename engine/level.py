@@ -1,23 +1,36 @@
-import math
-
 from pgzero.rect import Rect
-from typing import Dict, Tuple, List
+from typing import Dict, Tuple, List, Generator
 from uuid import UUID, uuid4
 
-from .level_objects import WorldObject, Entity, Tile
+from .level_objects import WorldObject, Entity, Tile, COLLISION_PATH_REFERENCE, COLLISION_PATHS, MOUSE_EVENTS
 from .particles import ParticlesEngine
+from .draw_queue import DrawQueue
+from .viewport import Viewport
+from .timers import TimerWheel, Timer
+from .think import ThinkScheduler
 from .misc import Primitives
 from .chunk import Chunk
 from .gui import Gui
-from .animation import AnimationProvider
+from .animation import animation_clock, gui_clock
+from .level_cache import LevelCache, CompiledLevel
+from .level_parser import LevelParser, CellBatch
+from .region import RegionWorld, RegionStreamer
+from .counters import perf_counters
 
 import random
+import time
 import os
 
+GET_TILE_CALLS = perf_counters.register("level.get_tile", "Level.get_tile calls")
+ENTITIES_CREATED = perf_counters.register("level.entities_created", "Entities added to levels")
+ENTITIES_DESTROYED = perf_counters.register("level.entities_destroyed", "Entities removed from levels")
+
 
 class Level:
     def __init__(self, level_source: str | None = None, player: Entity | None = None):
         self._entities: Dict[UUID, Entity] = {}
+        # Entities which receive each mouse event
+        self._mouse_entities: Dict[str, Dict[UUID, Entity]] = {event: {} for event in MOUSE_EVENTS}
         self._chunk_layers: Dict[str, Dict[Tuple[int, int], Chunk]] = {}
         self._bg_color = (0, 0, 0)
         self._screen_size = (800, 600)
@@ -37,8 +50,19 @@ class Level:
         self._level_prepared = False
         self._game = None
         self._level_source_file = level_source
-        self._synchronized_animations = []
         self._is_paused = False
+        self._flyweight_tiles = True
+        self._streamer = None
+        self._preparation = None
+        self._loading_progress = 0
+        self._drawn_chunks_count = (0, 0)
+        self._collision_path = COLLISION_PATH_REFERENCE
+        self._collision_log: List[tuple] | None = None
+        self._draw_queue = DrawQueue()
+        self._viewport = Viewport(self)
+        # Timeouts of the game logic, in the time of the level
+        self._timers = TimerWheel()
+        self._think_scheduler = ThinkScheduler()
         
         self.particles_engine = ParticlesEngine()
         self.objects_map = {}
@@ -49,14 +73,103 @@ class Level:
     
     def toggle_pause(self):
         self._is_paused = not self._is_paused
+
+    def is_prepared(self) -> bool:
+        return self._level_prepared
+
+    def get_loading_progress(self) -> float:
+        """Returns how much of the level preparation is done, from 0 to 1"""
+        return self._loading_progress
+
+    def prepare(self, game, time_budget: float | None = None) -> bool:
+        """Loads the level and updates all its chunks. If the time budget (in seconds) is provided,
+        the preparation is paused once the budget is exceeded, and continues during the next call.
+        Returns True once the level is prepared"""
+        if self._level_prepared:
+            return True
+
+        self._game = game
+        if self._preparation is None:
+            self._preparation = self._prepare_level(game)
+
+        # Each call is a separate span of the trace, since the preparation is split between frames
+        start = time.perf_counter()
+        game.get_tracer().begin("Level.load_level")
+        try:
+            while True:
+                self._loading_progress = next(self._preparation)
+                if time_budget is not None and time.perf_counter() - start > time_budget:
+                    return False
+        except StopIteration:
+            pass
+        finally:
+            tracer = game.get_tracer()
+            tracer.end({"level": self.__class__.__name__, "progress": self._loading_progress}
+                       if tracer.is_enabled() else None)
+
+        self._preparation = None
+        self._level_prepared = True
+        self._loading_progress = 1
+        return True
+
+    def _prepare_level(self, game):
+        # Load the level from the source file and set player to spawn position
+        if self._level_source_file:
+            spawn_point = yield from self._scale_progress(self._load_level_steps(
+                self._level_source_file,
+                self.objects_map,
+                step=(Tile.TILE_SIZE, Tile.TILE_SIZE)
+            ), 0, 0.8)
+
+            if not spawn_point:
+                # We could not load the level file
+                game.exit()
+            self._spawn_point = spawn_point
+
+            if self._player:
+                self._player.set_position(self._spawn_point)
+                self._camera_position = list(self._player.get_position())
+
+        chunks = [chunk for layer in self._chunk_layers.values() for chunk in layer.values()]
+        for idx, chunk in enumerate(chunks):
+            chunk.mark_redraw()
+            chunk.update(game, self, 1)
+            yield 0.8 + 0.2 * (idx + 1) / len(chunks)
+
+    @classmethod
+    def _scale_progress(cls, steps, start: float, end: float):
+        """Maps progress of the steps to the range and returns their result"""
+        try:
+            while True:
+                yield start + (end - start) * next(steps)
+        except StopIteration as e:
+            return e.value
+
+    def set_flyweight_tiles(self, state: bool):
+        """In flyweight mode stateless tiles loaded from the level file share one instance per tile type"""
+        self._flyweight_tiles = state
+
+    def is_flyweight_tiles(self) -> bool:
+        return self._flyweight_tiles
     
-    def synchronize_animation(self, animation: AnimationProvider):
-        self._synchronized_animations.append(animation)
-    
-    def desynchronize_animation(self, animation: AnimationProvider):
-        if animation in self._synchronized_animations:
-            self._synchronized_animations.pop(animation)
-    
+    def set_collision_path(self, path: str):
+        """Sets the way tiles to collide with are found, one of COLLISION_PATHS"""
+        if path not in COLLISION_PATHS:
+            print(f"{self.__class__.__name__}: unknown collision path {path}")
+            return
+        self._collision_path = path
+
+    def get_collision_path(self) -> str:
+        return self._collision_path
+
+    def set_collision_log(self, log: List[tuple] | None):
+        """Sets the list all collisions are appended to, or None to stop recording them.
+        Each collision is its object's class and rect, the other object's class and rect, and the collided sides"""
+        self._collision_log = log
+
+    def get_collision_log(self) -> List[tuple] | None:
+        return self._collision_log
+
     def get_spawn_point(self) -> Tuple[int, int]:
         return tuple(self._spawn_point)
 
@@ -125,12 +238,59 @@ class Level:
         return (self._chunk_layers[layer]
                 .get(Chunk.local_coords((position[0] // Tile.TILE_SIZE, position[1] // Tile.TILE_SIZE))))
 
+    def add_chunk(self, chunk: Chunk) -> Chunk:
+        """Adds already created chunk to the level, replacing the existing one at its position"""
+        self._chunk_layers.setdefault(chunk.get_layer(), {})[chunk.get_position()] = chunk
+        self._viewport.invalidate()
+        return chunk
+
+    def remove_chunk(self, position: Tuple[int, int], layer: str) -> Chunk | None:
+        if layer not in self._chunk_layers:
+            return None
+        chunk = self._chunk_layers[layer].pop(tuple(position), None)
+        if chunk is not None:
+            self._viewport.invalidate()
+        if chunk is not None and chunk == self._last_player_chunk:
+            self._last_player_chunk = None
+        return chunk
+
+    def get_viewport(self) -> Viewport:
+        return self._viewport
+
+    def get_timers(self) -> TimerWheel:
+        return self._timers
+
+    def get_think_scheduler(self) -> ThinkScheduler:
+        return self._think_scheduler
+
+    def schedule(self, delay: float, callback=None, *args) -> Timer:
+        """Calls the callback with the arguments after the delay in seconds of the level time"""
+        return self._timers.schedule(delay, callback, *args)
+
+    def get_draw_queue(self) -> DrawQueue:
+        return self._draw_queue
+
+    def get_particles_engine(self) -> ParticlesEngine:
+        return self.particles_engine
+
+    def get_streamer(self):
+        """Returns the region streamer if the level is loaded from a region world"""
+        return self._streamer
+
+    def get_drawn_chunks_count(self) -> Tuple[int, int]:
+        """Returns the amount of chunks drawn during the last draw call, and how many of them had to be rendered again"""
+        return self._drawn_chunks_count
+
+    def get_layers(self) -> List[str]:
+        return list(self._chunk_layers.keys())
+
     def get_chunks(self, layer: str) -> List[Chunk]:
         if layer not in self._chunk_layers:
             return []
         return list(self._chunk_layers[layer].values())
 
     def get_tile(self, position: Tuple[int, int], layer: str) -> Tile | None:
+        GET_TILE_CALLS.value += 1
         position = tuple(position)
         chunk_position = Chunk.local_coords((position[0] // Tile.TILE_SIZE, position[1] // Tile.TILE_SIZE))
         chunk = self.get_chunk(chunk_position, layer)
@@ -138,10 +298,17 @@ class Level:
             return chunk.get_tile(position)
         return None
 
-    def set_tile(self, tile: Tile | None, position: Tuple[int, int], layer: str) -> Tile | None:
+    def set_tile(self,
+                 tile: Tile | None,
+                 position: Tuple[int, int],
+                 layer: str,
+                 variant: str | None = None) -> Tile | None:
+        """Adds the tile at the position. If the tile is a shared flyweight instance,
+        only its type id and sprite variant (resolved later if not provided) are stored in the chunk"""
         position = tuple(position)
+        is_flyweight = tile is not None and tile.is_flyweight()
 
-        if tile:
+        if tile and not is_flyweight:
             tile.set_position(position)
             tile.set_layer(layer)
             tile._level = self
@@ -154,10 +321,15 @@ class Level:
         if chunk is None:
             chunk = self._generate_chunk(*chunk_position, layer)
         
-        if old_tile := chunk.get_tile(position):
+        if (old_tile := chunk.get_tile(position)) and not old_tile.is_flyweight():
             old_tile.being_destroyed(self._game, self)
 
-        chunk.set_tile(tile, position)
+        if is_flyweight:
+            chunk.set_cell(tile.get_type_id(), position, variant)
+        else:
+            chunk.set_tile(tile, position)
+            if tile:
+                tile.being_added(self._game, self)
         return tile
 
     def capture_entity(self, entity: Entity | None, offset: Tuple[int, int] = (0, 0)) -> Entity:
@@ -168,6 +340,14 @@ class Level:
         self._camera_position = list(entity.get_position())
         return entity
 
+    def get_captured_entity(self) -> Entity | None:
+        """Returns the entity the camera follows"""
+        return self._captured_object
+
+    def get_screen_size(self) -> Tuple[int, int]:
+        """Returns the size of the screen the level was drawn to last"""
+        return self._screen_size
+
     def add_entity(self, entity: Entity) -> Entity:
         """Add the entity to the dictionary and update its private variable"""
         # Check that we don't have this entity on the engine already
@@ -175,10 +355,15 @@ class Level:
             return entity
 
         # Add the entity
+        ENTITIES_CREATED.value += 1
         uuid = uuid4()
         entity._level = self
         entity._uuid = uuid
         self._entities[uuid] = entity
+        for event in entity.get_mouse_subscriptions():
+            self._mouse_entities[event][uuid] = entity
+        self._think_scheduler.add(entity)
+        entity.being_added(self._game, self)
         return entity
 
     def remove_entity(self, key: UUID | Entity) -> None:
@@ -194,6 +379,10 @@ class Level:
             if key in values:
                 key_idx = values.index(key)
                 entity = self._entities.pop(keys[key_idx])
+        for subscribers in self._mouse_entities.values():
+            subscribers.pop(entity.get_uuid(), None)
+        self._think_scheduler.remove(entity)
+        ENTITIES_DESTROYED.value += 1
         entity.being_destroyed(self._game, self)
 
     def get_entity(self, uuid: UUID) -> Entity | None:
@@ -224,70 +413,96 @@ class Level:
     def draw(self, game) -> None:
         surf = game.get_screen().surface
         self._screen_size = game.get_size()
+        self._viewport.update(self.get_camera_position(), self._screen_size)
+        profiler = game.get_profiler()
+
+        # Chunks, entities and particles are submitted to the draw queue, which blits them all at once
+        queue = self._draw_queue
+        queue.begin(surf.get_size())
 
         # Draw all visible chunks on each layer
-        for layer in self._chunk_layers.keys():
-            visible_chunks = self._get_visible_chunks(layer)
+        visible_count, dirty_count = 0, 0
+        for idx, layer in enumerate(self._chunk_layers.keys()):
+            profiler.begin(f"draw.chunks.{layer}")
+            queue.set_layer(DrawQueue.LAYER_CHUNKS + idx)
+            visible_chunks = self._viewport.get_visible_chunks(layer)
             for chunk in visible_chunks:
-                chunk.draw(game, self, surf)
-
-        # Draw entities
-        for entity in self._entities.values():
+                dirty_count += chunk.is_dirty()
+                chunk.draw(game, self, queue)
+            visible_count += len(visible_chunks)
+            profiler.end()
+        self._drawn_chunks_count = (visible_count, dirty_count)
+
+        # Draw entities. Entities outside of the screen are skipped before their sprites are transformed
+        queue.set_layer(DrawQueue.LAYER_ENTITIES)
+        for entity in self._viewport.get_visible_entities(self._entities.values()):
+            profiler.begin("draw.entities")
             entity._level = self
-            entity.draw(game, self, surf)
+            entity.draw(game, self, queue)
 
             # If the debug is enabled, render it on top of the object
             if game.get_options().is_debug_enabled():
-                self._render_entity_bondingbox(game, self, entity, surf)
+                self._render_entity_bondingbox(game, self, entity, queue)
+            profiler.add_entity_time(entity.__class__.__name__, profiler.end())
+
+        with profiler.scope("draw.particles"):
+            queue.set_layer(DrawQueue.LAYER_PARTICLES)
+            self.particles_engine.draw(game, self, queue)
+
+        with profiler.scope("draw.flush"):
+            queue.flush(surf)
 
         # Draw the gui
         if self._gui is not None:
-            self._gui.draw(game, self, surf)
+            with profiler.scope("draw.gui"):
+                self._gui.draw(game, self, surf)
         
     def update(self, game, dt) -> None:
+        profiler = game.get_profiler()
+
+        # The gui is animated by its own clock, so it keeps animating while the level is paused
+        gui_clock.advance(dt)
+
         # Update the gui
         if self._gui is not None:
-            self._gui.update(game, self, dt)
+            with profiler.scope("update.gui"):
+                self._gui.update(game, self, dt)
             
         if self._is_paused:
             return
         
         self._game = game
         
-        for animation in self._synchronized_animations:
-            animation.update(game, dt)
+        # Sprites and animations of all objects compute their state from the shared clock
+        animation_clock.advance(dt)
         
         # Prepare the level if we haven't yet
         if not self._level_prepared:
-            self._level_prepared = True
-            
-            # Load the level from the source file and set player to spawn position
-            if self._level_source_file:
-                self._spawn_point = self.load_level(
-                    self._level_source_file,
-                    self.objects_map,
-                    step=(Tile.TILE_SIZE, Tile.TILE_SIZE)
-                )
-                
-                if not self._spawn_point:
-                    # We could not load the level file
-                    game.exit()
-                
-                if self._player:
-                    self._player.set_position(self._spawn_point)
-                    self._camera_position = list(self._player.get_position())
-            self.update_all_chunks(game)
+            with profiler.scope("update.prepare"):
+                self.prepare(game)
         
+        # Stream chunks of the region world around the camera
+        if self._streamer is not None:
+            with profiler.scope("update.streaming"):
+                self._streamer.update(self)
+
         # Update all chunks which were added to the update list
+        profiler.begin("update.chunk_queue")
         for chunk_position in self._chunks_updates:
             for neighbor_chunks in self._chunk_layers.values():
                 if (chunk := neighbor_chunks.get(chunk_position)) is not None:
                     chunk.update(game, self, dt)
         self._chunks_updates.clear()
+        profiler.end()
         self._ticks += 1 * dt
         self._counter += 1
+
+        # Fire the timers which are due, so timers scheduled during this update start from the current time
+        with profiler.scope("update.timers"):
+            self._timers.advance(self._ticks)
         
         # Update all visible chunks on each layer
+        profiler.begin("update.player_chunks")
         chunk = self.get_player_chunk()
         if chunk:
             if chunk != self._last_player_chunk:
@@ -302,9 +517,11 @@ class Level:
         neighbor_chunks = self.get_neighbors_chunks(chunk)
         for chunk in neighbor_chunks:
             chunk.update(game, self, dt)
+        profiler.end()
 
         # Update camera
         if self._captured_object is not None:
+            profiler.begin("update.camera")
             rect = self._captured_object.get_rect()
             self._camera_position[0] += (rect.x - self._camera_position[0]) * 0.1
             self._camera_position[1] += (rect.y - self._camera_position[1]) * 0.1
@@ -312,11 +529,21 @@ class Level:
             self._shake_value = [
                 random.randint(-1, 1) * self._shake_strength,
                 random.randint(-1, 1) * self._shake_strength]
+            profiler.end()
+
+        # Entities make their decisions before they're updated, only a part of them during each frame
+        with profiler.scope("update.think"):
+            self._think_scheduler.update(game, self, self._ticks)
 
-        # Update entities
+        # Update entities. The time is also attributed to the class of each entity
         for entity in self.get_entities():
+            profiler.begin("update.entities")
             entity._level = self
             entity.update(game, self, dt)
+            profiler.add_entity_time(entity.__class__.__name__, profiler.end())
+
+        with profiler.scope("update.particles"):
+            self.particles_engine.update(self, dt)
 
     def on_mouse_pressed(self, game, pos, button):
         # Send mouse event to the gui
@@ -324,16 +551,7 @@ class Level:
             result = self._gui.on_mouse_pressed(game, self, pos, button)
             if result:
                 return
-        
-        # Send mouse event to all visible chunks on each layer
-        for layer in self._chunk_layers.keys():
-            for chunk in self._get_visible_chunks(layer):
-                chunk.on_mouse_pressed(game, self, pos, button)
-
-        # Send mouse event to entities
-        for entity in self.get_entities():
-            entity._level = self
-            entity.on_mouse_pressed(game, self, pos, button)
+        self._send_mouse_event(game, "on_mouse_pressed", pos, button)
 
     def on_mouse_down(self, game, pos, button):
         # Send mouse event to the gui
@@ -341,16 +559,7 @@ class Level:
             result = self._gui.on_mouse_down(game, self, pos, button)
             if result:
                 return
-        
-        # Send mouse event to all visible chunks on each layer
-        for layer in self._chunk_layers.keys():
-            for chunk in self._get_visible_chunks(layer):
-                chunk.on_mouse_down(game, self, pos, button)
-
-        # Send mouse event to entities
-        for entity in self.get_entities():
-            entity._level = self
-            entity.on_mouse_down(game, self, pos, button)
+        self._send_mouse_event(game, "on_mouse_down", pos, button)
 
     def on_mouse_up(self, game, pos, button):
         # Send mouse event to the gui
@@ -358,132 +567,202 @@ class Level:
             result = self._gui.on_mouse_up(game, self, pos, button)
             if result:
                 return
-        
-        # Send mouse event to all visible chunks on each layer
-        for layer in self._chunk_layers.keys():
-            for chunk in self._get_visible_chunks(layer):
-                chunk.on_mouse_up(game, self, pos, button)
-
-        # Send mouse event to entities
-        for entity in self.get_entities():
-            entity._level = self
-            entity.on_mouse_up(game, self, pos, button)
+        self._send_mouse_event(game, "on_mouse_up", pos, button)
 
     def on_mouse_move(self, game, pos):
-        # Send mouse event to all visible chunks on each layer
-        for layer in self._chunk_layers.keys():
-            for chunk in self._get_visible_chunks(layer):
-                chunk.on_mouse_move(game, self, pos)
-
-        # Send mouse event to entities
-        for entity in self.get_entities():
-            entity._level = self
-            entity.on_mouse_move(game, self, pos)
+        self._send_mouse_event(game, "on_mouse_move", pos)
 
         # Send mouse event to the gui
         if self._gui is not None:
             self._gui.on_mouse_move(game, self, pos)
 
-    def _get_visible_chunks(self, layer: str) -> List[Chunk]:
-        chunks = []
-        cam_x, cam_y = self.get_camera_position()
-        width = Chunk.local_coords(math.ceil(self._screen_size[0] / Tile.TILE_SIZE)) + 2
-        height = Chunk.local_coords(math.ceil(self._screen_size[1] / Tile.TILE_SIZE)) + 4
-        start_x = Chunk.local_coords(cam_x / Tile.TILE_SIZE) - (width // 2)
-        end_x = Chunk.local_coords(cam_x / Tile.TILE_SIZE) + (width // 2)
-        start_y = Chunk.local_coords(cam_y / Tile.TILE_SIZE) - (height // 2)
-        end_y = Chunk.local_coords(cam_y / Tile.TILE_SIZE) + (height // 2)
-
-        # Iterate through all possible chunks coordinates in the screen bounds
-        for x in range(start_x, end_x + 1):
-            for y in range(start_y, end_y + 1):
-                chunk = self.get_chunk((x, y), layer)
-                if chunk is not None:
-                    chunks.append(chunk)
-        return chunks
+    def _send_mouse_event(self, game, event: str, pos, *args):
+        """Sends the mouse event to tiles of the visible chunks and to entities, but only to the ones
+        which receive it (see WorldObject.get_mouse_subscriptions)"""
+        for layer in self._chunk_layers.keys():
+            for chunk in self._viewport.get_visible_chunks(layer):
+                for tile in chunk.get_mouse_tiles(event):
+                    if tile.accepts_mouse(self, pos):
+                        getattr(tile, event)(game, self, pos, *args)
+
+        # Handlers can add or remove entities, so the subscribers are copied
+        for entity in list(self._mouse_entities[event].values()):
+            entity._level = self
+            if entity.accepts_mouse(self, pos):
+                getattr(entity, event)(game, self, pos, *args)
 
     def load_level(self,
                    filepath: str,
                    objects_map: Dict[str, WorldObject],
                    offset: Tuple[int, int] = (0, 0),
-                   step: Tuple[int, int] = (1, 1)) -> Tuple[int, int] | None:
-        """Loads level objects from file using the map. Returns position where player should spawn, or None on error"""
+                   step: Tuple[int, int] = (1, 1),
+                   use_cache: bool = True) -> Tuple[int, int] | None:
+        """Loads level objects from file using the map. Returns position where player should spawn, or None on error.
+        The level is compiled into a binary cache next to the file, which is used instead of parsing the file
+        as long as the file does not change. If the path is a directory, it's opened as a region world,
+        which chunks are streamed around the camera"""
+        steps = self._load_level_steps(filepath, objects_map, offset, step, use_cache)
+        while True:
+            try:
+                next(steps)
+            except StopIteration as e:
+                return e.value
+
+    def _load_level_steps(self,
+                          filepath: str,
+                          objects_map: Dict[str, WorldObject],
+                          offset: Tuple[int, int] = (0, 0),
+                          step: Tuple[int, int] = (1, 1),
+                          use_cache: bool = True) -> Generator[float, None, Tuple[int, int] | None]:
+        """Generator which loads the level step by step, yielding progress from 0 to 1.
+        Returns the same result as load_level"""
+        if os.path.isdir(filepath):
+            return self._load_region_world(filepath, objects_map)
+
         if not os.path.isfile(filepath):
             print(f"{self.__class__.__name__}: level file {filepath} does not exist")
             return None
 
-        # Load the level file
-        layers = {}
-        level_data = []
-        current_layer = None
-        with open(filepath, "r", encoding="utf-8") as file:
-            content = file.read().replace("\t", "    ")
-            for line in content.split("\n"):
-                # Remove comments
-                if "#" in line:
-                    line = line[0:line.find("#")]
-
-                if line.endswith(":"):
-                    if current_layer is not None:
-                        layers[current_layer] = level_data
-                    level_data = []
-                    current_layer = line[:-1]
-                    continue
-
-                level_data.append(line)
-        if level_data and current_layer:
-            layers[current_layer] = level_data
-
-        print(f"{self.__class__.__name__}: loaded {len(layers)} layer(s)")
-
-        # Parse its contents and add all objects according to the map
-        spawn_x, spawn_y = 0, 0
-        for layer_name, layer in layers.items():
-            position = list(offset)
-            for row in layer:
-                for obj_id in row:
-                    if obj_id in ['0', ' ']:
-                        # We got air. Skip it
-                        position[0] += step[0]
-                        continue
-                    elif obj_id == 'P':
-                        # Player spawn
-                        spawn_x = position[0]
-                        spawn_y = position[1]
-                        position[0] += step[0]
-                        continue
-
-                    obj = objects_map.get(obj_id)
-                    if obj is None:
-                        print(f"{self.__class__.__name__}: invalid object '{obj_id}' in level file {filepath}")
-                        return None
-
-                    # Add the object and set its position
-                    if isinstance(obj, Entity):
-                        entity = obj.__class__()
-                        entity.set_position(position)
-                        self.add_entity(entity)
-                    elif isinstance(obj, Tile):
-                        self.set_tile(obj.__class__(), (int(position[0]), int(position[1])), layer=layer_name)
-                    position[0] += step[0]
-                position[0] = offset[0]
-                position[1] -= step[1]
-
-        return (spawn_x, spawn_y)
+        with open(filepath, "rb") as file:
+            source = file.read()
+
+        # Try to load the compiled level first
+        key = LevelCache.compute_key(source, objects_map, offset, step)
+        if use_cache and (compiled_level := LevelCache.read(filepath, key)) is not None:
+            print(f"{self.__class__.__name__}: loaded compiled level {LevelCache.get_cache_path(filepath)}")
+            try:
+                return (yield from self._load_compiled_level(compiled_level, objects_map, offset, step))
+            finally:
+                compiled_level.close()
+
+        parser = LevelParser(objects_map, offset, step)
+        compiled_level = parser.parse(source, filepath)
+        if compiled_level is None:
+            return None
+        print(f"{self.__class__.__name__}: loaded {len(compiled_level.layers)} layer(s)")
+        yield 0.1
+
+        spawn_point = yield from self._scale_progress(
+            self._load_compiled_level(compiled_level, objects_map, offset, step), 0.1, 0.7)
+
+        # Resolve sprites of all tiles, so they can be saved to the compiled level
+        chunks = [chunk for layer in self._chunk_layers.values() for chunk in layer.values()]
+        for idx, chunk in enumerate(chunks):
+            chunk.resolve_cells(self)
+            yield 0.7 + 0.2 * (idx + 1) / len(chunks)
+
+        if use_cache:
+            self._compile_variants(compiled_level, parser)
+            LevelCache.write(filepath, key, compiled_level)
+        yield 1
+        return spawn_point
+
+    def create_tile(self, obj: Tile) -> Tile:
+        """Returns a new tile of the type of the object from the objects map.
+        Stateless tiles share one instance per type in the flyweight mode"""
+        if self._flyweight_tiles and obj.FLYWEIGHT:
+            return obj.get_flyweight()
+        return obj.__class__()
+
+    def _compile_variants(self, compiled_level: CompiledLevel, parser: LevelParser):
+        """Saves resolved sprite variants of the loaded flyweight cells to the compiled level"""
+        strings: Dict[str, int] = {}
+        for layer in compiled_level.layers:
+            for chunk in self._chunk_layers.get(layer.name, {}).values():
+                for position, (_, variant) in chunk.get_cells().items():
+                    x, y = parser.get_cell(position)
+                    if variant is not None and 0 <= x < layer.width and 0 <= y < layer.height:
+                        layer.variants[y * layer.width + x] = strings.setdefault(variant, len(strings))
+        compiled_level.strings = list(strings.keys())
+
+    def _load_region_world(self, directory: str, objects_map: Dict[str, WorldObject]) -> Tuple[int, int] | None:
+        world = RegionWorld(directory)
+        if not world.layers:
+            print(f"{self.__class__.__name__}: region world {directory} is empty")
+            return None
+        print(f"{self.__class__.__name__}: streaming {len(world.layers)} layer(s) from {directory}")
+
+        # Load the chunks around the spawn point right away, all others are streamed in the background
+        if self._streamer is not None:
+            self._streamer.close()
+        self._streamer = RegionStreamer(world, objects_map)
+        self._streamer.update(self, center=world.spawn_point, blocking=True)
+        return world.spawn_point
+
+    def _load_compiled_level(self,
+                             compiled_level: CompiledLevel,
+                             objects_map: Dict[str, WorldObject],
+                             offset: Tuple[int, int],
+                             step: Tuple[int, int]) -> Generator[float, None, Tuple[int, int] | None]:
+        parser = LevelParser(objects_map, offset, step)
+        cell_values = self._get_cell_values(compiled_level.strings, objects_map)
+        for layer_idx, layer in enumerate(compiled_level.layers):
+            buckets = parser.bucket_cells(layer)
+            for chunk_idx, (chunk_position, batch) in enumerate(buckets.items()):
+                self._load_chunk_cells(chunk_position, layer.name, batch, cell_values, objects_map)
+                yield (layer_idx + (chunk_idx + 1) / len(buckets)) / len(compiled_level.layers)
+
+        for obj_id, x, y in compiled_level.entities:
+            entity = objects_map[obj_id].__class__()
+            entity.set_position([x, y])
+            self.add_entity(entity)
+
+        return compiled_level.spawn_point
 
     def update_all_chunks(self, game):
         for layer, chunks in self._chunk_layers.items():
             for chunk in chunks.values():
-                print(f"{self.__class__.__name__}: updating chunk {chunk.get_position()} at layer '{layer}'")
-                chunk.mark_dirty()
+                chunk.mark_redraw()
                 chunk.update(game, self, 1)
 
+    def _get_cell_values(self,
+                         strings: List[str],
+                         objects_map: Dict[str, WorldObject]) -> Dict[Tuple[int, int], Tuple[int, str] | None]:
+        """Returns the chunk cell for every pair of object id and variant index. Pairs of tiles which are not
+        flyweight map to None. Unresolved variants map to the default image of the tile"""
+        cell_values = {}
+        for obj_id, obj in objects_map.items():
+            if not isinstance(obj, Tile):
+                continue
+            tile = self.create_tile(obj)
+            is_flyweight = tile.is_flyweight()
+            cell_values[(ord(obj_id), LevelCache.NO_VARIANT)] = \
+                (tile.get_type_id(), tile.get_default_variant()) if is_flyweight else None
+            for idx, variant in enumerate(strings):
+                cell_values[(ord(obj_id), idx)] = (tile.get_type_id(), variant) if is_flyweight else None
+        return cell_values
+
+    def _load_chunk_cells(self,
+                          chunk_position: Tuple[int, int],
+                          layer: str,
+                          batch: CellBatch,
+                          cell_values: Dict[Tuple[int, int], Tuple[int, str] | None],
+                          objects_map: Dict[str, WorldObject]):
+        """Adds all cells of one chunk at once. Flyweight cells are stored in a batch,
+        the other tiles are created one by one"""
+        chunk = self.get_chunk(chunk_position, layer) or self._generate_chunk(*chunk_position, layer)
+        positions = batch.get_positions()
+        obj_ids = batch.get_object_ids()
+        variants = batch.get_variants()
+        values = [cell_values[key] for key in zip(obj_ids, variants)]
+        if None not in values:
+            chunk.set_cells(dict(zip(positions, values)), resolved=LevelCache.NO_VARIANT not in variants)
+            return
+
+        # Chunks with other tiles are filled one cell at a time, so the tiles collide in the order of the level.
+        # Placing the tiles marks the chunk dirty, which resolves the variants of the cells too
+        for position, obj_id, value in zip(positions, obj_ids, values):
+            if value is None:
+                self.set_tile(self.create_tile(objects_map[chr(obj_id)]), position, layer)
+            else:
+                chunk.set_cell(value[0], position, value[1])
+
     def _generate_chunk(self, x: int, y: int, layer: str) -> Chunk:
-        print(f"{self.__class__.__name__}: generating chunk at {x} {y}")
         chunk = Chunk(layer, x, y)
         if layer not in self._chunk_layers:
             self._chunk_layers[layer] = {}
         self._chunk_layers[layer][(x, y)] = chunk
+        self._viewport.invalidate()
 
         # Update neighbor chunks
         for i in range(-1, 2):
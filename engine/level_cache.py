@@ -0,0 +1,226 @@
+from typing import Dict, List, Tuple
+
+from .level_objects import Tile
+
+import hashlib
+import struct
+import types
+import mmap
+import sys
+import os
+
+
+class CompiledLayer:
+    def __init__(self, name: str, width: int, height: int, tiles, variants):
+        self.name = name
+        self.width = width
+        self.height = height
+        # Object id (character code from the objects map, 0 is air) of each cell, row by row
+        self.tiles = tiles
+        # Index of the resolved sprite variant in the strings table for each cell, or NO_VARIANT
+        self.variants = variants
+
+
+class CompiledLevel:
+    def __init__(self,
+                 spawn_point: Tuple[int, int],
+                 layers: List[CompiledLayer],
+                 strings: List[str],
+                 entities: List[Tuple[str, int, int]],
+                 mapping: mmap.mmap | None = None):
+        self.spawn_point = spawn_point
+        self.layers = layers
+        self.strings = strings
+        self.entities = entities
+        # File the arrays of the layers are mapped from, if the level was read from the cache
+        self._mapping = mapping
+        self._data = memoryview(mapping) if mapping is not None else None
+
+    def get_data(self) -> memoryview | None:
+        """Returns the content of the file the level is read from"""
+        return self._data
+
+    def close(self):
+        """Closes the file the level was read from. The arrays of the layers can't be used afterwards"""
+        if self._mapping is None:
+            return
+        layers, self.layers = self.layers, []
+        try:
+            for layer in layers:
+                if isinstance(layer.tiles, memoryview):
+                    layer.tiles.release()
+                if isinstance(layer.variants, memoryview):
+                    layer.variants.release()
+            self._data.release()
+            self._mapping.close()
+        except BufferError:
+            # Something still uses the arrays, so the file is closed once they're garbage collected
+            pass
+        self._mapping = None
+        self._data = None
+
+
+class LevelCache:
+    """Binary cache of compiled level files. The compiled file is saved next to the source file
+    and is used only if the content hash stored in its header matches the source"""
+    MAGIC = b"LVLC"
+    VERSION = 2
+    NO_VARIANT = 0xffff
+    EXTENSION = ".cache"
+
+    # Magic, version, key, spawn point, amount of strings, layers and entities
+    _HEADER = struct.Struct("<4sH20siiHHI")
+    _LAYER = struct.Struct("<II")
+    _ENTITY = struct.Struct("<Bii")
+
+    @classmethod
+    def get_cache_path(cls, filepath: str) -> str:
+        return filepath + cls.EXTENSION
+
+    @classmethod
+    def compute_key(cls, source: bytes, objects_map: Dict, offset: Tuple[int, int], step: Tuple[int, int]) -> bytes:
+        """Hash of everything the compiled level depends on, including the rules and the code
+        which resolved the sprite variants of the tiles"""
+        key = hashlib.sha1(source)
+        key.update(repr((cls.VERSION, tuple(offset), tuple(step))).encode("utf-8"))
+        for obj_id in sorted(objects_map.keys()):
+            obj = objects_map[obj_id]
+            key.update(f"{obj_id}={obj.__class__.__name__};".encode("utf-8"))
+            if isinstance(obj, Tile):
+                connects_with = sorted(cls.__name__ for cls in obj._connects_with)
+                key.update(repr((list(obj.SPRITE_RULES.items()), connects_with)).encode("utf-8"))
+                for method in (obj.__class__.resolve_sprite, obj.__class__._tile_check_rule):
+                    cls._hash_code(key, method.__code__)
+        return key.digest()
+
+    @classmethod
+    def _hash_code(cls, key, code: types.CodeType):
+        # Nested functions are constants of the code, and their repr contains the address, so they're hashed instead
+        key.update(code.co_code)
+        for const in code.co_consts:
+            if isinstance(const, types.CodeType):
+                cls._hash_code(key, const)
+            else:
+                key.update(repr(const).encode("utf-8"))
+
+    @classmethod
+    def read(cls, filepath: str, key: bytes) -> CompiledLevel | None:
+        """Reads the compiled level of the source file. Returns None if there's no valid cache for the key,
+        or if the cache is corrupt. The returned level has to be closed once it's loaded"""
+        path = cls.get_cache_path(filepath)
+        if not os.path.isfile(path) or os.path.getsize(path) < cls._HEADER.size:
+            return None
+
+        # Arrays are mapped directly from the file, which is stored in little-endian
+        if sys.byteorder != "little":
+            return None
+
+        try:
+            with open(path, "rb") as file:
+                mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            print(f"level_cache: couldn't read the cache file {path}: {e}")
+            return None
+
+        level = CompiledLevel((0, 0), [], [], [], mapping)
+        try:
+            if cls._read_level(level.get_data(), key, level):
+                return level
+        except (struct.error, ValueError) as e:
+            # UnicodeDecodeError is a ValueError too
+            print(f"level_cache: ignoring the corrupt cache file {path}: {e}")
+        level.close()
+        return None
+
+    @classmethod
+    def _read_level(cls, data: memoryview, key: bytes, level: CompiledLevel) -> bool:
+        # Fills the level from the data. Returns False if the cache is for another key or version
+        magic, version, cache_key, spawn_x, spawn_y, strings_count, layers_count, entities_count = \
+            cls._HEADER.unpack_from(data, 0)
+        if magic != cls.MAGIC or version != cls.VERSION or cache_key != key:
+            return False
+
+        offset = cls._HEADER.size
+        strings = []
+        for _ in range(strings_count):
+            string, offset = cls._read_string(data, offset)
+            strings.append(string)
+
+        for _ in range(layers_count):
+            name, offset = cls._read_string(data, offset)
+            width, height = cls._LAYER.unpack_from(data, offset)
+            offset += cls._LAYER.size
+            size = width * height
+            cls._check_size(data, offset + size)
+            tiles = data[offset:offset + size]
+            offset += size
+            # The variants array is aligned to 2 bytes, so it can be used directly from the mapped file
+            offset += offset % 2
+            cls._check_size(data, offset + size * 2)
+            variants = data[offset:offset + size * 2].cast("H")
+            offset += size * 2
+            # Layers are added right away, so they're released together with the file if a later one is corrupt
+            level.layers.append(CompiledLayer(name, width, height, tiles, variants))
+
+        entities = []
+        for _ in range(entities_count):
+            obj_id, x, y = cls._ENTITY.unpack_from(data, offset)
+            offset += cls._ENTITY.size
+            entities.append((chr(obj_id), x, y))
+
+        level.spawn_point = (spawn_x, spawn_y)
+        level.strings = strings
+        level.entities = entities
+        return True
+
+    @classmethod
+    def write(cls, filepath: str, key: bytes, level: CompiledLevel) -> bool:
+        """Saves the compiled level next to the source file. Returns False if the cache could not be written"""
+        data = bytearray(cls._HEADER.pack(
+            cls.MAGIC, cls.VERSION, key,
+            int(level.spawn_point[0]), int(level.spawn_point[1]),
+            len(level.strings), len(level.layers), len(level.entities)))
+
+        for string in level.strings:
+            cls._write_string(data, string)
+
+        for layer in level.layers:
+            cls._write_string(data, layer.name)
+            data += cls._LAYER.pack(layer.width, layer.height)
+            data += bytes(layer.tiles)
+            if len(data) % 2:
+                data += b"\0"
+            data += struct.pack(f"<{len(layer.variants)}H", *layer.variants)
+
+        for obj_id, x, y in level.entities:
+            data += cls._ENTITY.pack(ord(obj_id), int(x), int(y))
+
+        # Write to a temporary file first, so a partially written cache would never be read
+        path = cls.get_cache_path(filepath)
+        try:
+            with open(path + ".tmp", "wb") as file:
+                file.write(data)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"level_cache: couldn't write the cache file {path}: {e}")
+            return False
+        return True
+
+    @classmethod
+    def _read_string(cls, data: memoryview, offset: int) -> Tuple[str, int]:
+        length, = struct.unpack_from("<H", data, offset)
+        offset += 2
+        cls._check_size(data, offset + length)
+        return bytes(data[offset:offset + length]).decode("utf-8"), offset + length
+
+    @classmethod
+    def _check_size(cls, data: memoryview, size: int):
+        # Slices of memoryviews are silently cut at the end, so a truncated file has to be noticed before
+        if size > len(data):
+            raise ValueError(f"the file is truncated, {size} bytes expected but it has {len(data)}")
+
+    @classmethod
+    def _write_string(cls, data: bytearray, string: str):
+        encoded = string.encode("utf-8")
+        data += struct.pack("<H", len(encoded))
+        data += encoded
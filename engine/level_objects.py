@@ -1,15 +1,37 @@
-from typing import List, Tuple
+from typing import List, Tuple, Dict, Iterable, FrozenSet
 from uuid import UUID
 
 from .animation import *
 from .misc import Direction, Primitives, format_string, direction_position
 from .sprite import Sprite
+from .particles import ParticleEmitter
+from .counters import perf_counters
+from .timers import Timer
 
 import math
 import random
 
+COLLISION_CHECKS = perf_counters.register("physics.collision_checks", "PhysObject._collision_check calls")
+
+# Ways of finding tiles an object can collide with. The reference path checks every tile of the chunks around
+# the object, the broadphase path only tiles near the area the object moves through. Both must give the same
+# results, which is verified by python -m benchmarks.physics_diff
+COLLISION_PATH_REFERENCE = "reference"
+COLLISION_PATH_BROADPHASE = "broadphase"
+COLLISION_PATHS = (COLLISION_PATH_REFERENCE, COLLISION_PATH_BROADPHASE)
+
+# Mouse events which level objects can receive, by the names of their handlers
+MOUSE_EVENTS = ("on_mouse_pressed", "on_mouse_down", "on_mouse_up", "on_mouse_move")
+# Mouse events received by objects of each class, found once per class
+_MOUSE_SUBSCRIPTIONS: Dict[type, FrozenSet[str]] = {}
+
 
 class WorldObject:
+    # Mouse events the objects receive even if they don't override the handlers of them
+    MOUSE_SUBSCRIPTIONS: Tuple[str, ...] = ()
+    # If True, mouse events are only sent to the objects while the cursor is over them
+    MOUSE_UNDER_CURSOR = False
+
     def __init__(self, position: List[float], size: List[float]):
         self._rect = Rect(*position, *size)
         self.seed = random.randint(0, 0xfffffff)
@@ -19,6 +41,8 @@ class WorldObject:
 
         self._level = None
         self._game = None
+        # Timers scheduled by the object, cancelled once it's removed from the level
+        self._timers: List[Timer] = []
 
     def distance(self, obj):
         pos0 = self.get_position()
@@ -41,7 +65,20 @@ class WorldObject:
         self._rect.x = position[0]
         self._rect.y = position[1]
 
-    def being_destroyed(self, game, level): ...
+    def schedule(self, delay: float, callback=None, *args) -> Timer:
+        """Schedules the callback on the level's timers. Without the callback the timer works as a cooldown,
+        which is over once it fires. The object must be added to a level"""
+        self._timers = [timer for timer in self._timers if timer.is_pending()]
+        timer = self._level.schedule(delay, callback, *args)
+        self._timers.append(timer)
+        return timer
+
+    def being_added(self, game, level): ...
+
+    def being_destroyed(self, game, level):
+        for timer in self._timers:
+            timer.cancel()
+        self._timers = []
 
     def draw(self, game, level, surface): ...
 
@@ -58,6 +95,21 @@ class WorldObject:
             else:
                 level.set_tile(None, self.get_position(), "layer0")
 
+    @classmethod
+    def get_mouse_subscriptions(cls) -> FrozenSet[str]:
+        """Returns mouse events the objects of the class receive: the ones whose handlers the class overrides,
+        and the ones in MOUSE_SUBSCRIPTIONS. Levels only send mouse events to the objects which receive them"""
+        if (events := _MOUSE_SUBSCRIPTIONS.get(cls)) is None:
+            events = frozenset(event for event in MOUSE_EVENTS
+                               if getattr(cls, event) is not getattr(WorldObject, event)
+                               or event in cls.MOUSE_SUBSCRIPTIONS)
+            _MOUSE_SUBSCRIPTIONS[cls] = events
+        return events
+
+    def accepts_mouse(self, level, pos: Tuple[int, int]) -> bool:
+        """Returns True if the mouse event at the screen position should be sent to the object"""
+        return not self.MOUSE_UNDER_CURSOR or level.translate_world_local(self._rect).collidepoint(pos)
+
     def on_mouse_pressed(self, game, level, pos, button): ...
 
     def on_mouse_down(self, game, level, pos, button): ...
@@ -81,7 +133,6 @@ class PhysObject(WorldObject):
         self._bounding_box = Rect(0, 0, *size)
         self._x_vel_multiplier = 0.8
         self._animations = {}
-        self._animations_to_synchronize = []
 
         self.is_static = static
         self.has_collision = True
@@ -103,19 +154,11 @@ class PhysObject(WorldObject):
             return
 
         if preset not in self._animations:
-            self._animations[preset] = AnimationProvider(preset, speed=speed)
-            self._animations_to_synchronize.append(self._animations[preset])
+            self._animations[preset] = AnimationProvider(preset, speed=speed, clock=animation_clock)
 
     def remove_animation_preset(self, preset: AnimationPresets):
         """Removes the animation preset from the object"""
-        if preset in self._animations:
-            animation = self._animations.pop(preset)
-            self._level.desynchronize_animation(animation)
-
-    def being_destroyed(self, game, level):
-        super().being_destroyed(game, level)
-        for animation in self._animations:
-            level.desynchronize_animation(animation)
+        self._animations.pop(preset, None)
 
     def set_bounding_box(self, bounding_box: Rect):
         self._bounding_box = bounding_box
@@ -134,12 +177,6 @@ class PhysObject(WorldObject):
     def get_bounding_box(self) -> Rect:
         return self._bounding_box
 
-    def update(self, game, level, dt):
-        super().update(game, level, dt)
-        for animation in self._animations_to_synchronize:
-            self._level.synchronize_animation(animation)
-        self._animations_to_synchronize = []
-
     def update_physics(self, game, level):
         # Add gravity to the velocity
         gravity = level.get_gravity()
@@ -150,7 +187,9 @@ class PhysObject(WorldObject):
 
         # Check the collision with other objects
         if not self.is_static:
+            game.get_profiler().begin("update.collision")
             delta = self._compute_collision(game, level)
+            game.get_profiler().end()
             self._rect.x += delta[0]
             self._rect.y += delta[1]
 
@@ -179,14 +218,17 @@ class PhysObject(WorldObject):
             if chunk is None:
                 continue
 
-            for tile in chunk.get_tiles():
-                delta, result = self._collision_check(game, tile, delta)
+            checks = 0
+            for tile, rect in self._get_collision_tiles(level, chunk, delta):
+                checks += 1
+                delta, result = self._collision_check(game, tile, delta, rect=rect)
                 if result[1]:
                     self._on_ground = True
                 if result[0] or result[1]:
                     self._velocity[1] = 0
                 if result[2] or result[3]:
                     self._velocity[0] = 0
+            perf_counters.add_collision_checks(chunk.get_position(), checks)
 
         # Collide with entities
         for entity in level.get_entities():
@@ -200,13 +242,37 @@ class PhysObject(WorldObject):
 
         return delta
 
+    def _get_collision_tiles(self, level, chunk, delta) -> Iterable[Tuple["Tile", Rect | None]]:
+        """Returns tiles of the chunk to check the collision with, found by the collision path of the level"""
+        if level.get_collision_path() == COLLISION_PATH_REFERENCE:
+            return chunk.get_collision_tiles()
+        rect = Rect(self._bounding_box.x + self._rect.x, self._bounding_box.y + self._rect.y,
+                    self._bounding_box.width, self._bounding_box.height)
+        area = rect.union(rect.move(int(delta[0]), int(delta[1])))
+        # The margin covers objects which are pushed out of a tile further than they move
+        return chunk.get_collision_tiles_near(area.inflate(Tile.TILE_SIZE * 2, Tile.TILE_SIZE * 2))
+
     def on_collision(self, game, obj, top, bottom, right, left): ...
 
-    def _collision_check(self, game, obj, delta, trigger: bool = False) -> Tuple[List[float], Tuple[bool, bool, bool, bool]]:
-        """Checks collision with an object.
+    def _notify_collision(self, game, obj, other_rect: Rect, top: bool, bottom: bool, left: bool, right: bool):
+        """Calls on_collision of both objects. If the level keeps the collision log, the collision is added to it"""
+        if self._level is not None and (log := self._level.get_collision_log()) is not None:
+            log.append((self.__class__.__name__, tuple(self._rect), obj.__class__.__name__, tuple(other_rect),
+                        (top, bottom, left, right)))
+        self.on_collision(game, obj, top, bottom, left, right)
+        obj.on_collision(game, self, top, bottom, left, right)
+
+    def _collision_check(self,
+                         game,
+                         obj,
+                         delta,
+                         trigger: bool = False,
+                         rect: Rect = None) -> Tuple[List[float], Tuple[bool, bool, bool, bool]]:
+        """Checks collision with an object. The rect of the object can be overridden, which is used for flyweight tiles.
         Returns tuple with the new delta and collided sides TOP, BOTTOM, LEFT, RIGHT"""
+        COLLISION_CHECKS.value += 1
         top, bottom, left, right = False, False, False, False
-        other_rect: Rect = obj.get_rect()
+        other_rect: Rect = obj.get_rect() if rect is None else rect
         rect: Rect = Rect(
             self._bounding_box.x + self._rect.x,
             self._bounding_box.y + self._rect.y,
@@ -233,11 +299,9 @@ class PhysObject(WorldObject):
                         top = True
                         delta[1] = round(other_rect.top - rect.bottom)
                 if top or bottom or left or right:
-                    self.on_collision(game, obj, top, bottom, left, right)
-                    obj.on_collision(game, self, top, bottom, left, right)
+                    self._notify_collision(game, obj, other_rect, top, bottom, left, right)
             elif other_rect.colliderect(rect):
-                self.on_collision(game, obj, True, True, True, True)
-                obj.on_collision(game, self, True, True, True, True)
+                self._notify_collision(game, obj, other_rect, True, True, True, True)
         return delta, (top, bottom, left, right)
 
 
@@ -245,18 +309,85 @@ class Tile(PhysObject):
     SPRITE_RULES = {}
     TILE_SIZE = 54
 
+    # Tiles which have no per-instance state besides their position and sprite variant
+    # can be shared between all cells of the same type (see Tile.get_flyweight)
+    FLYWEIGHT = False
+    # Tiles which need to be updated every frame even if they don't override update and aren't animated
+    ACTIVE = False
+    _FLYWEIGHTS: List["Tile"] = []
+    _FLYWEIGHT_IDS: Dict[type, int] = {}
+
     def __init__(self, sprite: Sprite = None):
         super(Tile, self).__init__([0, 0], [Tile.TILE_SIZE, Tile.TILE_SIZE])
         self._connects_with = []
         self._sprite = sprite
+        # Image the sprite of the shared flyweight instance was created with (see get_default_variant)
+        self._default_variant: str | None = None
         self._layer = ""
+        # Frame of the sprite the chunk's frame was rendered with
+        self._frame = 0
+
+    @classmethod
+    def get_flyweight(cls) -> "Tile":
+        """Returns the instance shared between all cells of this tile type"""
+        if cls not in Tile._FLYWEIGHT_IDS:
+            Tile._FLYWEIGHT_IDS[cls] = len(Tile._FLYWEIGHTS)
+            tile = cls()
+            tile._default_variant = tile.get_default_variant()
+            Tile._FLYWEIGHTS.append(tile)
+        return Tile._FLYWEIGHTS[Tile._FLYWEIGHT_IDS[cls]]
+
+    @classmethod
+    def get_type_id(cls) -> int:
+        """Returns the id of this tile type, which is stored in chunk cells instead of the tile object"""
+        cls.get_flyweight()
+        return Tile._FLYWEIGHT_IDS[cls]
+
+    @classmethod
+    def from_type_id(cls, type_id: int) -> "Tile":
+        return Tile._FLYWEIGHTS[type_id]
+
+    def is_flyweight(self) -> bool:
+        return self.FLYWEIGHT and Tile._FLYWEIGHT_IDS.get(self.__class__) is not None \
+            and Tile._FLYWEIGHTS[Tile._FLYWEIGHT_IDS[self.__class__]] is self
     
     def set_layer(self, layer: str):
         self._layer = layer
 
+    def is_active(self) -> bool:
+        """Returns True if the tile has per-frame behaviour: it overrides update, is animated, has a sprite
+        with several frames or is being removed. Chunks only update active tiles, the inert ones cost nothing"""
+        if self.ACTIVE or self._should_be_removed or self._animations:
+            return True
+        if type(self).update is not Tile.update:
+            return True
+        return self._sprite is not None and len(self._sprite.get_images()) > 1
+
+    def destroy(self):
+        super().destroy()
+        self._activate()
+
+    def set_animation_preset(self, preset: AnimationPresets, speed: float = 1.2):
+        super().set_animation_preset(preset, speed)
+        self._activate()
+
+    def _activate(self):
+        # The tile got per-frame behaviour after it was placed, so its chunk has to start updating it
+        if self._level is not None and not self.is_flyweight():
+            chunk = self._level.get_chunk_tile_position(self.get_position(), layer=self._layer)
+            if chunk is not None:
+                chunk.activate_tile(self)
+
     def get_sprite(self):
         return self._sprite
 
+    def get_default_variant(self) -> str | None:
+        """Returns the image the tile's sprite was created with. The sprite of the shared flyweight instance
+        shows the variant of the cell drawn last, so its image is remembered when the instance is created"""
+        if self._default_variant is not None:
+            return self._default_variant
+        return self._sprite.get_image(0) if self._sprite is not None else None
+
     def draw_chunk(self, game, level, surface):
         from engine import Chunk
         # Translate current tile's world position to local chunk's surface position.
@@ -272,17 +403,25 @@ class Tile(PhysObject):
         else:
             self._sprite.draw(game, rect, surface)
 
+    def draw_cell(self, game, level, surface, position: Tuple[int, int], variant: str | None):
+        """Draws the shared flyweight tile at the cell's position using the cell's sprite variant"""
+        self.set_position(position)
+        variant = variant or self._default_variant
+        if self._sprite is not None and variant:
+            self._sprite._initialize()
+            self._sprite.set_image(0, variant)
+        self.draw_chunk(game, level, surface)
+
     def update(self, game, level, dt):
         super().update(game, level, dt)
         self.update_physics(game, level)
 
-        # If we have any animations, we need to always re-render chunk's frame
-        if any(self._animations):
-            level.get_chunk_tile_position(self.get_position(), layer=self._layer).mark_dirty()
-
-        # Update the sprite
-        if self._sprite is not None:
-            self._sprite.update(game, dt)
+        # If we have any animations or the frame of the sprite changed, we need to re-render chunk's frame.
+        # Sprites of the tiles don't change, so they aren't resolved again
+        frame = self._sprite.get_frame() if self._sprite is not None else 0
+        if any(self._animations) or frame != self._frame:
+            self._frame = frame
+            level.get_chunk_tile_position(self.get_position(), layer=self._layer).mark_redraw()
 
     def update_tile(self, game, level):
         # Update tile's sprite
@@ -292,24 +431,29 @@ class Tile(PhysObject):
         return self._rect.x // Tile.TILE_SIZE, self._rect.y // Tile.TILE_SIZE
 
     def _update_sprite(self, game, level):
-        target_sprite = None
-
-        # Set different sprite textures for the tile based on its neighbours.
-        for sprite, rule in self.SPRITE_RULES.items():
-            # If the provided rule can be applied to this tile, set the sprite as the target one
-            if self._tile_check_rule(level, rule):
-                target_sprite = sprite
-                break
+        tracer = game.get_tracer()
+        tracer.begin("Tile._update_sprite")
+        target_sprite = self.resolve_sprite(level, self.get_position(), self._layer, self.seed)
+        # The arguments are only built while recording, since sprites are updated for every tile
+        tracer.end({"tile": self.__class__.__name__} if tracer.is_enabled() else None)
 
         # Update the sprite if we found appropriate one
         if target_sprite is not None:
-            target_sprite = format_string(target_sprite, seed=self.seed)
             if self._sprite.get_image(0) != target_sprite:
                 # Mark the chunk dirty, so we can notice the change of the sprite
                 level.get_chunk_tile_position(self.get_position(), layer=self._layer).mark_dirty()
                 self._sprite.set_image(0, target_sprite)
 
-    def _tile_check_rule(self, level, rule) -> bool:
+    def resolve_sprite(self, level, position: Tuple[int, int], layer: str, seed: int) -> str | None:
+        """Returns the sprite variant for a tile of this type at the position, or None if no rule applies"""
+        # Set different sprite textures for the tile based on its neighbours.
+        for sprite, rule in self.SPRITE_RULES.items():
+            # If the provided rule can be applied to this tile, set the sprite as the target one
+            if self._tile_check_rule(level, rule, position, layer):
+                return format_string(sprite, seed=seed)
+        return None
+
+    def _tile_check_rule(self, level, rule, position: Tuple[int, int] = None, layer: str = None) -> bool:
         # The rule should have this form, where 0 means there
         # must be object of a different type, A means there must be a tile of the same type,
         # C means where our tile is located in the rule:
@@ -318,7 +462,8 @@ class Tile(PhysObject):
         #   0A0
         is_relative = lambda x, y: x and x.__class__ == y.__class__ or \
             (x and y.__class__ in x._connects_with or x.__class__ in y._connects_with)
-        x, y = self.get_position()
+        x, y = position if position is not None else self.get_position()
+        layer = layer if layer is not None else self._layer
 
         # Find the C locating in the rule
         x_offset, y_offset = 0, 0
@@ -343,10 +488,10 @@ class Tile(PhysObject):
                     continue
 
                 position = (x + (x_offset - center_x) * Tile.TILE_SIZE, y + (y_offset - center_y) * Tile.TILE_SIZE)
-                tile = level.get_tile(position, self._layer)
+                tile = level.get_tile(position, layer)
                 if (char == '0' and is_relative(tile, self)) or (char == 'A' and not is_relative(tile, self)):
                     collision_static = True if tile is None else tile.has_collision and tile.is_static
-                    if tile != self and collision_static:
+                    if collision_static:
                         # The tile didn't apply to the rule
                         return False
                 x_offset += 1
@@ -356,7 +501,55 @@ class Tile(PhysObject):
         return True
 
 
+class TileCell:
+    """Flyweight cell returned by the level instead of the shared tile instance, whose position is the one
+    of the cell drawn last. Everything besides the position and the sprite variant is taken from the tile"""
+    __slots__ = ("_tile", "_position", "_variant")
+
+    def __init__(self, tile: Tile, position: Tuple[int, int], variant: str | None):
+        self._tile = tile
+        self._position = position
+        self._variant = variant
+
+    @property
+    def __class__(self):
+        # The cell passes for the tile in type checks, e.g. when autotiling compares neighbours
+        return self._tile.__class__
+
+    def __getattr__(self, name: str):
+        return getattr(self._tile, name)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, TileCell) and self._tile is other._tile and self._position == other._position
+
+    def __hash__(self) -> int:
+        return hash((id(self._tile), self._position))
+
+    def get_tile(self) -> Tile:
+        """Returns the shared tile instance"""
+        return self._tile
+
+    def get_position(self) -> Tuple[int, int]:
+        return self._position
+
+    def get_position_tile(self) -> Tuple[int, int]:
+        return self._position[0] // Tile.TILE_SIZE, self._position[1] // Tile.TILE_SIZE
+
+    def get_rect(self) -> Rect:
+        return Rect(self._position[0], self._position[1], Tile.TILE_SIZE, Tile.TILE_SIZE)
+
+    def get_variant(self) -> str | None:
+        """Returns the sprite variant of the cell, or the default one if it's not resolved yet"""
+        return self._variant or self._tile.get_default_variant()
+
+
 class Entity(PhysObject):
+    # Particles emitted when the entity is hit, away from the entity which hit it
+    HIT_PARTICLES = ParticleEmitter([(230, 50, 50), (170, 30, 30)], speed=(80, 220), life=(0.2, 0.45), size=(3, 5),
+                                    spread=120)
+    # Times per second the entity decides and thinks. Costly decisions are made there instead of every frame
+    THINK_RATE = 0
+
     def __init__(self,
                  position: List[float],
                  size: List[float],
@@ -372,6 +565,25 @@ class Entity(PhysObject):
         self.hp = 4
         self.max_hp = 4
 
+    def capture_state(self):
+        """Returns the state of the entity the snapshot keeps for deciding (see EntityState),
+        or None if the position and hp are enough"""
+        return None
+
+    def get_think_tiles(self, snapshot) -> Iterable[Tuple[int, int]]:
+        """Returns positions of the tiles the entity looks at while deciding, captured in the snapshot.
+        Only the states already in the snapshot are looked at, the tiles aren't there yet"""
+        return ()
+
+    def decide(self, snapshot):
+        """Returns the decision of the entity, made only from the snapshot and its state there.
+        The entity itself is not looked at, and nothing can be changed here"""
+        return None
+
+    def think(self, game, level, decision):
+        """Applies the decision. Unlike deciding, thinking can change the entity and the level"""
+        ...
+
     def direction(self, entity, strength: int = 1) -> Tuple[int, int]:
         pos0 = self.get_position()
         pos1 = entity.get_position()
@@ -408,6 +620,9 @@ class Entity(PhysObject):
         self.hp = min(max(self.hp, 0), self.max_hp)
         direction = self.direction(entity)
         self.add_velocity(direction[0] * 2 * -1, direction[1] * 2 * -1)
+        rect = self.get_rect()
+        self._level.get_particles_engine().emit(self.HIT_PARTICLES, (rect.centerx, rect.y - rect.height // 2), 12,
+                                                (-direction[0], -direction[1]))
         
         # Play hit sound
         sounds = ['hit0', 'hit1', 'hit2']
@@ -464,7 +679,7 @@ class Entity(PhysObject):
 
         # Render the entity as a rectangle if no sprite is set
         if self._sprite is None:
-            game.get_screen().draw.rect(rect, (255, 255, 255))
+            Primitives.rect(surface, rect, (255, 255, 255))
         else:
             self._sprite.draw(game, rect, surface, direction=self._direction)
 
@@ -474,10 +689,6 @@ class Entity(PhysObject):
         self._delta = [0, 0]
         self.hp = min(max(self.hp, 0), self.max_hp)
 
-        # Update the sprite
-        if self._sprite is not None:
-            self._sprite.update(game, dt)
-
     def _compute_collision(self, game, level) -> List[float]:
         """Computes the delta that needs to be added to the position based on collisions with all objects"""
         self._on_ground = False
@@ -506,12 +717,15 @@ class Entity(PhysObject):
             if chunk is None:
                 continue
 
-            for tile in chunk.get_tiles():
-                delta, result = self._collision_check(game, tile, delta)
+            checks = 0
+            for tile, rect in self._get_collision_tiles(level, chunk, delta):
+                checks += 1
+                delta, result = self._collision_check(game, tile, delta, rect=rect)
                 if result[1]:
                     self._on_ground = True
                 if result[0] or result[1]:
                     self._velocity[1] = 0
+            perf_counters.add_collision_checks(chunk.get_position(), checks)
 
         # Collide with entities
         for entity in level.get_entities():
@@ -0,0 +1,209 @@
+from typing import Dict, List, Tuple
+
+from .level_objects import WorldObject, Entity, Tile
+from .level_cache import LevelCache, CompiledLevel, CompiledLayer
+from .chunk import Chunk
+
+from array import array
+
+# NumPy is optional. Without it the tiles are still mapped with bytes.translate,
+# but cells are bucketed into chunks one by one
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class LevelParser:
+    """Parses text level files into compiled levels. Each layer is read as bytes and characters are mapped
+    to object ids with a 256 entry lookup table, instead of walking the file character by character"""
+    AIR = b"0 "
+    SPAWN = b"P"
+
+    def __init__(self,
+                 objects_map: Dict[str, WorldObject],
+                 offset: Tuple[int, int] = (0, 0),
+                 step: Tuple[int, int] = (1, 1)):
+        self._objects_map = objects_map
+        self._offset = offset
+        self._step = step
+
+        # Character code of tiles, 0 for air, entities and the spawn point
+        self._tiles_table = bytearray(256)
+        # Non-zero for every character which is not a tile
+        self._others_table = bytearray(256)
+        # Non-zero for characters not in the objects map
+        self._invalid_table = bytearray(b"\1" * 256)
+        for char in self.AIR + self.SPAWN:
+            self._invalid_table[char] = 0
+        self._others_table[self.SPAWN[0]] = 1
+
+        self._unsupported = [obj_id for obj_id in objects_map.keys() if len(obj_id) != 1 or ord(obj_id) > 0x7f]
+        for obj_id, obj in objects_map.items():
+            if obj_id in self._unsupported:
+                continue
+            self._invalid_table[ord(obj_id)] = 0
+            if isinstance(obj, Tile):
+                self._tiles_table[ord(obj_id)] = ord(obj_id)
+            elif isinstance(obj, Entity):
+                self._others_table[ord(obj_id)] = 1
+
+    def parse(self, source: bytes, filepath: str = "") -> CompiledLevel | None:
+        """Parses the level source. Sprite variants of the returned level are not resolved.
+        Returns None if the level contains invalid objects"""
+        if self._unsupported:
+            print(f"level_parser: object ids {self._unsupported} are not ASCII characters")
+            return None
+
+        spawn_point = (0, 0)
+        layers = []
+        entities = []
+        for layer_name, rows in self.split_layers(source).items():
+            width = max((len(row) for row in rows), default=0)
+            grid = b"".join(row.ljust(width, b" ") for row in rows)
+
+            # Any invalid character fails the whole level
+            invalid = grid.translate(self._invalid_table)
+            if (idx := invalid.find(b"\1")) != -1:
+                obj_id = grid[idx:idx + 4].decode("utf-8", errors="replace")[0]
+                print(f"level_parser: invalid object '{obj_id}' in level file {filepath}")
+                return None
+
+            # Entities and the spawn point are rare, so they are located separately
+            others = grid.translate(self._others_table)
+            idx = others.find(b"\1")
+            while idx != -1:
+                y, x = divmod(idx, width)
+                position = self.get_position(x, y)
+                if grid[idx] == self.SPAWN[0]:
+                    spawn_point = position
+                else:
+                    entities.append((chr(grid[idx]), *position))
+                idx = others.find(b"\1", idx + 1)
+
+            tiles = bytearray(grid.translate(self._tiles_table))
+            variants = array("H", [LevelCache.NO_VARIANT]) * len(tiles)
+            layers.append(CompiledLayer(layer_name, width, len(rows), tiles, variants))
+
+        return CompiledLevel(spawn_point, layers, [], entities)
+
+    def get_position(self, x: int, y: int) -> Tuple[int, int]:
+        """Converts cell coordinates in the layer grid to the world position"""
+        return int(self._offset[0] + x * self._step[0]), int(self._offset[1] - y * self._step[1])
+
+    def get_cell(self, position: Tuple[int, int]) -> Tuple[int, int]:
+        """Converts the world position to cell coordinates in the layer grid"""
+        return (int((position[0] - self._offset[0]) // self._step[0]),
+                int((self._offset[1] - position[1]) // self._step[1]))
+
+    def bucket_cells(self, layer: CompiledLayer) -> Dict[Tuple[int, int], "CellBatch"]:
+        """Groups non-empty cells of the layer by chunks"""
+        if not layer.width:
+            return {}
+        if numpy is not None:
+            return self._bucket_cells_numpy(layer)
+
+        chunks = {}
+        for idx, obj_id in enumerate(layer.tiles):
+            if not obj_id:
+                continue
+            y, x = divmod(idx, layer.width)
+            position = self.get_position(x, y)
+            chunk_position = Chunk.local_coords((position[0] // Tile.TILE_SIZE, position[1] // Tile.TILE_SIZE))
+            batch = chunks.setdefault(chunk_position, CellBatch([], [], [], []))
+            batch.add(position, obj_id, layer.variants[idx])
+        return chunks
+
+    def _bucket_cells_numpy(self, layer: CompiledLayer) -> Dict[Tuple[int, int], "CellBatch"]:
+        tiles = numpy.frombuffer(layer.tiles, dtype=numpy.uint8)
+        y, x = numpy.nonzero(tiles.reshape(layer.height, layer.width))
+        if not len(x):
+            return {}
+        position_x = (self._offset[0] + x * self._step[0]).astype(numpy.int64)
+        position_y = (self._offset[1] - y * self._step[1]).astype(numpy.int64)
+        chunk_x = position_x // (Tile.TILE_SIZE * Chunk.CHUNK_SIZE)
+        chunk_y = position_y // (Tile.TILE_SIZE * Chunk.CHUNK_SIZE)
+
+        # Sort cells by their chunk and split them where the chunk changes. Chunks are numbered row by row,
+        # numbers that fit into 16 bits are sorted with a radix sort, which is much faster
+        min_x, min_y = chunk_x.min(), chunk_y.min()
+        columns = int(chunk_x.max() - min_x) + 1
+        keys = (chunk_y - min_y) * columns + (chunk_x - min_x)
+        if keys.max() <= 0xffff:
+            keys = keys.astype(numpy.uint16)
+        order = numpy.argsort(keys, kind="stable")
+        keys = keys[order]
+        indices = y[order] * layer.width + x[order]
+
+        bounds = numpy.flatnonzero(keys[1:] != keys[:-1]) + 1
+        starts = [0] + bounds.tolist()
+        ends = bounds.tolist() + [len(indices)]
+        chunk_positions = zip(chunk_x[order[starts]].tolist(), chunk_y[order[starts]].tolist())
+        arrays = (position_x[order], position_y[order],
+                  tiles[indices], numpy.frombuffer(layer.variants, dtype=numpy.uint16)[indices])
+        return {chunk_position: CellBatch(*arrays, start, end)
+                for chunk_position, start, end in zip(chunk_positions, starts, ends)}
+
+    @classmethod
+    def split_layers(cls, source: bytes) -> Dict[str, List[bytes]]:
+        """Splits the level source into layers of rows, with comments removed"""
+        layers = {}
+        rows = []
+        current_layer = None
+        for line in source.replace(b"\t", b"    ").split(b"\n"):
+            # Files with Windows line endings are read as bytes, so the carriage return is left on each line
+            line = line.rstrip(b"\r")
+
+            # Remove comments
+            if (idx := line.find(b"#")) != -1:
+                line = line[:idx]
+
+            if line.endswith(b":"):
+                if current_layer is not None:
+                    layers[current_layer] = rows
+                rows = []
+                current_layer = line[:-1].decode("utf-8")
+                continue
+
+            rows.append(line)
+        if rows and current_layer:
+            layers[current_layer] = rows
+        return layers
+
+
+class CellBatch:
+    """Cells of one chunk, stored as a range of parallel sequences of positions, object ids and variant indices.
+    The sequences may be NumPy arrays shared by all chunks of the layer, which are converted only when the chunk is loaded"""
+
+    def __init__(self, x, y, obj_ids, variants, start: int = 0, end: int | None = None):
+        self._x = x
+        self._y = y
+        self._obj_ids = obj_ids
+        self._variants = variants
+        self._start = start
+        self._end = end
+
+    def add(self, position: Tuple[int, int], obj_id: int, variant: int):
+        self._x.append(position[0])
+        self._y.append(position[1])
+        self._obj_ids.append(obj_id)
+        self._variants.append(variant)
+
+    def get_positions(self) -> List[Tuple[int, int]]:
+        return list(zip(self._to_list(self._x), self._to_list(self._y)))
+
+    def get_object_ids(self) -> List[int]:
+        return self._to_list(self._obj_ids)
+
+    def get_variants(self) -> List[int]:
+        return self._to_list(self._variants)
+
+    def __len__(self):
+        return len(self._obj_ids[self._start:self._end])
+
+    def __iter__(self):
+        return zip(self.get_positions(), self.get_object_ids(), self.get_variants())
+
+    def _to_list(self, values) -> List[int]:
+        values = values[self._start:self._end]
+        return values if isinstance(values, list) else values.tolist()
@@ -0,0 +1,216 @@
+from pgzero.rect import Rect
+from pgzero import loaders
+from typing import Dict, Any, List
+
+import tracemalloc
+import pygame
+import json
+import time
+import sys
+import os
+
+from . import misc
+from .sprite import SPRITES
+from .metrics import MetricsRecorder
+
+# Python files of the repository are attributed to their subsystem, the rest to their library
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class MemoryTracker:
+    """Builds memory reports broken down by subsystem. Surfaces are accounted by their pixel bytes,
+    and if tracing is started, Python allocations are grouped by the module which made them.
+    Allocations are compared with the first report, so memory which keeps growing during a session can be found"""
+    # Taking the tracemalloc snapshot is slow, so the overlay reuses the report for a while
+    REPORT_INTERVAL = 2.0
+    TOP_ALLOCATIONS = 10
+
+    def __init__(self):
+        self._baseline: Dict[str, int] | None = None
+        self._report: Dict[str, Any] | None = None
+        self._report_time = 0.0
+
+    def start_tracing(self):
+        """Starts tracing Python allocations. It slows the game down, so it's only done on demand"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._baseline = None
+
+    def stop_tracing(self):
+        tracemalloc.stop()
+        self._baseline = None
+
+    def is_tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def get_report(self, levels: Dict[str, Any]) -> Dict[str, Any]:
+        """Returns the memory report of the levels, which are keyed by their names"""
+        chunk_count, chunk_bytes = 0, 0
+        level_reports = {}
+        for name, level in levels.items():
+            level_report = self._get_level_report(level)
+            chunk_count += level_report["chunks"]
+            chunk_bytes += level_report["prerender_bytes"]
+            level_reports[name] = level_report
+
+        # Images are shared between sprites through the loader cache, so each surface is counted once
+        images = {id(surface): surface for surface in loaders.images.cache.values()}
+        actors = 0
+        sprites = list(SPRITES)
+        for sprite in sprites:
+            for actor in sprite.get_actors():
+                images[id(actor._surf)] = actor._surf
+                actors += 1
+
+        format_cache = misc.FORMAT_CACHE
+        report = {
+            "time": time.time(),
+            "rss_mb": MetricsRecorder.get_rss(),
+            "surfaces": {
+                "chunk_prerenders": {"count": chunk_count, "bytes": chunk_bytes},
+                "images": {"count": len(images),
+                           "bytes": sum(self.get_surface_bytes(surface) for surface in images.values())},
+            },
+            "sprites": {"count": len(sprites), "actors": actors},
+            "format_cache": {
+                "entries": len(format_cache),
+                "bytes": sys.getsizeof(format_cache) + sum(
+                    sys.getsizeof(key) + sys.getsizeof(value) for key, value in format_cache.items()),
+            },
+            "levels": level_reports,
+            "tracemalloc": self._get_tracemalloc_report() if self.is_tracing() else None,
+        }
+        self._report = report
+        self._report_time = time.perf_counter()
+        return report
+
+    def dump(self, filepath: str, levels: Dict[str, Any]) -> bool:
+        """Writes the memory report to the file. Returns False if the file could not be written"""
+        report = self.get_report(levels)
+        try:
+            directory = os.path.dirname(filepath)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(filepath, "w", encoding="utf-8") as file:
+                json.dump(report, file, indent=4)
+        except OSError as e:
+            print(f"memory: couldn't write the report {filepath}: {e}")
+            return False
+        print(f"memory: saved the report to {filepath}")
+        return True
+
+    def draw(self, game, surface: pygame.Surface, rect: Rect, levels: Dict[str, Any]):
+        """Draws the latest report. The report is taken again once it's older than the report interval"""
+        if self._report is None or time.perf_counter() - self._report_time > MemoryTracker.REPORT_INTERVAL:
+            self.get_report(levels)
+        report = self._report
+
+        lines = [
+            f"rss: {report['rss_mb'] or 0:.1f} MB",
+            f"chunk surfaces: {report['surfaces']['chunk_prerenders']['count']}, "
+            f"{self._format_bytes(report['surfaces']['chunk_prerenders']['bytes'])}",
+            f"images: {report['surfaces']['images']['count']}, "
+            f"{self._format_bytes(report['surfaces']['images']['bytes'])}",
+            f"sprites: {report['sprites']['count']}, actors: {report['sprites']['actors']}",
+            f"format cache: {report['format_cache']['entries']}, "
+            f"{self._format_bytes(report['format_cache']['bytes'])}",
+        ]
+        for name, level in report["levels"].items():
+            lines.append(f"{name}: {level['chunks']} chunks, {level['entities']} entities")
+        if (traced := report["tracemalloc"]) is not None:
+            lines.append(f"traced: {self._format_bytes(traced['current_bytes'])} "
+                         f"(peak {self._format_bytes(traced['peak_bytes'])})")
+            for name, size in sorted(traced["by_subsystem"].items(), key=lambda item: -item[1]):
+                growth = traced["growth_by_subsystem"].get(name, 0)
+                lines.append(f"  {name}: {self._format_bytes(size)} ({'+' if growth >= 0 else '-'}"
+                             f"{self._format_bytes(abs(growth))})")
+
+        height = min(rect.height, 8 + 12 * len(lines))
+        background = pygame.Surface((rect.width, height), pygame.SRCALPHA)
+        background.fill((0, 0, 0, 160))
+        surface.blit(background, rect.topleft)
+        y = rect.y + 4
+        for line in lines:
+            if y + 12 > rect.bottom:
+                break
+            game.get_screen().draw.text(line, (rect.x + 4, y), fontsize=12, color=(255, 255, 255))
+            y += 12
+
+    @classmethod
+    def get_surface_bytes(cls, surface: pygame.Surface) -> int:
+        return surface.get_pitch() * surface.get_height()
+
+    @classmethod
+    def get_subsystem(cls, filename: str) -> str:
+        """Returns the subsystem of the Python file, e.g. "engine.chunk" or "pygame" """
+        if filename.startswith("<"):
+            return "other"
+        path = os.path.abspath(filename)
+        if path.startswith(ROOT_DIRECTORY + os.sep):
+            parts = os.path.relpath(path, ROOT_DIRECTORY).split(os.sep)
+            parts[-1] = os.path.splitext(parts[-1])[0]
+            return ".".join(parts)
+        for library in ("pgzero", "pygame", "numpy"):
+            if f"{os.sep}{library}{os.sep}" in path:
+                return library
+        return "other"
+
+    @classmethod
+    def _get_level_report(cls, level) -> Dict[str, Any]:
+        chunks, tiles, cells, prerender_bytes = 0, 0, 0, 0
+        for layer in level.get_layers():
+            for chunk in level.get_chunks(layer):
+                chunks += 1
+                tiles += len(chunk.get_tiles())
+                cells += len(chunk.get_cells())
+                prerender_bytes += cls.get_surface_bytes(chunk.get_prerendered_frame())
+
+        entities_by_class: Dict[str, int] = {}
+        for entity in level.get_entities():
+            name = entity.__class__.__name__
+            entities_by_class[name] = entities_by_class.get(name, 0) + 1
+        return {
+            "chunks": chunks,
+            "tiles": tiles,
+            "cells": cells,
+            "prerender_bytes": prerender_bytes,
+            "entities": sum(entities_by_class.values()),
+            "entities_by_class": entities_by_class,
+        }
+
+    def _get_tracemalloc_report(self) -> Dict[str, Any]:
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ])
+        statistics = snapshot.statistics("lineno")
+
+        by_subsystem: Dict[str, int] = {}
+        for statistic in statistics:
+            name = self.get_subsystem(statistic.traceback[0].filename)
+            by_subsystem[name] = by_subsystem.get(name, 0) + statistic.size
+
+        # The first report is the baseline which the growth is measured from
+        if self._baseline is None:
+            self._baseline = dict(by_subsystem)
+        growth = {name: by_subsystem.get(name, 0) - self._baseline.get(name, 0)
+                  for name in by_subsystem.keys() | self._baseline.keys()}
+
+        top: List[Dict[str, Any]] = []
+        for statistic in statistics[:MemoryTracker.TOP_ALLOCATIONS]:
+            frame = statistic.traceback[0]
+            top.append({"location": f"{frame.filename}:{frame.lineno}", "bytes": statistic.size,
+                        "count": statistic.count})
+        return {
+            "current_bytes": current,
+            "peak_bytes": peak,
+            "by_subsystem": by_subsystem,
+            "growth_by_subsystem": growth,
+            "top": top,
+        }
+
+    @classmethod
+    def _format_bytes(cls, size: int) -> str:
+        if size >= 1024 * 1024:
+            return f"{size / (1024 * 1024):.1f} MB"
+        return f"{size / 1024:.1f} KB"
@@ -0,0 +1,159 @@
+from typing import Dict, Any
+
+from array import array
+
+import threading
+import atexit
+import queue
+import json
+import math
+import csv
+import sys
+import os
+
+
+class MetricsRecorder:
+    """Writes per-frame metrics to a JSON lines or CSV file. Samples are queued by the main thread
+    and written by a background thread, so the game never waits for the disk.
+    Percentiles of frame and tick times are printed and saved next to the file when the recorder is closed"""
+    FORMATS = ("jsonl", "csv")
+    CSV_FIELDS = ["frame", "time", "frame_ms", "tick_ms", "level", "entities", "entities_by_class",
+                  "visible_chunks", "dirty_chunks", "rss_mb"]
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self, filepath: str, file_format: str | None = None):
+        self._filepath = filepath
+        if file_format is None:
+            file_format = "csv" if filepath.endswith(".csv") else "jsonl"
+        self._format = file_format if file_format in MetricsRecorder.FORMATS else "jsonl"
+        self._frame = 0
+
+        # Frame and tick times are kept for the summary
+        self._frame_times = array("d")
+        self._tick_times = array("d")
+
+        self._queue: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="metrics_writer", daemon=True)
+        self._writer.start()
+        self._is_closed = False
+        atexit.register(self.close)
+
+    def get_filepath(self) -> str:
+        return self._filepath
+
+    def record(self, time: float, frame_time: float, tick_time: float, level=None):
+        """Queues the sample of a frame. Times are in seconds"""
+        if self._is_closed:
+            return
+        self._frame += 1
+        self._frame_times.append(frame_time)
+        self._tick_times.append(tick_time)
+
+        sample = {
+            "frame": self._frame,
+            "time": round(time, 4),
+            "frame_ms": round(frame_time * 1000, 3),
+            "tick_ms": round(tick_time * 1000, 3),
+            "level": None,
+            "entities": 0,
+            "entities_by_class": {},
+            "visible_chunks": 0,
+            "dirty_chunks": 0,
+        }
+        if level is not None:
+            entities_by_class: Dict[str, int] = {}
+            for entity in level.get_entities():
+                name = entity.__class__.__name__
+                entities_by_class[name] = entities_by_class.get(name, 0) + 1
+            sample["level"] = level.__class__.__name__
+            sample["entities"] = sum(entities_by_class.values())
+            sample["entities_by_class"] = entities_by_class
+            sample["visible_chunks"], sample["dirty_chunks"] = level.get_drawn_chunks_count()
+        self._queue.put(sample)
+
+    def get_summary(self) -> Dict[str, Any]:
+        return {
+            "frames": self._frame,
+            "frame_ms": self._get_percentiles(self._frame_times),
+            "tick_ms": self._get_percentiles(self._tick_times),
+        }
+
+    def close(self):
+        """Writes the remaining samples and the summary"""
+        if self._is_closed:
+            return
+        self._is_closed = True
+        atexit.unregister(self.close)
+        self._queue.put(None)
+        self._writer.join()
+
+        summary = self.get_summary()
+        summary_text = ", ".join(
+            f"{name} " + " ".join(f"p{p} {value:.2f}" for p, value in summary[name].items())
+            for name in ("frame_ms", "tick_ms"))
+        print(f"metrics: {summary['frames']} frame(s), {summary_text}")
+        try:
+            with open(os.path.splitext(self._filepath)[0] + ".summary.json", "w", encoding="utf-8") as file:
+                json.dump(summary, file, indent=4)
+        except OSError as e:
+            print(f"metrics: couldn't write the summary: {e}")
+
+    @classmethod
+    def get_rss(cls) -> float | None:
+        """Returns the resident memory of the process in megabytes, or None if it's not known"""
+        try:
+            with open("/proc/self/statm", "r") as file:
+                return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+        except (OSError, ValueError, AttributeError):
+            pass
+
+        # The peak memory is better than nothing
+        try:
+            import resource
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+        except ImportError:
+            return None
+
+    @classmethod
+    def _get_percentiles(cls, values: array) -> Dict[int, float]:
+        if not values:
+            return {p: 0.0 for p in MetricsRecorder.PERCENTILES}
+        # Nearest-rank percentiles
+        ordered = sorted(values)
+        return {p: ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)] * 1000
+                for p in MetricsRecorder.PERCENTILES}
+
+    def _write_loop(self):
+        try:
+            directory = os.path.dirname(self._filepath)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            file = open(self._filepath, "w", encoding="utf-8", newline="")
+        except OSError as e:
+            print(f"metrics: couldn't open {self._filepath}: {e}")
+            # Keep draining the queue, so the game won't keep the samples in memory
+            while self._queue.get() is not None:
+                pass
+            return
+
+        with file:
+            writer = None
+            if self._format == "csv":
+                writer = csv.DictWriter(file, fieldnames=MetricsRecorder.CSV_FIELDS)
+                writer.writeheader()
+
+            while (sample := self._queue.get()) is not None:
+                # The memory is measured here, so the main thread does not read the proc files
+                rss = self.get_rss()
+                sample["rss_mb"] = round(rss, 2) if rss is not None else None
+                if writer is not None:
+                    sample["entities_by_class"] = ";".join(
+                        f"{name}:{count}" for name, count in sample["entities_by_class"].items())
+                    writer.writerow(sample)
+                else:
+                    file.write(json.dumps(sample) + "\n")
+
+                # Flush once the queue is drained, so the file is readable while the game runs
+                if self._queue.empty():
+                    file.flush()
@@ -52,8 +52,9 @@ def format_string(s: str, seed: int = 0):
     if mode == 2:
         result_string += str(rnd.randint(int(rnd_range[0]), int(rnd_range[1])))
 
-    # Save in cache and return
-    FORMAT_CACHE[cache_key] = result_string
+    # Save in cache and return. Seeds of cells are all different, so the cache is limited when adding to it too
+    if len(FORMAT_CACHE) < 1024:
+        FORMAT_CACHE[cache_key] = result_string
     return result_string
 
 
@@ -80,12 +81,19 @@ class Direction(Enum):
 
 
 class Primitives:
+    """Draws shapes to a surface, or submits them to a draw queue which draws them in order with its blits"""
     @classmethod
     def rect(cls, surf: pygame.Surface, rect: pygame.Rect, color: Tuple[int, int, int]):
+        if hasattr(surf, "submit_call"):
+            surf.submit_call(lambda target: pygame.draw.rect(target, color, rect, 2))
+            return
         pygame.draw.rect(surf, color, rect, 2)
 
     @classmethod
     def circle(cls, surf: pygame.Surface, position: Tuple[float, float], radius, color: Tuple[int, int, int]):
+        if hasattr(surf, "submit_call"):
+            surf.submit_call(lambda target: pygame.draw.circle(target, color, position, radius))
+            return
         pygame.draw.circle(surf, color, position, radius)
 
 
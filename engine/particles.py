@@ -1,3 +1,202 @@
+from pgzero.rect import Rect
+from typing import Dict, List, Tuple
+
+from .counters import perf_counters
+
+import pygame
+
+# NumPy is optional. Without it no particles are emitted, the rest of the game works the same
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PARTICLES_EMITTED = perf_counters.register("particles.emitted", "Particles emitted")
+PARTICLES_DRAWN = perf_counters.register("particles.drawn", "Particles drawn")
+
+
+class ParticleEmitter:
+    """Describes how particles of one kind are emitted. Speed is in pixels per second, gravity is the part
+    of the level gravity applied to the particles, and drag is the part of the velocity kept each second"""
+    def __init__(self,
+                 colors: List[Tuple[int, int, int]],
+                 speed: Tuple[float, float] = (60, 180),
+                 life: Tuple[float, float] = (0.3, 0.6),
+                 size: Tuple[int, int] = (3, 6),
+                 gravity: float = 1.0,
+                 drag: float = 0.2,
+                 spread: float = 360.0):
+        self.colors = colors
+        self.speed = speed
+        self.life = life
+        self.size = size
+        self.gravity = gravity
+        self.drag = drag
+        # Angle in degrees around the direction which particles are emitted within
+        self.spread = spread
+
 
 class ParticlesEngine:
-    pass
+    """Particles stored as a structure of arrays, so all of them are moved with a few array operations
+    and drawn with a single blits call. When the capacity is reached, the oldest particles are replaced"""
+    CAPACITY = 4096
+    # Gravity of the level is added to velocities every tick, while particles move per second.
+    # They fall at half of the rate of entities at 60 ticks per second
+    GRAVITY_SCALE = 60 * 60 * 0.5
+    # Particles fade out in this many steps, each step is a separate surface
+    ALPHA_LEVELS = 4
+
+    def __init__(self, capacity: int = CAPACITY, seed: int = 0):
+        self._capacity = capacity
+        # Index of the slot the next particle is written to, and the amount of slots used so far
+        self._cursor = 0
+        self._used = 0
+        # Surfaces of each color, size and alpha level. Particles refer to them by their sprite id
+        self._sprite_ids: Dict[Tuple[Tuple[int, int, int], int], int] = {}
+        self._surfaces: List[pygame.Surface] = []
+        self._surfaces_table = None
+        # Particles to emit during next update, grouped by their emitter
+        self._pending: Dict[ParticleEmitter, List[Tuple[float, float, int, float, float]]] = {}
+        if numpy is None:
+            return
+
+        # Particles have their own generator, so they don't change random numbers the game logic gets
+        self._rng = numpy.random.default_rng(seed)
+        self._position = numpy.zeros((capacity, 2), numpy.float32)
+        self._velocity = numpy.zeros((capacity, 2), numpy.float32)
+        self._life = numpy.zeros(capacity, numpy.float32)
+        self._max_life = numpy.ones(capacity, numpy.float32)
+        self._gravity = numpy.zeros(capacity, numpy.float32)
+        self._drag = numpy.ones(capacity, numpy.float32)
+        self._size = numpy.zeros(capacity, numpy.int16)
+        self._sprite = numpy.zeros(capacity, numpy.int32)
+
+    def get_capacity(self) -> int:
+        return self._capacity
+
+    def get_count(self) -> int:
+        """Returns the amount of alive particles"""
+        if numpy is None:
+            return 0
+        return int(numpy.count_nonzero(self._life[:self._used] > 0))
+
+    def clear(self):
+        self._pending.clear()
+        if numpy is not None:
+            self._life[:] = 0
+        self._cursor = 0
+        self._used = 0
+
+    def emit(self,
+             emitter: ParticleEmitter,
+             position: Tuple[float, float],
+             count: int,
+             direction: Tuple[float, float] = (0, 0)):
+        """Emits particles at the world position. Without direction, particles are emitted to all sides.
+        Particles are created during next update, together with all other particles of the same emitter"""
+        if numpy is None or count <= 0:
+            return
+        self._pending.setdefault(emitter, []).append((position[0], position[1], count, direction[0], direction[1]))
+
+    def _emit_pending(self):
+        for emitter, requests in self._pending.items():
+            requests = numpy.array(requests, numpy.float64)
+            counts = requests[:, 2].astype(numpy.int64)
+            # Only the newest particles are kept if there's more of them than the capacity
+            total = min(int(counts.sum()), self._capacity)
+            PARTICLES_EMITTED.value += total
+            positions = numpy.repeat(requests[:, :2], counts, axis=0)[-total:]
+            directions = numpy.repeat(requests[:, 3:], counts, axis=0)[-total:]
+
+            slots = (self._cursor + numpy.arange(total)) % self._capacity
+            self._cursor = (self._cursor + total) % self._capacity
+            self._used = min(self._used + total, self._capacity)
+
+            spread = numpy.radians(emitter.spread)
+            angles = numpy.arctan2(directions[:, 1], directions[:, 0])
+            angles += self._rng.uniform(-spread / 2, spread / 2, total)
+            speeds = self._rng.uniform(emitter.speed[0], emitter.speed[1], total)
+            life = self._rng.uniform(emitter.life[0], emitter.life[1], total)
+            self._position[slots] = positions
+            self._velocity[slots, 0] = numpy.cos(angles) * speeds
+            self._velocity[slots, 1] = numpy.sin(angles) * speeds
+            self._life[slots] = life
+            self._max_life[slots] = life
+            self._gravity[slots] = emitter.gravity
+            self._drag[slots] = emitter.drag
+
+            # Colors and sizes are picked from the few the emitter has, so each of them has its own surfaces
+            colors = self._rng.integers(0, len(emitter.colors), total)
+            sizes = self._rng.integers(emitter.size[0], emitter.size[1] + 1, total)
+            sizes_range = range(emitter.size[0], emitter.size[1] + 1)
+            sprite_ids = numpy.array([[self._get_sprite_id(color, size) for size in sizes_range]
+                                      for color in emitter.colors])
+            self._size[slots] = sizes
+            self._sprite[slots] = sprite_ids[colors, sizes - emitter.size[0]]
+        self._pending.clear()
+
+    def update(self, level, dt: float):
+        if numpy is None:
+            return
+        if self._pending:
+            self._emit_pending()
+        if self._used == 0 or dt <= 0:
+            return
+        used = slice(0, self._used)
+        life = self._life[used]
+        life -= dt
+        alive = life > 0
+        if not alive.any():
+            self.clear()
+            return
+
+        gravity = level.get_gravity()
+        velocity = self._velocity[used]
+        velocity *= (self._drag[used] ** dt)[:, None]
+        velocity[:, 0] += gravity[0] * self.GRAVITY_SCALE * self._gravity[used] * dt
+        velocity[:, 1] += gravity[1] * self.GRAVITY_SCALE * self._gravity[used] * dt
+        self._position[used] += velocity * dt
+
+    def draw(self, game, level, surface):
+        if numpy is None or self._used == 0:
+            return
+        used = slice(0, self._used)
+        life = self._life[used]
+
+        # Translate world positions to the screen the same way as Level.translate_world_local does
+        origin = level.translate_world_local(Rect(0, 0, 0, 0))
+        half_size = self._size[used] // 2
+        x = (self._position[used, 0] + origin.x).astype(numpy.int32) - half_size
+        y = (origin.y - self._position[used, 1]).astype(numpy.int32) - half_size
+        width, height = surface.get_size()
+        visible = (life > 0) & (x > -16) & (x < width) & (y > -16) & (y < height)
+        indices = numpy.flatnonzero(visible)
+        if len(indices) == 0:
+            return
+        PARTICLES_DRAWN.value += len(indices)
+
+        # Particles fade out by switching to surfaces with lower alpha
+        levels = numpy.minimum((life[indices] / self._max_life[indices] * self.ALPHA_LEVELS).astype(numpy.int32),
+                               self.ALPHA_LEVELS - 1)
+        surfaces = self._surfaces_table[self._sprite[indices] * self.ALPHA_LEVELS + levels]
+        blits = zip(surfaces.tolist(), zip(x[indices].tolist(), y[indices].tolist()))
+        # Surface.fblits is only available in pygame-ce
+        if hasattr(surface, "fblits"):
+            surface.fblits(blits)
+        else:
+            surface.blits(blits, doreturn=False)
+
+    def _get_sprite_id(self, color: Tuple[int, int, int], size: int) -> int:
+        key = (tuple(color), size)
+        if (sprite_id := self._sprite_ids.get(key)) is not None:
+            return sprite_id
+        sprite_id = len(self._sprite_ids)
+        self._sprite_ids[key] = sprite_id
+        for level in range(self.ALPHA_LEVELS):
+            particle = pygame.Surface((size, size), pygame.SRCALPHA)
+            particle.fill((*color[:3], round(255 * (level + 1) / self.ALPHA_LEVELS)))
+            self._surfaces.append(particle)
+        # Surfaces are looked up for all drawn particles at once
+        self._surfaces_table = numpy.empty(len(self._surfaces), dtype=object)
+        self._surfaces_table[:] = self._surfaces
+        return sprite_id
@@ -0,0 +1,160 @@
+from pgzero.rect import Rect
+from typing import Dict, List, Tuple
+from collections import deque
+from contextlib import contextmanager
+
+import pygame
+import time
+
+
+class FrameRecord:
+    def __init__(self, duration: float, scopes: Dict[str, float], entity_classes: Dict[str, float]):
+        self.duration = duration
+        # Time spent in each scope, without the time of scopes nested into it
+        self.scopes = scopes
+        # Time spent updating and drawing entities of each class, including nested scopes
+        self.entity_classes = entity_classes
+
+
+class FrameProfiler:
+    """Measures time spent in named scopes during each frame and keeps the last frames in a ring buffer.
+    Time of nested scopes is not included in their parents, so the scopes of a frame add up to its duration"""
+    HISTORY_SIZE = 120
+    # Frame time which takes half of the graph height
+    GRAPH_BUDGET = 1 / 60
+    COLORS = [
+        (230, 25, 75), (60, 180, 75), (255, 225, 25), (0, 130, 200), (245, 130, 48), (145, 30, 180),
+        (70, 240, 240), (240, 50, 230), (210, 245, 60), (250, 190, 212), (0, 128, 128), (220, 190, 255),
+        (170, 110, 40), (255, 250, 200), (128, 0, 0), (170, 255, 195), (128, 128, 0), (0, 0, 128),
+    ]
+    OTHER_COLOR = (128, 128, 128)
+
+    def __init__(self, history_size: int = HISTORY_SIZE):
+        self._frames: deque[FrameRecord] = deque(maxlen=history_size)
+        self._scopes: Dict[str, float] = {}
+        self._entity_classes: Dict[str, float] = {}
+        # Each opened scope is its name, start time and time spent in the scopes nested into it
+        self._stack: List[List] = []
+        self._frame_start: float | None = None
+        self._colors: Dict[str, Tuple[int, int, int]] = {}
+        self._is_enabled = False
+
+    def set_enabled(self, state: bool):
+        if not state:
+            self._frame_start = None
+            self._stack.clear()
+        self._is_enabled = state
+
+    def is_enabled(self) -> bool:
+        return self._is_enabled
+
+    def begin_frame(self):
+        if not self._is_enabled:
+            return
+        self._scopes = {}
+        self._entity_classes = {}
+        self._stack.clear()
+        self._frame_start = time.perf_counter()
+
+    def end_frame(self):
+        """Saves the measured frame to the history"""
+        if self._frame_start is None:
+            return
+        duration = time.perf_counter() - self._frame_start
+        self._frames.append(FrameRecord(duration, self._scopes, self._entity_classes))
+        self._frame_start = None
+
+    def begin(self, name: str):
+        """Opens the scope. Every scope must be closed with the end method"""
+        if self._frame_start is None:
+            return
+        self._stack.append([name, time.perf_counter(), 0.0])
+
+    def end(self) -> float:
+        """Closes the last opened scope. Returns the time spent in it, including nested scopes"""
+        if self._frame_start is None or not self._stack:
+            return 0
+        name, start, nested = self._stack.pop()
+        elapsed = time.perf_counter() - start
+        self._scopes[name] = self._scopes.get(name, 0) + elapsed - nested
+        if self._stack:
+            self._stack[-1][2] += elapsed
+        return elapsed
+
+    @contextmanager
+    def scope(self, name: str):
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end()
+
+    def add_entity_time(self, entity_class: str, elapsed: float):
+        if self._frame_start is None:
+            return
+        self._entity_classes[entity_class] = self._entity_classes.get(entity_class, 0) + elapsed
+
+    def get_frames(self) -> List[FrameRecord]:
+        return list(self._frames)
+
+    def get_averages(self) -> Tuple[Dict[str, float], Dict[str, float]]:
+        """Returns average time per frame of each scope and each entity class over the history"""
+        scopes: Dict[str, float] = {}
+        entity_classes: Dict[str, float] = {}
+        for frame in self._frames:
+            for name, elapsed in frame.scopes.items():
+                scopes[name] = scopes.get(name, 0) + elapsed
+            for name, elapsed in frame.entity_classes.items():
+                entity_classes[name] = entity_classes.get(name, 0) + elapsed
+        count = max(len(self._frames), 1)
+        return ({name: elapsed / count for name, elapsed in scopes.items()},
+                {name: elapsed / count for name, elapsed in entity_classes.items()})
+
+    def get_color(self, name: str) -> Tuple[int, int, int]:
+        if name not in self._colors:
+            self._colors[name] = FrameProfiler.COLORS[len(self._colors) % len(FrameProfiler.COLORS)]
+        return self._colors[name]
+
+    def draw(self, game, surface: pygame.Surface, rect: Rect):
+        """Draws the stacked bar graph of the frames history and the legend with average times"""
+        background = pygame.Surface(rect.size, pygame.SRCALPHA)
+        background.fill((0, 0, 0, 160))
+        surface.blit(background, rect.topleft)
+
+        # Each frame is a bar of its scopes, the time not covered by any scope is drawn in gray
+        graph = Rect(rect.x + 4, rect.y + 4, rect.width * 2 // 5, rect.height - 8)
+        bar_width = max(graph.width // max(self._frames.maxlen, 1), 1)
+        scale = graph.height / (FrameProfiler.GRAPH_BUDGET * 2)
+        for idx, frame in enumerate(self._frames):
+            x = graph.x + idx * bar_width
+            y = graph.bottom
+            for name, elapsed in list(frame.scopes.items()) + [("other", frame.duration - sum(frame.scopes.values()))]:
+                height = min(round(elapsed * scale), y - graph.y)
+                if height <= 0:
+                    continue
+                color = FrameProfiler.OTHER_COLOR if name == "other" else self.get_color(name)
+                pygame.draw.rect(surface, color, Rect(x, y - height, bar_width, height))
+                y -= height
+
+        # Frame budget line
+        budget_y = graph.bottom - round(FrameProfiler.GRAPH_BUDGET * scale)
+        pygame.draw.line(surface, (255, 255, 255), (graph.x, budget_y), (graph.right, budget_y))
+
+        # Legend with the slowest scopes and entity classes, each in its own column
+        scopes, entity_classes = self.get_averages()
+        column_width = (rect.right - graph.right) // 2
+        self._draw_legend(game, surface, Rect(graph.right + 8, rect.y + 4, column_width - 8, rect.height - 8),
+                          scopes, True)
+        self._draw_legend(game, surface, Rect(graph.right + column_width, rect.y + 4, column_width - 8, rect.height - 8),
+                          entity_classes, False)
+
+    def _draw_legend(self, game, surface: pygame.Surface, rect: Rect, times: Dict[str, float], with_colors: bool):
+        y = rect.y
+        for name, elapsed in sorted(times.items(), key=lambda item: -item[1]):
+            if y + 12 > rect.bottom:
+                break
+            if with_colors:
+                pygame.draw.rect(surface, self.get_color(name), Rect(rect.x, y + 2, 8, 8))
+            game.get_screen().draw.text(f"{name} {elapsed * 1000:.2f} ms", (rect.x + 12, y),
+                                        fontsize=12, color=(255, 255, 255))
+            y += 12
@@ -0,0 +1,521 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, Iterator, List, Tuple
+from collections import OrderedDict
+
+from .chunk import Chunk
+from .level_objects import Tile, Entity, WorldObject
+
+import tempfile
+import atexit
+import shutil
+import struct
+import math
+import json
+import os
+
+
+class ChunkData:
+    """Serialized contents of a chunk, which can be created and read outside the main thread"""
+
+    def __init__(self,
+                 cells: List[Tuple[int, int, str, str | None]] = None,
+                 entities: List[Tuple[str, int, int, float]] = None):
+        # Local tile position in the chunk, object id from the objects map and the sprite variant
+        self.cells = cells if cells is not None else []
+        # Object id, world position and hp
+        self.entities = entities if entities is not None else []
+
+    def encode(self) -> bytes:
+        strings: Dict[str, int] = {}
+        cells = bytearray()
+        for x, y, obj_id, variant in self.cells:
+            variant_idx = RegionFile.NO_VARIANT if variant is None else strings.setdefault(variant, len(strings))
+            cells += ChunkData._CELL.pack(x, y, ord(obj_id), variant_idx)
+
+        data = bytearray(struct.pack("<H", len(strings)))
+        for string in strings.keys():
+            encoded = string.encode("utf-8")
+            data += struct.pack("<B", len(encoded)) + encoded
+        data += struct.pack("<H", len(self.cells)) + cells
+        data += struct.pack("<H", len(self.entities))
+        for obj_id, x, y, hp in self.entities:
+            data += ChunkData._ENTITY.pack(ord(obj_id), int(x), int(y), hp)
+        return bytes(data)
+
+    @classmethod
+    def decode(cls, data: bytes) -> "ChunkData":
+        offset = 0
+        strings_count, = struct.unpack_from("<H", data, offset)
+        offset += 2
+        strings = []
+        for _ in range(strings_count):
+            length = data[offset]
+            strings.append(data[offset + 1:offset + 1 + length].decode("utf-8"))
+            offset += 1 + length
+
+        cells_count, = struct.unpack_from("<H", data, offset)
+        offset += 2
+        cells = []
+        for x, y, obj_id, variant_idx in ChunkData._CELL.iter_unpack(data[offset:offset + cells_count * ChunkData._CELL.size]):
+            cells.append((x, y, chr(obj_id), None if variant_idx == RegionFile.NO_VARIANT else strings[variant_idx]))
+        offset += cells_count * ChunkData._CELL.size
+
+        entities_count, = struct.unpack_from("<H", data, offset)
+        offset += 2
+        entities = []
+        for obj_id, x, y, hp in ChunkData._ENTITY.iter_unpack(data[offset:offset + entities_count * ChunkData._ENTITY.size]):
+            entities.append((chr(obj_id), x, y, hp))
+        return ChunkData(cells, entities)
+
+    _CELL = struct.Struct("<BBBH")
+    _ENTITY = struct.Struct("<Biif")
+
+
+class RegionFile:
+    """File with a square of chunks. The header contains the seek index with offset and length
+    of each chunk's data, so any chunk can be read with a single seek"""
+    MAGIC = b"RGN0"
+    VERSION = 1
+    NO_VARIANT = 0xffff
+
+    _HEADER = struct.Struct("<4sHH")
+    _INDEX_ENTRY = struct.Struct("<II")
+
+    def __init__(self, path: str, region_size: int):
+        self._path = path
+        self._region_size = region_size
+        self._index: List[Tuple[int, int]] = [(0, 0)] * (region_size * region_size)
+
+        if os.path.isfile(path):
+            self._file = open(path, "r+b")
+            magic, version, size = RegionFile._HEADER.unpack(self._file.read(RegionFile._HEADER.size))
+            if magic != RegionFile.MAGIC or version != RegionFile.VERSION or size != region_size:
+                raise ValueError(f"region_file: invalid region file {path}")
+            index = self._file.read(RegionFile._INDEX_ENTRY.size * len(self._index))
+            self._index = list(RegionFile._INDEX_ENTRY.iter_unpack(index))
+        else:
+            self._file = open(path, "w+b")
+            self._file.write(RegionFile._HEADER.pack(RegionFile.MAGIC, RegionFile.VERSION, region_size))
+            self._file.write(RegionFile._INDEX_ENTRY.pack(0, 0) * len(self._index))
+
+    def read_chunk(self, slot: int) -> bytes | None:
+        offset, length = self._index[slot]
+        if not length:
+            return None
+        self._file.seek(offset)
+        return self._file.read(length)
+
+    def write_chunk(self, slot: int, data: bytes):
+        offset, length = self._index[slot]
+
+        # Overwrite the previous data if the new one fits there, otherwise append it to the end of the file
+        if len(data) > length:
+            self._file.seek(0, os.SEEK_END)
+            offset = self._file.tell()
+        self._file.seek(offset)
+        self._file.write(data)
+
+        self._index[slot] = (offset, len(data))
+        self._file.seek(RegionFile._HEADER.size + slot * RegionFile._INDEX_ENTRY.size)
+        self._file.write(RegionFile._INDEX_ENTRY.pack(offset, len(data)))
+
+    def close(self):
+        self._file.close()
+
+
+class RegionWorld:
+    """Directory with region files of all layers and the world.json file with the world properties"""
+    REGION_SIZE = 16
+    MAX_OPEN_FILES = 32
+    # Rows of the level converted between the progress messages
+    CONVERSION_LOG_ROWS = 1024
+
+    def __init__(self, directory: str):
+        self._directory = directory
+        self._files: OrderedDict[Tuple[str, int, int], RegionFile] = OrderedDict()
+        self.spawn_point = (0, 0)
+        self.layers: List[str] = []
+        self.region_size = RegionWorld.REGION_SIZE
+
+        metadata_path = os.path.join(directory, "world.json")
+        if os.path.isfile(metadata_path):
+            with open(metadata_path, "r", encoding="utf-8") as file:
+                metadata = json.load(file)
+            self.spawn_point = tuple(metadata["spawn_point"])
+            self.layers = metadata["layers"]
+            self.region_size = metadata["region_size"]
+
+    def get_directory(self) -> str:
+        return self._directory
+
+    def save_metadata(self):
+        os.makedirs(self._directory, exist_ok=True)
+        with open(os.path.join(self._directory, "world.json"), "w", encoding="utf-8") as file:
+            json.dump({
+                "spawn_point": list(self.spawn_point),
+                "layers": self.layers,
+                "region_size": self.region_size,
+                "chunk_size": Chunk.CHUNK_SIZE,
+                "tile_size": Tile.TILE_SIZE,
+            }, file)
+
+    def read_chunk(self, layer: str, position: Tuple[int, int]) -> ChunkData | None:
+        region_file, slot = self._get_region_file(layer, position, create=False)
+        if region_file is None or (data := region_file.read_chunk(slot)) is None:
+            return None
+        return ChunkData.decode(data)
+
+    def write_chunk(self, layer: str, position: Tuple[int, int], chunk_data: ChunkData):
+        region_file, slot = self._get_region_file(layer, position, create=True)
+        region_file.write_chunk(slot, chunk_data.encode())
+
+    def close(self):
+        for region_file in self._files.values():
+            region_file.close()
+        self._files.clear()
+
+    def _get_region_file(self, layer: str, position: Tuple[int, int], create: bool) -> Tuple[RegionFile | None, int]:
+        region = (layer, position[0] // self.region_size, position[1] // self.region_size)
+        slot = (position[0] % self.region_size) + (position[1] % self.region_size) * self.region_size
+
+        if region in self._files:
+            self._files.move_to_end(region)
+            return self._files[region], slot
+
+        path = os.path.join(self._directory, f"{region[0]}.{region[1]}.{region[2]}.region")
+        if not create and not os.path.isfile(path):
+            return None, slot
+
+        # Keep only limited amount of region files opened
+        if len(self._files) >= RegionWorld.MAX_OPEN_FILES:
+            _, region_file = self._files.popitem(last=False)
+            region_file.close()
+        self._files[region] = RegionFile(path, self.region_size)
+        return self._files[region], slot
+
+    @classmethod
+    def convert_level(cls,
+                      filepath: str,
+                      directory: str,
+                      objects_map: Dict[str, WorldObject],
+                      offset: Tuple[int, int] = (0, 0)) -> "RegionWorld":
+        """Converts the level file into region files. The file is read row by row, and each row of chunks
+        is written as soon as the rows below it which the tile rules look at are read. Only those rows are
+        kept in the memory, so any level can be converted. The sprite variants are resolved during the conversion"""
+        os.makedirs(directory, exist_ok=True)
+        world = RegionWorld(directory)
+        grid: _LayerGrid | None = None
+        for layer_name, y, row in cls._read_rows(filepath):
+            if grid is None or grid.get_layer() != layer_name:
+                if grid is not None:
+                    grid.convert_rows(world, grid.get_rows_count())
+                grid = _LayerGrid(layer_name, objects_map, offset)
+                world.layers.append(layer_name)
+            grid.add_row(y, row)
+
+            # The rules of the row above the margin can be checked now.
+            # If it's the last row of its chunks, the chunks can be written
+            complete = y - grid.get_margin()
+            if complete >= 0 and grid.get_chunk_row(complete) != grid.get_chunk_row(complete + 1):
+                grid.convert_rows(world, complete + 1)
+        if grid is not None:
+            grid.convert_rows(world, grid.get_rows_count())
+
+        world.close()
+        world.save_metadata()
+        return world
+
+    @classmethod
+    def _read_rows(cls, filepath: str) -> Iterator[Tuple[str, int, str]]:
+        """Yields the layer, the index and the content of all rows of the level file, in the same way
+        LevelParser.split_layers splits the file"""
+        layer, y = None, 0
+        with open(filepath, "r", encoding="utf-8") as file:
+            for line in file:
+                line = line.rstrip("\r\n").replace("\t", "    ")
+                # Remove comments
+                if "#" in line:
+                    line = line[0:line.find("#")]
+
+                if line.endswith(":"):
+                    layer, y = line[:-1], 0
+                    continue
+                if layer is not None:
+                    yield layer, y, line
+                    y += 1
+
+
+class _LayerGrid:
+    """Rows of the level layer which are being converted. Provides tiles to the tile rules during conversion"""
+
+    def __init__(self, layer: str, objects_map: Dict[str, WorldObject], offset: Tuple[int, int]):
+        self._layer = layer
+        self._rows: Dict[int, str] = {}
+        self._objects_map = objects_map
+        self._offset = offset
+        # Rows before this one are already converted
+        self._converted = 0
+        self._rows_count = 0
+        self._margin = _LayerGrid.get_rules_margin(objects_map)
+
+    @classmethod
+    def get_rules_margin(cls, objects_map: Dict[str, WorldObject]) -> int:
+        """Returns how many rows above or below a tile the sprite rules of the tiles look at"""
+        margin = 0
+        for obj in objects_map.values():
+            if not isinstance(obj, Tile):
+                continue
+            for rule in obj.SPRITE_RULES.values():
+                center = next((idx for idx, row in enumerate(rule) if "C" in row), 0)
+                margin = max(margin, center, len(rule) - 1 - center)
+        return margin
+
+    def get_layer(self) -> str:
+        return self._layer
+
+    def get_margin(self) -> int:
+        return self._margin
+
+    def get_rows_count(self) -> int:
+        return self._rows_count
+
+    def add_row(self, y: int, row: str):
+        self._rows[y] = row
+        self._rows_count = y + 1
+
+    def get_chunk_row(self, y: int) -> int:
+        return Chunk.local_coords(self.get_position(0, y)[1] // Tile.TILE_SIZE)
+
+    def convert_rows(self, world: RegionWorld, end: int):
+        """Writes the chunks of the rows up to the end, which must be the first row of a chunk or the last row,
+        and drops the rows which the rules won't look at anymore"""
+        chunks: Dict[Tuple[int, int], ChunkData] = {}
+        for y in range(self._converted, end):
+            for x, obj_id in enumerate(self._rows[y]):
+                if obj_id == 'P':
+                    world.spawn_point = self.get_position(x, y)
+                    continue
+                if (obj := self.get_object(x, y)) is None:
+                    continue
+
+                position = self.get_position(x, y)
+                tile_x, tile_y = position[0] // Tile.TILE_SIZE, position[1] // Tile.TILE_SIZE
+                chunk_data = chunks.setdefault(Chunk.local_coords((tile_x, tile_y)), ChunkData())
+                if isinstance(obj, Entity):
+                    chunk_data.entities.append((obj_id, position[0], position[1], obj.hp))
+                elif isinstance(obj, Tile):
+                    variant = None
+                    if obj.FLYWEIGHT:
+                        variant = obj.get_flyweight().resolve_sprite(
+                            self, position, self._layer, Chunk.cell_seed(position))
+                    chunk_data.cells.append((tile_x % Chunk.CHUNK_SIZE, tile_y % Chunk.CHUNK_SIZE, obj_id, variant))
+
+        for chunk_position, chunk_data in chunks.items():
+            world.write_chunk(self._layer, chunk_position, chunk_data)
+        if end // RegionWorld.CONVERSION_LOG_ROWS != self._converted // RegionWorld.CONVERSION_LOG_ROWS \
+                or end == self._rows_count:
+            print(f"region_world: converted {end} rows of layer '{self._layer}'")
+        self._converted = end
+
+        # The rows above the converted ones are kept only as long as the rules of the next rows can look at them
+        for y in [y for y in self._rows if y < end - self._margin]:
+            del self._rows[y]
+
+    def get_position(self, x: int, y: int) -> Tuple[int, int]:
+        return self._offset[0] + x * Tile.TILE_SIZE, self._offset[1] - y * Tile.TILE_SIZE
+
+    def get_object(self, x: int, y: int) -> WorldObject | None:
+        row = self._rows.get(y)
+        if row is None or x < 0 or x >= len(row):
+            return None
+        return self._objects_map.get(row[x])
+
+    def get_tile(self, position: Tuple[int, int], layer: str) -> Tile | None:
+        x = (position[0] - self._offset[0]) // Tile.TILE_SIZE
+        y = (self._offset[1] - position[1]) // Tile.TILE_SIZE
+        obj = self.get_object(x, y)
+        if not isinstance(obj, Tile):
+            return None
+        return obj.get_flyweight() if obj.FLYWEIGHT else obj
+
+
+class RegionStreamer:
+    """Loads chunks of the region world around the camera and unloads the ones which are far from it.
+    Files are read and written on a worker thread, the loaded chunks are added to the level on the main thread"""
+
+    def __init__(self,
+                 world: RegionWorld,
+                 objects_map: Dict[str, WorldObject],
+                 load_margin: int = 1,
+                 unload_margin: int = 2,
+                 chunks_per_frame: int = 4):
+        self._world = world
+        self._objects_map = objects_map
+        self._object_ids = {obj.__class__: obj_id for obj_id, obj in objects_map.items()}
+        self._load_margin = load_margin
+        self._unload_margin = unload_margin
+        self._chunks_per_frame = chunks_per_frame
+        self._pending: Dict[Tuple[str, Tuple[int, int]], Future] = {}
+        self._last_center = None
+
+        # Chunks unloaded during the session are saved separately, so the source world is never modified.
+        # The session world is looked at first, so nothing about the unloaded chunks is kept in the memory
+        self._session_world = RegionWorld(tempfile.mkdtemp(prefix="regions_"))
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="region_streamer")
+        atexit.register(self.close)
+
+    def get_world(self) -> RegionWorld:
+        return self._world
+
+    def get_pending_count(self) -> int:
+        return len(self._pending)
+
+    def is_loading(self, layer: str, position: Tuple[int, int]) -> bool:
+        """Returns True if the chunk was requested, but it's not added to the level yet"""
+        return (layer, tuple(position)) in self._pending
+
+    def update(self, level, center: Tuple[float, float] = None, blocking: bool = False):
+        if center is None:
+            center = level.get_camera_position()
+        center_chunk = Chunk.local_coords((center[0] // Tile.TILE_SIZE, center[1] // Tile.TILE_SIZE))
+        screen_width, screen_height = level.get_screen_size()
+        chunk_size = Tile.TILE_SIZE * Chunk.CHUNK_SIZE
+        distance = (math.ceil(screen_width / chunk_size / 2) + self._load_margin,
+                    math.ceil(screen_height / chunk_size / 2) + self._load_margin)
+
+        # The set of the chunks only changes when the camera moves to another chunk
+        if center_chunk != self._last_center:
+            self._last_center = center_chunk
+            self._unload_chunks(level, center_chunk, distance)
+            self._request_chunks(level, center_chunk, distance)
+
+        self._apply_loaded_chunks(level, blocking)
+
+    def close(self):
+        atexit.unregister(self.close)
+        self._executor.shutdown(wait=True)
+        self._session_world.close()
+        self._world.close()
+        shutil.rmtree(self._session_world.get_directory(), ignore_errors=True)
+
+    def _request_chunks(self, level, center_chunk: Tuple[int, int], distance: Tuple[int, int]):
+        for layer in self._world.layers:
+            for x in range(center_chunk[0] - distance[0], center_chunk[0] + distance[0] + 1):
+                for y in range(center_chunk[1] - distance[1], center_chunk[1] + distance[1] + 1):
+                    key = (layer, (x, y))
+                    if key not in self._pending and level.get_chunk((x, y), layer) is None:
+                        self._pending[key] = self._executor.submit(self._read_chunk, layer, (x, y))
+
+    def _read_chunk(self, layer: str, position: Tuple[int, int]) -> ChunkData | None:
+        if (chunk_data := self._session_world.read_chunk(layer, position)) is not None:
+            return chunk_data
+        return self._world.read_chunk(layer, position)
+
+    def _write_chunk(self, layer: str, position: Tuple[int, int], chunk_data: ChunkData):
+        self._session_world.write_chunk(layer, position, chunk_data)
+
+    def _apply_loaded_chunks(self, level, blocking: bool):
+        applied = 0
+        for key, future in list(self._pending.items()):
+            if not blocking and (applied >= self._chunks_per_frame or not future.done()):
+                continue
+            self._pending.pop(key)
+
+            # The chunk could have been created while we were loading it
+            layer, position = key
+            chunk_data = future.result()
+            if chunk_data is None or level.get_chunk(position, layer) is not None:
+                continue
+            self._add_chunk(level, layer, position, chunk_data)
+            applied += 1
+
+    def _add_chunk(self, level, layer: str, position: Tuple[int, int], chunk_data: ChunkData):
+        level.add_chunk(Chunk(layer, *position))
+        tile_x, tile_y = Chunk.world_coords(position)
+        for x, y, obj_id, variant in chunk_data.cells:
+            tile = level.create_tile(self._objects_map[obj_id])
+            tile_position = ((tile_x + x) * Tile.TILE_SIZE, (tile_y + y) * Tile.TILE_SIZE)
+            level.set_tile(tile, tile_position, layer, variant=variant if tile.is_flyweight() else None)
+
+        for obj_id, x, y, hp in chunk_data.entities:
+            entity = self._objects_map[obj_id].__class__()
+            entity.set_position([x, y])
+            entity.hp = hp
+            level.add_entity(entity)
+
+    def _unload_chunks(self, level, center_chunk: Tuple[int, int], distance: Tuple[int, int]):
+        # Chunks are unloaded a few chunks further than they're loaded, so the chunks on the border
+        # are not loaded and unloaded again when the camera moves back and forth
+        keep = (distance[0] + self._unload_margin, distance[1] + self._unload_margin)
+        is_far = lambda position: abs(position[0] - center_chunk[0]) > keep[0] or \
+            abs(position[1] - center_chunk[1]) > keep[1]
+
+        # Entities are saved with the chunks of the first layer
+        entities_layer = self._world.layers[0] if self._world.layers else None
+        far_entities = self._find_far_entities(level, is_far)
+        for layer in self._world.layers:
+            for chunk in level.get_chunks(layer):
+                if not is_far(chunk.get_position()):
+                    continue
+
+                chunk_data = self._serialize_chunk(chunk)
+                if layer == entities_layer:
+                    chunk_data.entities = self._take_entities(level, far_entities.pop(chunk.get_position(), []))
+                level.remove_chunk(chunk.get_position(), layer)
+                self._executor.submit(self._write_chunk, layer, chunk.get_position(), chunk_data)
+
+        # Entities which left the loaded chunks, e.g. flying over the air, are added to the saved chunks at their
+        # position. If the chunk is being loaded, they're unloaded with it later
+        for chunk_position, entities in far_entities.items():
+            if (entities_layer, chunk_position) not in self._pending:
+                self._executor.submit(self._append_entities, entities_layer, chunk_position,
+                                      self._take_entities(level, entities))
+
+    def _append_entities(self, layer: str, position: Tuple[int, int], entities: List[Tuple[str, int, int, float]]):
+        chunk_data = self._read_chunk(layer, position) or ChunkData()
+        chunk_data.entities += entities
+        self._write_chunk(layer, position, chunk_data)
+
+    def _serialize_chunk(self, chunk: Chunk) -> ChunkData:
+        # Cells are saved in the order they were placed in, which is the order they collide in
+        chunk_data = ChunkData()
+        cells = chunk.get_cells()
+        for position in chunk.get_positions():
+            if (cell := cells.get(position)) is not None:
+                obj_id = self._object_ids.get(Tile.from_type_id(cell[0]).__class__)
+                variant = cell[1]
+            else:
+                obj_id = self._object_ids.get(chunk.get_tile(position).__class__)
+                variant = None
+            if obj_id is not None:
+                chunk_data.cells.append(self._serialize_cell(position, obj_id, variant))
+        return chunk_data
+
+    @classmethod
+    def _serialize_cell(cls, position: Tuple[int, int], obj_id: str, variant: str | None) -> Tuple[int, int, str, str | None]:
+        tile_x, tile_y = position[0] // Tile.TILE_SIZE, position[1] // Tile.TILE_SIZE
+        return tile_x % Chunk.CHUNK_SIZE, tile_y % Chunk.CHUNK_SIZE, obj_id, variant
+
+    @classmethod
+    def _find_far_entities(cls, level, is_far) -> Dict[Tuple[int, int], List[Entity]]:
+        """Returns the entities in the chunks which are unloaded, by their chunk"""
+        far_entities: Dict[Tuple[int, int], List[Entity]] = {}
+        for entity in level.get_entities():
+            if entity == level.get_player() or entity == level.get_captured_entity():
+                continue
+            x, y = entity.get_position()
+            chunk_position = Chunk.local_coords((x // Tile.TILE_SIZE, y // Tile.TILE_SIZE))
+            if is_far(chunk_position):
+                far_entities.setdefault(chunk_position, []).append(entity)
+        return far_entities
+
+    def _take_entities(self, level, entities: List[Entity]) -> List[Tuple[str, int, int, float]]:
+        """Removes the entities from the level and returns their serialized state.
+        Entities which are not in the objects map (fireballs, explosions) are just removed"""
+        serialized = []
+        for entity in entities:
+            x, y = entity.get_position()
+            if (obj_id := self._object_ids.get(entity.__class__)) is not None:
+                serialized.append((obj_id, int(x), int(y), entity.hp))
+            level.remove_entity(entity)
+        return serialized
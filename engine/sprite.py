@@ -2,18 +2,26 @@ from pgzero.actor import Actor
 
 from typing import List, Tuple
 
+import weakref
+
 from .animation import *
 from .misc import Direction
+from .counters import perf_counters
+
+TRANSFORMS = perf_counters.register("sprite.transforms", "Surface transforms done while drawing sprites")
+# All alive sprites, used by the memory report
+SPRITES: "weakref.WeakSet[Sprite]" = weakref.WeakSet()
 
 
 class Sprite:
-    def __init__(self, images: List[str], interval: float = 0.1):
+    def __init__(self, images: List[str], interval: float = 0.1, clock: AnimationClock | None = None):
+        """The sprite is animated by the clock, which is the clock of the level by default"""
         self._images = images
         self._actors: List[Actor] = []
-        self._current_frame = 0
-        self._tick = 0
         self._interval = interval
-        self._last_frame_change = 0
+        # Offset of the animation on the clock's timeline, so it can start from the first frame
+        self._phase = 0.0
+        self._clock = clock if clock is not None else animation_clock
         self._is_enabled = True
 
         # The init method of the class might be called when pygame hasn't initialized yet,
@@ -22,25 +30,41 @@ class Sprite:
 
         self._blink_color = (0, 0, 0)
         self._blink_timeout = -1
+        SPRITES.add(self)
 
     def blink(self, color: Tuple[int, int, int]):
         """Blink with color"""
         self._blink_color = color
-        self._blink_timeout = self._tick + 0.7
+        self._blink_timeout = self._clock.get_time() + 0.7
+
+    def restart(self):
+        """Starts the animation from the first frame, for animations which are played once"""
+        self._phase = -self._clock.get_time()
+
+    def get_frame(self) -> int:
+        """Returns the index of the frame shown at the current time of the sprite's clock"""
+        if not self._is_enabled or len(self._images) <= 1:
+            return 0
+        return int((self._clock.get_time() + self._phase) / self._interval) % len(self._images)
 
     def set_image(self, idx: int, image: str):
         """Sets an image at an index"""
-        if idx >= len(self._actors):
+        if idx >= len(self._images):
             return
         self._images[idx] = image
-        self._actors[idx].image = image
+        # Sprites are initialized when they're drawn first, until then only the image is changed
+        if idx < len(self._actors):
+            self._actors[idx].image = image
 
     def get_image(self, idx: int) -> str:
         """Returns an image at an index"""
-        if idx >= len(self._actors):
+        if idx >= len(self._images):
             return ""
         return self._images[idx]
 
+    def get_images(self) -> List[str]:
+        return self._images
+
     def get_interval(self) -> float:
         """Returns the interval between animation frames in MS"""
         return self._interval
@@ -49,49 +73,43 @@ class Sprite:
         """Sets the interval between animation frames in MS"""
         self._interval = interval
 
+    def get_actors(self) -> List[Actor]:
+        return self._actors
+
     def enable_animation(self, state: bool):
         self._is_enabled = state
 
     def draw(self, game, rect: Rect, surface, direction: Direction = Direction.WEST):
+        # Initialize the sprite if we haven't yet
+        self._initialize()
         if not self._actors:
             return
         
         # Render current frame at provided position
-        actor = self._actors[self._current_frame % len(self._actors)]
+        actor = self._actors[self.get_frame() % len(self._actors)]
 
         # As far as I can see there's no native method in pgzero that would allow to flip the image.
         # Because of this I'll make a little hack using standard pygame to flip the image.
         # Also I'll use it to scale the image for now
         import pygame
         scaled_frame = pygame.transform.scale(actor._surf, (rect.width, rect.height))
+        TRANSFORMS.value += 1
 
         # Blink effect
-        if self._blink_timeout != -1:
-            state = round(self._tick * 10) % 2
+        time = self._clock.get_time()
+        if self._blink_timeout > time:
+            state = round(time * 10) % 2
             clr = self._blink_color
             color_img = pygame.Surface(scaled_frame.get_size(), pygame.SRCALPHA)
             color_img.fill(((255 - clr[0]) * state, (255 - clr[1]) * state, (255 - clr[2]) * state))
             scaled_frame.blit(color_img, (0, 0), special_flags=pygame.BLEND_RGB_SUB)
 
         frame = pygame.transform.flip(scaled_frame, direction == Direction.EAST, direction == Direction.NORTH)
+        TRANSFORMS.value += 1
         surface.blit(frame, (rect.x, rect.y))
 
-    def update(self, game, dt):
-        # Initialize the sprite if we haven't yet
+    def _initialize(self):
         if not self._initialized:
             for img in self._images:
                 self._actors.append(Actor(img))
             self._initialized = True
-        
-        ticks_per_second = 1 * dt
-        self._tick += ticks_per_second
-        if self._tick > self._last_frame_change + self._interval and self._is_enabled:
-            self._current_frame += 1
-            self._last_frame_change = self._interval + self._tick
-
-        if self._blink_timeout < self._tick:
-            self._blink_timeout = -1
-
-        # If the animation is disabled, only show the first frame
-        if not self._is_enabled:
-            self._current_frame = 0
\ No newline at end of file
@@ -0,0 +1,200 @@
+from typing import Dict, Iterable, List, Tuple
+
+from .level_objects import Tile
+from .counters import perf_counters
+from .misc import direction_position
+
+import heapq
+import math
+import time
+
+AI_THINKS = perf_counters.register("ai.thinks", "Entities which thought")
+AI_DEFERRED = perf_counters.register("ai.deferred", "Frames the AI budget ran out before all entities thought")
+AI_SNAPSHOT_TILES = perf_counters.register("ai.snapshot_tiles", "Tiles captured in the snapshots entities decide from")
+
+# Fraction of the think interval each next entity is shifted by, so entities added together think in different frames
+STAGGER = 0.618034
+
+
+class EntityState:
+    """Position and hp of an entity at the time of the snapshot. Entities which think capture
+    the rest of the state they decide from by subclassing it (see Entity.capture_state)"""
+    def __init__(self, entity):
+        self._entity = entity
+        self._position = tuple(entity.get_position())
+        self._hp = entity.hp
+        self._on_ground = entity.is_on_ground()
+
+    def get_entity(self):
+        """Returns the entity itself. It may only be compared to others while deciding, not looked at"""
+        return self._entity
+
+    def get_position(self) -> Tuple[float, float]:
+        return self._position
+
+    def get_hp(self) -> float:
+        return self._hp
+
+    def is_on_ground(self) -> bool:
+        return self._on_ground
+
+    def distance(self, position: Tuple[float, float]) -> float:
+        return math.sqrt((self._position[0] - position[0]) ** 2 + (self._position[1] - position[1]) ** 2)
+
+    def direction(self, position: Tuple[float, float], strength: int = 1) -> List[int]:
+        """Returns the direction from the position to the entity, the same way Entity.direction does"""
+        return direction_position(position, self._position, strength=strength)
+
+
+class WorldSnapshot:
+    """Read-only state of the level which entities decide from. Entities decide only from the snapshot,
+    never from the level or their own fields, so all of them decide from the level as it was at the same time"""
+    def __init__(self, time_now: float, players: Tuple[EntityState, ...], states: Dict[int, EntityState]):
+        self._time = time_now
+        self._players = players
+        # States of the players and the entities which decide, by the id of the entity
+        self._states = states
+        # Tiles the entities asked for, and whether they're solid. Asked positions without a tile are left out
+        self._tiles: Dict[Tuple[float, float], bool] = {}
+
+    @classmethod
+    def capture(cls, level, time_now: float, entities: Iterable, layer: str = "layer0") -> "WorldSnapshot":
+        """Captures the player, the entities and the tiles the entities will look at (see Entity.get_think_tiles)"""
+        player = level.get_player()
+        players = (EntityState(player),) if player is not None else ()
+        states = {id(state.get_entity()): state for state in players}
+        for entity in entities:
+            states[id(entity)] = entity.capture_state() or EntityState(entity)
+        snapshot = cls(time_now, players, states)
+
+        # The tiles depend on the captured states only, like the decisions
+        asked = set()
+        for entity in entities:
+            for position in entity.get_think_tiles(snapshot):
+                position = tuple(position)
+                if position in asked:
+                    continue
+                asked.add(position)
+                if (tile := level.get_tile(position, layer)) is not None:
+                    snapshot._tiles[position] = tile.is_static and tile.has_collision
+        AI_SNAPSHOT_TILES.value += len(asked)
+        return snapshot
+
+    def get_time(self) -> float:
+        return self._time
+
+    def get_players(self) -> Tuple[EntityState, ...]:
+        return self._players
+
+    def get_state(self, entity) -> EntityState | None:
+        """Returns the captured state of the entity, or None if it wasn't captured"""
+        return self._states.get(id(entity))
+
+    def has_tile(self, position: Tuple[float, float]) -> bool:
+        return tuple(position) in self._tiles
+
+    def is_solid(self, position: Tuple[float, float]) -> bool:
+        return self._tiles.get(tuple(position), False)
+
+    def distance_ground(self, position: Tuple[float, float], max_iterations: int = 16) -> int:
+        """The same as Entity.distance_ground, for the tiles captured below the position"""
+        x = position[0] // Tile.TILE_SIZE * Tile.TILE_SIZE
+        y = position[1] // Tile.TILE_SIZE * Tile.TILE_SIZE
+        for i in range(max_iterations):
+            if self.is_solid((x, y - i * Tile.TILE_SIZE)):
+                return i
+        return max_iterations
+
+
+class ThinkScheduler:
+    """Lets entities think THINK_RATE times per second of the level time. Entities are staggered,
+    so only a part of them thinks during each frame. Entities due during the frame decide together from
+    a snapshot of the level, then each of them applies its decision in the order of the queue. Once the time
+    spent thinking exceeds the budget, the remaining entities think during next frames, before the others"""
+    # Seconds of the frame all entities can spend thinking
+    BUDGET = 0.002
+
+    def __init__(self, budget: float | None = BUDGET):
+        self._budget = budget
+        # Each entry is the time of the next think, the order entities were added in and the entity
+        self._queue: List[Tuple[float, int, object]] = []
+        # Entities which think and their order, so entries of removed entities are skipped even if they're added again
+        self._thinkers: Dict[int, Tuple[object, int]] = {}
+        self._order = 0
+        self._time = 0.0
+        # Seconds a think took on average, which decides how many entities fit in the budget
+        self._think_cost = 0.0
+
+    def set_budget(self, budget: float | None):
+        """Sets the time in seconds entities can spend thinking each frame, or None to never defer them.
+        Without the budget, the entities which think don't depend on the speed of the computer"""
+        self._budget = budget
+
+    def get_budget(self) -> float | None:
+        return self._budget
+
+    def get_count(self) -> int:
+        return len(self._thinkers)
+
+    def add(self, entity):
+        if id(entity) in self._thinkers or entity.THINK_RATE <= 0:
+            return
+        self._thinkers[id(entity)] = (entity, self._order)
+        interval = 1 / entity.THINK_RATE
+        heapq.heappush(self._queue, (self._time + self._order * STAGGER % 1 * interval, self._order, entity))
+        self._order += 1
+
+    def remove(self, entity):
+        # The entity is dropped from the queue once its turn comes
+        self._thinkers.pop(id(entity), None)
+
+    def update(self, game, level, time_now: float):
+        """Lets entities whose time came think, until the time spent thinking exceeds the budget"""
+        self._time = time_now
+        start = time.perf_counter()
+
+        # Take the due entities which likely fit in the budget, going by the cost of the previous thinks,
+        # so the snapshot isn't captured for the ones which will be deferred anyway
+        limit = None
+        if self._budget is not None and self._think_cost > 0:
+            limit = max(1, int(self._budget / self._think_cost))
+        due = []
+        while self._queue and self._queue[0][0] <= time_now:
+            if limit is not None and len(due) >= limit:
+                break
+            entry = heapq.heappop(self._queue)
+            if self._thinkers.get(id(entry[2])) == (entry[2], entry[1]):
+                due.append(entry)
+        if not due:
+            return
+
+        entities = [entity for _, _, entity in due]
+        snapshot = WorldSnapshot.capture(level, time_now, entities)
+
+        thought = 0
+        for idx, (think_time, order, entity) in enumerate(due):
+            # The first entity always thinks, so the entities can't be deferred forever
+            if thought > 0 and self._budget is not None and time.perf_counter() - start > self._budget:
+                # The remaining entities think first during the next frame, as they keep their time
+                for entry in due[idx:]:
+                    heapq.heappush(self._queue, entry)
+                break
+            # An entity applying its decision could remove one which decided after it
+            if self._thinkers.get(id(entity)) != (entity, order):
+                continue
+            entity.think(game, level, entity.decide(snapshot))
+            AI_THINKS.value += 1
+            thought += 1
+
+            # Keep the stagger of the entity, unless it was deferred for more than the interval
+            interval = 1 / entity.THINK_RATE
+            think_time += interval
+            if think_time <= time_now:
+                think_time = time_now + interval
+            heapq.heappush(self._queue, (think_time, order, entity))
+
+        if self._queue and self._queue[0][0] <= time_now:
+            AI_DEFERRED.value += 1
+        if thought > 0:
+            cost = (time.perf_counter() - start) / thought
+            self._think_cost = cost if self._think_cost == 0 else self._think_cost * 0.9 + cost * 0.1
@@ -0,0 +1,185 @@
+from typing import Any, Callable, List
+
+from .counters import perf_counters
+
+import math
+
+TIMERS_SCHEDULED = perf_counters.register("timers.scheduled", "Timers scheduled")
+TIMERS_FIRED = perf_counters.register("timers.fired", "Timers fired")
+
+
+class Timer:
+    """Handle of a scheduled callback. Timers without a callback are used as cooldowns, which are over
+    once the timer fires. A cancelled cooldown never ends"""
+    def __init__(self, time: float, tick: int, order: int, callback: Callable | None, args: tuple,
+                 wheel: "TimerWheel | None" = None):
+        self._time = time
+        self._tick = tick
+        self._order = order
+        self._callback = callback
+        self._args = args
+        self._is_pending = True
+        self._is_fired = False
+        # Wheel which counts the timer while it's pending
+        self._wheel = wheel
+
+    def get_time(self) -> float:
+        """Returns the time the timer fires at"""
+        return self._time
+
+    def is_pending(self) -> bool:
+        """Returns True if the timer hasn't fired and wasn't cancelled"""
+        return self._is_pending
+
+    def is_fired(self) -> bool:
+        return self._is_fired
+
+    def cancel(self):
+        if self._is_pending and self._wheel is not None:
+            self._wheel._count -= 1
+        self._is_pending = False
+        self._wheel = None
+
+    def _fire(self):
+        self._is_pending = False
+        self._is_fired = True
+        self._wheel = None
+        if self._callback is not None:
+            self._callback(*self._args)
+
+
+class TimerWheel:
+    """Hierarchical timer wheel. The time is split into ticks of the resolution. Timers due within SLOTS ticks
+    are kept in the slot of their tick on the first wheel, timers due later on the coarser wheels, whose slots
+    are SLOTS times longer each. Once a wheel turns around, the next slot of the coarser wheel is moved down.
+    Each wheel has a bitmap of its slots with timers, so advancing the time jumps over the empty slots and
+    its cost depends on the fired timers and the turns of the first wheel"""
+    RESOLUTION = 1 / 60
+    SLOTS = 64
+    WHEELS = 4
+    # Part of a tick the time is rounded by, so time summed from many steps lands on the tick it should
+    EPSILON = 1e-6
+
+    def __init__(self, resolution: float = RESOLUTION, slots: int = SLOTS, wheels: int = WHEELS):
+        self._resolution = resolution
+        self._slots = slots
+        self._wheels: List[List[List[Timer]]] = [[[] for _ in range(slots)] for _ in range(wheels)]
+        # Bit of each slot is set when the slot has timers, pending or cancelled
+        self._occupied: List[int] = [0] * wheels
+        # Timers due after all wheels turn around once
+        self._overflow: List[Timer] = []
+        self._time = 0.0
+        self._tick = 0
+        self._count = 0
+        self._order = 0
+
+    def get_time(self) -> float:
+        return self._time
+
+    def get_count(self) -> int:
+        """Returns the amount of pending timers"""
+        return self._count
+
+    def schedule(self, delay: float, callback: Callable | None = None, *args: Any) -> Timer:
+        """Calls the callback with the arguments once the time advances by the delay.
+        The timer fires during the first advance at or after its time, rounded up to the resolution"""
+        TIMERS_SCHEDULED.value += 1
+        time = self._time + max(delay, 0)
+        tick = max(math.ceil(time / self._resolution - TimerWheel.EPSILON), self._tick + 1)
+        timer = Timer(time, tick, self._order, callback, args, self)
+        self._order += 1
+        self._count += 1
+        self._insert(timer)
+        return timer
+
+    def clear(self):
+        """Cancels all timers"""
+        for wheel in self._wheels:
+            for slot in wheel:
+                for timer in slot:
+                    timer.cancel()
+        for timer in self._overflow:
+            timer.cancel()
+        self._drop_all()
+
+    def _drop_all(self):
+        for wheel in self._wheels:
+            for slot in wheel:
+                slot.clear()
+        self._occupied = [0] * len(self._wheels)
+        self._overflow.clear()
+        self._count = 0
+
+    def advance(self, time: float):
+        """Moves the time forward, firing all timers which are due by then in the order of their time"""
+        tick = math.floor(time / self._resolution + TimerWheel.EPSILON)
+        self._time = max(self._time, time)
+        while self._tick < tick:
+            # Nothing to fire, so the wheels can jump straight to the tick. Only cancelled timers are left to drop
+            if self._count == 0:
+                if any(self._occupied) or self._overflow:
+                    self._drop_all()
+                self._tick = tick
+                return
+
+            # Jump to the next slot with timers of the first wheel, but stop once the wheel turns around,
+            # since the coarser wheels move their timers down then
+            index = self._tick % self._slots
+            occupied = self._occupied[0] >> (index + 1)
+            if occupied:
+                next_tick = self._tick + (occupied & -occupied).bit_length()
+            else:
+                next_tick = self._tick + self._slots - index
+            self._tick = min(next_tick, tick)
+            self._cascade()
+
+            index = self._tick % self._slots
+            slot = self._wheels[0][index]
+            if not slot:
+                continue
+            self._wheels[0][index] = []
+            self._occupied[0] &= ~(1 << index)
+            slot.sort(key=lambda timer: (timer._time, timer._order))
+            for timer in slot:
+                if timer.is_pending():
+                    self._count -= 1
+                    TIMERS_FIRED.value += 1
+                    timer._fire()
+
+    def _cascade(self):
+        # Move the timers of the coarser wheels down as the finer ones turn around
+        span = 1
+        for wheel in range(1, len(self._wheels)):
+            span *= self._slots
+            if self._tick % span != 0:
+                return
+            self._move(wheel, self._tick // span % self._slots)
+        if self._tick % (span * self._slots) == 0 and self._overflow:
+            timers = self._overflow
+            self._overflow = []
+            for timer in timers:
+                if timer.is_pending():
+                    self._insert(timer)
+
+    def _move(self, wheel: int, index: int):
+        timers = self._wheels[wheel][index]
+        if not timers:
+            return
+        self._wheels[wheel][index] = []
+        self._occupied[wheel] &= ~(1 << index)
+        # Cancelled timers are dropped, they're not counted anymore
+        for timer in timers:
+            if timer.is_pending():
+                self._insert(timer)
+
+    def _insert(self, timer: Timer):
+        delay = timer._tick - self._tick
+        span = 1
+        for wheel in range(len(self._wheels)):
+            if delay < span * self._slots:
+                index = timer._tick // span % self._slots
+                self._wheels[wheel][index].append(timer)
+                self._occupied[wheel] |= 1 << index
+                return
+            span *= self._slots
+        self._overflow.append(timer)
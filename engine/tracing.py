@@ -0,0 +1,114 @@
+from typing import Dict, Any, List
+from collections import deque
+from contextlib import contextmanager
+
+import threading
+import json
+import time
+import os
+
+
+class Tracer:
+    """Records spans of engine work into a ring buffer, which can be exported as a Chrome trace-event file
+    and opened in chrome://tracing or Perfetto. Only the latest events are kept, so the recording can run permanently"""
+    CAPACITY = 100000
+
+    def __init__(self, capacity: int = CAPACITY):
+        # Each event is its phase, name, category, start time, duration (in seconds), thread id and arguments
+        self._events: deque = deque(maxlen=capacity)
+        self._local = threading.local()
+        self._thread_names: Dict[int, str] = {}
+        self._is_enabled = False
+        # Spans opened before the tracing was toggled are dropped, so they don't stay on the stacks of the threads
+        self._generation = 0
+
+    def set_enabled(self, state: bool):
+        self._is_enabled = state
+        self._generation += 1
+
+    def is_enabled(self) -> bool:
+        return self._is_enabled
+
+    def clear(self):
+        self._events.clear()
+
+    def begin(self, name: str, category: str = "engine"):
+        """Opens the span on the current thread. Every span must be closed with the end method"""
+        if not self._is_enabled:
+            return
+        stack = self._get_stack()
+        stack.append((name, category, time.perf_counter()))
+
+    def end(self, args: Dict[str, Any] | None = None):
+        """Closes the last opened span on the current thread and records it"""
+        if not self._is_enabled:
+            return
+        stack = self._get_stack()
+        if not stack:
+            return
+        name, category, start = stack.pop()
+        self.add_span(name, start, time.perf_counter() - start, category, args)
+
+    @contextmanager
+    def span(self, name: str, category: str = "engine", args: Dict[str, Any] | None = None):
+        self.begin(name, category)
+        try:
+            yield
+        finally:
+            self.end(args)
+
+    def add_span(self, name: str, start: float, duration: float, category: str = "engine",
+                 args: Dict[str, Any] | None = None):
+        """Records the span which was measured outside of the tracer. The start is perf_counter time"""
+        if not self._is_enabled:
+            return
+        self._events.append(("X", name, category, start, duration, self._get_thread_id(), args))
+
+    def instant(self, name: str, category: str = "engine", args: Dict[str, Any] | None = None):
+        if not self._is_enabled:
+            return
+        self._events.append(("i", name, category, time.perf_counter(), 0, self._get_thread_id(), args))
+
+    def get_events(self) -> List[Dict[str, Any]]:
+        """Returns recorded events in the trace-event format. Times are in microseconds"""
+        pid = os.getpid()
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in self._thread_names.items()
+        ]
+        for phase, name, category, start, duration, tid, args in list(self._events):
+            event = {"name": name, "cat": category, "ph": phase, "ts": start * 1e6, "pid": pid, "tid": tid}
+            if phase == "X":
+                event["dur"] = duration * 1e6
+            else:
+                event["s"] = "t"
+            if args:
+                event["args"] = args
+            events.append(event)
+        return events
+
+    def export(self, filepath: str) -> bool:
+        """Writes the recorded events to the file. Returns False if the file could not be written"""
+        try:
+            directory = os.path.dirname(filepath)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(filepath, "w", encoding="utf-8") as file:
+                json.dump({"traceEvents": self.get_events(), "displayTimeUnit": "ms"}, file)
+        except OSError as e:
+            print(f"tracing: couldn't write the trace file {filepath}: {e}")
+            return False
+        print(f"tracing: saved {len(self._events)} event(s) to {filepath}")
+        return True
+
+    def _get_stack(self) -> List:
+        if getattr(self._local, "generation", None) != self._generation:
+            self._local.stack = []
+            self._local.generation = self._generation
+        return self._local.stack
+
+    def _get_thread_id(self) -> int:
+        tid = threading.get_ident()
+        if tid not in self._thread_names:
+            self._thread_names[tid] = threading.current_thread().name
+        return tid
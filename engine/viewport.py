@@ -0,0 +1,80 @@
+from typing import Dict, List, Tuple
+
+from .level_objects import Entity, Tile
+from .animation import AnimationProvider
+from .chunk import Chunk
+
+import math
+
+
+class Viewport:
+    """Part of the level which is visible on the screen. Visible chunks of each layer are cached, and found again
+    only when the camera moves to another chunk, the screen size changes or chunks are added or removed"""
+    # Entities are drawn with a few pixels around them in the debug mode, and animations move them further
+    ENTITY_MARGIN = 8 + AnimationProvider.FLOATING_OFFSET
+
+    def __init__(self, level):
+        self._level = level
+        self._screen_size = (0, 0)
+        self._camera_position = (0.0, 0.0)
+        # Chunk the camera is in, which together with the screen size decides the visible chunks
+        self._camera_chunk: Tuple[int, int] | None = None
+        self._visible_chunks: Dict[str, List[Chunk]] = {}
+
+    def update(self, camera_position: Tuple[float, float], screen_size: Tuple[int, int]):
+        """Moves the viewport. The cached chunks are dropped if the camera moved to another chunk"""
+        self._camera_position = tuple(camera_position)
+        camera_chunk = (Chunk.local_coords(camera_position[0] / Tile.TILE_SIZE),
+                        Chunk.local_coords(camera_position[1] / Tile.TILE_SIZE))
+        screen_size = tuple(screen_size)
+        if camera_chunk != self._camera_chunk or screen_size != self._screen_size:
+            self._camera_chunk = camera_chunk
+            self._screen_size = screen_size
+            self._visible_chunks.clear()
+
+    def invalidate(self):
+        """Drops the cached chunks, so they're found again on next use"""
+        self._visible_chunks.clear()
+
+    def get_screen_size(self) -> Tuple[int, int]:
+        return self._screen_size
+
+    def get_visible_chunks(self, layer: str) -> List[Chunk]:
+        if (chunks := self._visible_chunks.get(layer)) is not None:
+            return chunks
+        chunks = self._find_visible_chunks(layer)
+        self._visible_chunks[layer] = chunks
+        return chunks
+
+    def get_visible_entities(self, entities: List[Entity]) -> List[Entity]:
+        """Returns the entities which overlap the screen, in the same order"""
+        width, height = self._screen_size
+        margin = Viewport.ENTITY_MARGIN
+        # The same translation as Level.translate_world_local does, done once for all entities
+        offset_x = width // 2 - round(self._camera_position[0])
+        offset_y = height // 2 + round(self._camera_position[1])
+        visible = []
+        for entity in entities:
+            rect = entity.get_rect()
+            x = rect.x + offset_x
+            y = offset_y - rect.y
+            if x - margin < width and y - margin < height and x + rect.width + margin > 0 \
+                    and y + rect.height + margin > 0:
+                visible.append(entity)
+        return visible
+
+    def _find_visible_chunks(self, layer: str) -> List[Chunk]:
+        if self._camera_chunk is None:
+            return []
+        width = Chunk.local_coords(math.ceil(self._screen_size[0] / Tile.TILE_SIZE)) + 2
+        height = Chunk.local_coords(math.ceil(self._screen_size[1] / Tile.TILE_SIZE)) + 4
+        camera_x, camera_y = self._camera_chunk
+
+        # Iterate through all possible chunks coordinates in the screen bounds
+        chunks = []
+        for x in range(camera_x - width // 2, camera_x + width // 2 + 1):
+            for y in range(camera_y - height // 2, camera_y + height // 2 + 1):
+                chunk = self._level.get_chunk((x, y), layer)
+                if chunk is not None:
+                    chunks.append(chunk)
+        return chunks
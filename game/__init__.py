@@ -4,3 +4,4 @@ from .gui import *
 from .main_level import *
 from .player import *
 from .main_menu import *
+from .scenario import *
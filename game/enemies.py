@@ -1,5 +1,5 @@
 from pgzero.rect import Rect
-from engine import Entity, Sprite, Tile, Direction
+from engine import Entity, EntityState, Sprite, Tile, Direction, Timer
 
 from .player import Player
 from .weapon import *
@@ -11,82 +11,156 @@ import random
 import math
 
 
+class EnemyState(EntityState):
+    """What the enemy decides from, captured together with the snapshot"""
+    def __init__(self, enemy: "Enemy"):
+        super().__init__(enemy)
+        self.prey = enemy.prey
+        self.enable_ai = enemy.enable_ai
+        self.can_search_prey = enemy.prey_search_cooldown.is_fired()
+
+
+class RobotState(EnemyState):
+    def __init__(self, robot: "RobotEnemy"):
+        super().__init__(robot)
+        self.moving_direction = robot.moving_direction
+        self.speed = robot.speed
+        self.was_following = robot.was_following
+        self.is_stuck = robot.is_stuck
+        self.can_shoot = robot.shoot_cooldown.is_fired()
+        self.can_jump_attack = robot.jump_attack_cooldown.is_fired()
+
+
+class FlyState(EnemyState):
+    def __init__(self, fly: "FlyEnemy"):
+        super().__init__(fly)
+        self.can_shoot = fly.shoot_cooldown.is_fired()
+
+
+class EnemyDecision:
+    """What the enemy decided from the snapshot, applied during its think"""
+    def __init__(self, prey: Entity | None, searched_prey: bool):
+        self.prey = prey
+        # The prey search cooldown was used, so it has to be started again
+        self.searched_prey = searched_prey
+        self.shoot_direction: List[int] | None = None
+
+
+class RobotDecision(EnemyDecision):
+    def __init__(self, prey: Entity | None, searched_prey: bool, moving_direction: int, speed: float,
+                 was_following: bool):
+        super().__init__(prey, searched_prey)
+        self.moving_direction = moving_direction
+        self.speed = speed
+        self.was_following = was_following
+        self.jump = False
+
+
+class FlyDecision(EnemyDecision):
+    def __init__(self, prey: Entity | None, searched_prey: bool, speed: float, target_pos: List[float] | None):
+        super().__init__(prey, searched_prey)
+        self.speed = speed
+        self.target_pos = target_pos
+
+
 class Enemy(Entity):
+    # Enemies make their decisions in decide and think, and only follow them every frame
+    THINK_RATE = 10
+    PREY_SEARCH_INTERVAL = 2
+    # Dead enemies fall down before they're removed
+    DESPAWN_TIME = 5
+
     def __init__(self, position: List[float], size: List[float], sprite: Sprite = None):
         super().__init__(position, size, sprite)
         self.enable_ai = True
         self.prey: Entity | None = None
-        self.prey_search_timeout = 0
         self.hit_strength = 1
-        self.despawn_timeout = -1
+        self.despawn_timer: Timer | None = None
+        self.prey_search_cooldown: Timer | None = None
 
     def on_collision(self, game, obj, top, bottom, right, left):
         if isinstance(obj, Player) and obj.hp > 0 and self.hp > 0:
             obj.hit(self, self.hit_strength)
     
-    def update(self, game, level, dt):
-        super().update(game, level, dt)
+    def being_added(self, game, level):
+        super().being_added(game, level)
+        self.prey_search_cooldown = self.schedule(Enemy.PREY_SEARCH_INTERVAL)
+
+    def capture_state(self) -> EnemyState:
+        return EnemyState(self)
 
-        if self.prey:
-            if self.prey.hp <= 0 or not isinstance(self.prey, Player):
+    def decide_prey(self, snapshot, state: EnemyState) -> Tuple[Entity | None, EntityState | None, bool]:
+        """Returns the prey after checking it's still alive and near, or after looking for one every few
+        seconds while we don't have any. Also returns its state and whether the search cooldown was used"""
+        prey, prey_state = state.prey, None
+        if prey:
+            prey_state = snapshot.get_state(prey)
+            if prey_state is None or prey_state.get_hp() <= 0 or not isinstance(prey, Player):
                 # The prey has died
-                self.prey = None
-            elif self.prey.distance(self) / Tile.TILE_SIZE > 30:
+                prey, prey_state = None, None
+            elif prey_state.distance(state.get_position()) / Tile.TILE_SIZE > 30:
                 # We're too far from the prey
-                self.prey = None
+                prey, prey_state = None, None
 
-        if self.despawn_timeout != -1 and self.despawn_timeout < self._tick:
-            self.destroy()
+        searched_prey = state.can_search_prey
+        if searched_prey and prey is None:
+            prey_state = self.find_prey(snapshot, state)
+            prey = prey_state.get_entity() if prey_state else None
+        return prey, prey_state, searched_prey
+
+    def think(self, game, level, decision: EnemyDecision | None):
+        if decision is None:
             return
-        
+        self.prey = decision.prey
+        if decision.searched_prey:
+            self.prey_search_cooldown = self.schedule(Enemy.PREY_SEARCH_INTERVAL)
+        if decision.shoot_direction:
+            self.shoot(decision.shoot_direction)
+
+    def update(self, game, level, dt):
+        super().update(game, level, dt)
+
         if self.hp <= 0:
-            if self.despawn_timeout == -1:
+            if self.despawn_timer is None:
                 self.mass = 1
-                self.despawn_timeout = self._tick + 5
+                self.despawn_timer = self.schedule(Enemy.DESPAWN_TIME, self.destroy)
                 self.get_sprite().enable_animation(False)
                 self.set_velocity(0, 1)
-            return
-        
-        # Find prey to attack
-        if self.prey is None:
-            if self.prey_search_timeout + 2 < self._tick:
-                self.prey_search_timeout = self._tick
-                self.prey = self.find_prey(level)
-        else:
-            # Search for new prey if current one is dead
-            if self.prey.hp <= 0:
-                self.prey = None
 
     def shoot(self, direction: Tuple[int, int]):
         firebool = Fireball(self, list(self.get_position()), direction)
         self._level.add_entity(firebool)
     
-    def find_prey(self, level) -> Entity | None:
-        if not self.enable_ai:
+    def find_prey(self, snapshot, state: EnemyState) -> EntityState | None:
+        if not state.enable_ai:
             return None
         
-        entities = level.get_entities()
-        for entity in entities:
-            if not isinstance(entity, Player) or entity.hp <= 0:
+        for player_state in snapshot.get_players():
+            if not isinstance(player_state.get_entity(), Player) or player_state.get_hp() <= 0:
                 continue
-            dst = entity.distance(self) / Tile.TILE_SIZE
+            dst = player_state.distance(state.get_position()) / Tile.TILE_SIZE
             if dst < 20:
-                return entity
+                return player_state
         
         return None
 
 
 class RobotEnemy(Enemy):
+    SHOOT_INTERVAL = 3
+    JUMP_ATTACK_INTERVAL = 1
+    POSITION_CHECK_INTERVAL = 2
+
     def __init__(self):
         super().__init__([0, 0], [Tile.TILE_SIZE, Tile.TILE_SIZE], sprite=Sprite(["robot0", "robot1"], interval=0.1))
         w, h = self._rect.width * 0.96, self._rect.height * 0.96
         self.set_bounding_box(Rect((self._rect.width - w) // 2, (self._rect.height - h) // 2, w, h))
         self.moving_direction = -1
-        self.shoot_timeout = 0
         self.was_following = False
-        self.jump_attack_timeout = 0
-        self.position_check_timeout = 0
+        # Cooldowns are timers without a callback, the action is allowed once they fire
+        self.shoot_cooldown: Timer | None = None
+        self.jump_attack_cooldown: Timer | None = None
         self.last_position = [0, 0]
+        self.is_stuck = False
         self.speed = 1
         self.has_to_jump = False
         
@@ -100,74 +174,131 @@ class RobotEnemy(Enemy):
         if not top and not bottom and (left or right):# and obj.is_static and obj.has_collision:
             self.has_to_jump = True
 
-    def update(self, game, level, dt):
-        super().update(game, level, dt)
+    def being_added(self, game, level):
+        super().being_added(game, level)
+        self.shoot_cooldown = self.schedule(RobotEnemy.SHOOT_INTERVAL)
+        self.jump_attack_cooldown = self.schedule(RobotEnemy.JUMP_ATTACK_INTERVAL)
+        self.schedule(RobotEnemy.POSITION_CHECK_INTERVAL, self._check_position)
+
+    def _check_position(self):
+        # If the robot's position haven't changed since the last check, it has to change direction
         if self.hp <= 0:
             return
-        
-        if self.has_to_jump:
-            self.has_to_jump = False
-            if self.is_on_ground():
-                self.jump()
-        
+        if self.last_position == self.get_position():
+            self.is_stuck = True
+        self.last_position = self.get_position()
+        self.schedule(RobotEnemy.POSITION_CHECK_INTERVAL, self._check_position)
+
+    def capture_state(self) -> RobotState:
+        return RobotState(self)
+
+    def get_think_tiles(self, snapshot) -> List[Tuple[int, int]]:
+        state = snapshot.get_state(self)
+        if state.get_hp() <= 0:
+            return []
+        # The direction is turned around when the robot stops following its prey, so look both ways then
+        tiles = self._ledge_probe(state.get_position(), state.moving_direction)
+        if state.was_following:
+            tiles += self._ledge_probe(state.get_position(), -state.moving_direction)
+        return tiles
+
+    def decide(self, snapshot) -> RobotDecision | None:
+        state = snapshot.get_state(self)
+        if state.get_hp() <= 0:
+            return None
+        prey, prey_state, searched_prey = self.decide_prey(snapshot, state)
+        decision = RobotDecision(prey, searched_prey, state.moving_direction, state.speed, state.was_following)
+
         # Set moving direction towards prey if any
-        if self.prey:
-            self.speed = 1.4
-            self.was_following = True
-            self.moving_direction = round(self.direction(self.prey)[0])
+        position = state.get_position()
+        if prey:
+            decision.speed = 1.4
+            decision.was_following = True
+            decision.moving_direction = round(prey_state.direction(position)[0])
             
             # Shoot at the player after timeout
-            if self.shoot_timeout + 3 < self._tick and self.prey.distance(self) / Tile.TILE_SIZE < 10:
-                self.shoot_timeout = self._tick
-                self.shoot(self.direction(self.prey, strength=3))
+            if state.can_shoot and prey_state.distance(position) / Tile.TILE_SIZE < 10:
+                decision.shoot_direction = prey_state.direction(position, strength=3)
             
             # Make a jump attack if the robot is two tiles away from the player.
             # Do this only once every second
-            if self.jump_attack_timeout + 1 < self._tick and self.distance(self.prey) <= Tile.TILE_SIZE * 2 and self.is_on_ground():
-                self.jump_attack_timeout = self._tick
-                self.jump()
-        elif self.was_following:
-            self.was_following = False
-            self.moving_direction *= -1
-            self.speed = 1
+            if state.can_jump_attack and prey_state.distance(position) <= Tile.TILE_SIZE * 2 \
+                    and state.is_on_ground():
+                decision.jump = True
+        elif decision.was_following:
+            decision.was_following = False
+            decision.moving_direction *= -1
+            decision.speed = 1
         
         # If the robot would fall going one more tile, change its direction.
         # Only do this if we're not attacking the prey
-        pos = list(self.get_position())
         change_direction = False
-        if not self.prey:
-            found_tile = False
-            for i in range(5):
-                pos[0] = pos[0] // Tile.TILE_SIZE * Tile.TILE_SIZE + Tile.TILE_SIZE * self.moving_direction
-                pos[1] = pos[1] // Tile.TILE_SIZE * Tile.TILE_SIZE - (Tile.TILE_SIZE * i)
-                tile = self._level.get_tile(pos, layer="layer0")
-                if tile:
-                    found_tile = True
-                    break
-            if not found_tile:
+        if not prey:
+            tiles = self._ledge_probe(position, decision.moving_direction)
+            if not any(snapshot.has_tile(tile_position) for tile_position in tiles):
                 change_direction = True
         
         # If the robot's position haven't changed in last 2 seconds, change direction
-        if self.position_check_timeout + 2 < self._tick:
-            self.position_check_timeout = self._tick
-            if self.last_position == self.get_position():
-                change_direction = True
-            self.last_position = self.get_position()
+        if state.is_stuck:
+            change_direction = True
         
         if change_direction:
-            self.moving_direction *= -1
+            decision.moving_direction *= -1
+        return decision
+
+    def think(self, game, level, decision: RobotDecision | None):
+        if decision is None:
+            return
+        if decision.shoot_direction:
+            self.shoot_cooldown = self.schedule(RobotEnemy.SHOOT_INTERVAL)
+        super().think(game, level, decision)
+        self.moving_direction = decision.moving_direction
+        self.speed = decision.speed
+        self.was_following = decision.was_following
+        self.is_stuck = False
+        if decision.jump:
+            self.jump_attack_cooldown = self.schedule(RobotEnemy.JUMP_ATTACK_INTERVAL)
+            self.jump()
+
+    @classmethod
+    def _ledge_probe(cls, position: Tuple[float, float], moving_direction: int) -> List[Tuple[int, int]]:
+        # Tiles in front of the robot, one of which has to exist for the robot not to fall
+        pos = list(position)
+        tiles = []
+        for i in range(5):
+            pos[0] = pos[0] // Tile.TILE_SIZE * Tile.TILE_SIZE + Tile.TILE_SIZE * moving_direction
+            pos[1] = pos[1] // Tile.TILE_SIZE * Tile.TILE_SIZE - (Tile.TILE_SIZE * i)
+            tiles.append((pos[0], pos[1]))
+        return tiles
+
+    def update(self, game, level, dt):
+        super().update(game, level, dt)
+        if self.hp <= 0:
+            return
         
+        if self.has_to_jump:
+            self.has_to_jump = False
+            if self.is_on_ground():
+                self.jump()
+        
+        # Keep moving in the direction chosen during the last think
         self.add_velocity(self.moving_direction * self.speed, 0)
         self.set_facing_direction(Direction.EAST if self.moving_direction == 1 else Direction.WEST)
 
 
 class FlyEnemy(Enemy):
+    SHOOT_INTERVAL = 3
+    # Tiles above the ground the fly tries to keep following its prey
+    GROUND_DISTANCE = 6
+
     def __init__(self):
         super().__init__([0, 0], [Tile.TILE_SIZE * 0.9, Tile.TILE_SIZE * 0.9], sprite=Sprite(["fly0", "fly1", "fly2", "fly1"], interval=0.1))
         w, h = self._rect.width * 0.6, self._rect.height * 0.6
         self.set_bounding_box(Rect((self._rect.width - w) // 2, (self._rect.height - h) // 2, w, h))
         self.flying_around_pos = None
-        self.shoot_timeout = 0
+        # Position near the prey the fly moves to
+        self.target_pos: List[float] | None = None
+        self.shoot_cooldown: Timer | None = None
         self.hit_strength = 2
         self.speed = 1
         self.mass = 0
@@ -175,6 +306,10 @@ class FlyEnemy(Enemy):
         self.max_hp = 10
         self.hp = 10
 
+    def being_added(self, game, level):
+        super().being_added(game, level)
+        self.shoot_cooldown = self.schedule(FlyEnemy.SHOOT_INTERVAL)
+
     def update(self, game, level, dt):
         super().update(game, level, dt)
         if self.hp <= 0:
@@ -198,21 +333,54 @@ class FlyEnemy(Enemy):
         self.set_velocity(max(min(vel[0], 6), -6), max(min(vel[1], 6), -6))
         self.set_facing_direction(Direction.WEST if self.get_velocity()[0] < 0 else Direction.EAST)
         
-        if self.prey:
-            prey_pos = list(self.prey.get_position())
-            
-            # Shoot at the player after timeout
-            if self.shoot_timeout + 3 < self._tick and self.prey.distance(self) / Tile.TILE_SIZE < 10:
-                self.shoot_timeout = self._tick
-                self.shoot(self.direction(self.prey, strength=3))
-            
-            self.speed = 2
-            
-            # Follow the player. Also try not to be too close to the ground
-            distance_to_ground = self.prey.distance_ground(max_iterations=6)
-            prey_pos[1] += (6 - distance_to_ground) * Tile.TILE_SIZE
-            
-            self.flying_around_pos[0] += (prey_pos[0] - self.flying_around_pos[0]) * 0.002
-            self.flying_around_pos[1] += (prey_pos[1] - self.flying_around_pos[1]) * 0.002
+        # Follow the target chosen during the last think
+        if self.target_pos:
+            self.flying_around_pos[0] += (self.target_pos[0] - self.flying_around_pos[0]) * 0.002
+            self.flying_around_pos[1] += (self.target_pos[1] - self.flying_around_pos[1]) * 0.002
+
+    def capture_state(self) -> FlyState:
+        return FlyState(self)
+
+    def get_think_tiles(self, snapshot) -> List[Tuple[int, int]]:
+        # The ground below the prey, or below the player who may become the prey
+        state = snapshot.get_state(self)
+        if state.prey is not None:
+            target = snapshot.get_state(state.prey)
         else:
-            self.speed = 1
+            target = next(iter(snapshot.get_players()), None)
+        if state.get_hp() <= 0 or target is None:
+            return []
+        x = target.get_position()[0] // Tile.TILE_SIZE * Tile.TILE_SIZE
+        y = target.get_position()[1] // Tile.TILE_SIZE * Tile.TILE_SIZE
+        return [(x, y - i * Tile.TILE_SIZE) for i in range(FlyEnemy.GROUND_DISTANCE)]
+
+    def decide(self, snapshot) -> FlyDecision | None:
+        state = snapshot.get_state(self)
+        if state.get_hp() <= 0:
+            return None
+        prey, prey_state, searched_prey = self.decide_prey(snapshot, state)
+        if not prey:
+            return FlyDecision(prey, searched_prey, 1, None)
+
+        decision = FlyDecision(prey, searched_prey, 2, None)
+        position = state.get_position()
+        prey_pos = list(prey_state.get_position())
+        
+        # Shoot at the player after timeout
+        if state.can_shoot and prey_state.distance(position) / Tile.TILE_SIZE < 10:
+            decision.shoot_direction = prey_state.direction(position, strength=3)
+        
+        # Follow the player. Also try not to be too close to the ground
+        distance_to_ground = snapshot.distance_ground(prey_pos, max_iterations=FlyEnemy.GROUND_DISTANCE)
+        prey_pos[1] += (FlyEnemy.GROUND_DISTANCE - distance_to_ground) * Tile.TILE_SIZE
+        decision.target_pos = prey_pos
+        return decision
+
+    def think(self, game, level, decision: FlyDecision | None):
+        if decision is None:
+            return
+        if decision.shoot_direction:
+            self.shoot_cooldown = self.schedule(FlyEnemy.SHOOT_INTERVAL)
+        super().think(game, level, decision)
+        self.speed = decision.speed
+        self.target_pos = decision.target_pos
@@ -1,6 +1,6 @@
 from pgzero.rect import Rect
 from engine import Gui, Sprite, Entity, Button, Alignment,\
-    AnimationProvider, Panel, Text, Image, ImageButton, ease_in_out_circ
+    AnimationProvider, Panel, Text, Image, ImageButton, ease_in_out_circ, gui_clock
 
 from .powerup import PowerupTypes
 
@@ -18,7 +18,7 @@ class LevelGui(Gui):
     def __init__(self, player: Entity):
         super(LevelGui, self).__init__()
         self.player = player
-        self.heart_sprite = Sprite(["heart_full"])
+        self.heart_sprite = Sprite(["heart_full"], clock=gui_clock)
         self.escape_pressed = False
         
         # Setting up the game over panel
@@ -38,10 +38,10 @@ class LevelGui(Gui):
         self.time_text = Text("Время: 0", [14, LevelGui.ICON_SIZE + 80], font_size=20)
         self.total_kills_text = Text("Убийств: 0", [14, LevelGui.ICON_SIZE + 112], font_size=20)
         self.fps_text = Text("FPS: 0", [14, -70], font_size=20)
-        self.mute_music = ImageButton(Sprite(["mute0", "mute1"]), Rect(5, -5, 48, 48), handler=self._toggle_music, is_toggle=True)
+        self.mute_music = ImageButton(Sprite(["mute0", "mute1"], clock=gui_clock), Rect(5, -5, 48, 48), handler=self._toggle_music, is_toggle=True)
 
         # Powerups
-        self.coin_image = Image(Sprite(["coin0"]), Rect(5, LevelGui.ICON_SIZE + 16, LevelGui.ICON_SIZE, LevelGui.ICON_SIZE))
+        self.coin_image = Image(Sprite(["coin0"], clock=gui_clock), Rect(5, LevelGui.ICON_SIZE + 16, LevelGui.ICON_SIZE, LevelGui.ICON_SIZE))
         self.coin_text = Text("0", [64, LevelGui.ICON_SIZE + 18], font_size=28)
         
         # Powerups shop
@@ -62,7 +62,7 @@ class LevelGui(Gui):
                 ImageButton(powerup.value.sprite, rect=Rect(-74, -5 + y_offset, 64, 64), handler=self._buy_powerup(idx)),
                 align=Alignment.BOTTOM | Alignment.RIGHT)
             self.powerups_shop_panel.add_element(
-                Image(Sprite(["coin0"]), Rect(-10, -14 + y_offset, LevelGui.ICON_SIZE, LevelGui.ICON_SIZE)),
+                Image(Sprite(["coin0"], clock=gui_clock), Rect(-10, -14 + y_offset, LevelGui.ICON_SIZE, LevelGui.ICON_SIZE)),
                 align=Alignment.BOTTOM | Alignment.RIGHT)
             self.powerups_shop_panel.add_element(text, align=Alignment.BOTTOM | Alignment.RIGHT)
             y_offset -= LevelGui.ICON_SIZE + 18
@@ -155,7 +155,6 @@ class LevelGui(Gui):
 
     def update(self, game, level, dt):
         super().update(game, level, dt)
-        self.heart_sprite.update(game, dt)
         
         # Shot the game over panel if player is dead
         if self.player.hp <= 0:
@@ -206,7 +205,7 @@ class MainMenuGui(Gui):
         self.exit_btn = Button("Выйти", rect=Rect(0, 16, 160, 64), handler=self._close_game)
         self.debug_btn = Button("Отладка", rect=Rect(0, 120, 160, 64), handler=self._toggle_debug, is_toggle=True, btn_type=1)
         self.title_text = Text("Super mega game", [0, 0], font_size=32, color=(252, 249, 141))
-        self.mute_music = ImageButton(Sprite(["mute0", "mute1"]), Rect(5, -5, 48, 48), handler=self._toggle_music, is_toggle=True)
+        self.mute_music = ImageButton(Sprite(["mute0", "mute1"], clock=gui_clock), Rect(5, -5, 48, 48), handler=self._toggle_music, is_toggle=True)
         self.info_text = Text(MENU_INFO_TEXT, [10, 10], font_size=20)
         
         self.add_element(self.new_game_btn, align=Alignment.CENTER)
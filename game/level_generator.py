@@ -0,0 +1,150 @@
+"""Generates level files of any size for stress tests and benchmarks.
+Run from the repository root: python -m game.level_generator stress.level --width 400 --height 120 --robots 50"""
+from typing import Dict, List
+
+import argparse
+import random
+import sys
+
+# Decorations which grow on top of the grass, with their probability for each surface column
+DEFAULT_TILE_MIX = {"B": 0.15, "T": 0.04, "K": 0.02}
+
+
+class LevelGenerator:
+    """Builds a level with the ground of a random height, floating platforms and decorations.
+    Entities, mines and coins are placed where they can exist: robots, mines and coins on the ground or platforms,
+    flies in the air. The same seed always generates the same level"""
+    def __init__(self,
+                 width: int = 256,
+                 height: int = 96,
+                 seed: int = 0,
+                 terrain_density: float = 0.4,
+                 roughness: int = 1,
+                 platform_density: float = 0.04,
+                 platform_length: int = 6,
+                 tile_mix: Dict[str, float] | None = None,
+                 robots: int = 0,
+                 flies: int = 0,
+                 mines: int = 0,
+                 coins: int = 0):
+        self.width = max(width, 8)
+        self.height = max(height, 8)
+        self.seed = seed
+        # Average part of the level height which is filled with the ground
+        self.terrain_density = min(max(terrain_density, 0.0), 0.9)
+        # Maximal change of the ground height between two columns
+        self.roughness = roughness
+        # Platforms per column, and their maximal length
+        self.platform_density = platform_density
+        self.platform_length = platform_length
+        self.tile_mix = DEFAULT_TILE_MIX if tile_mix is None else tile_mix
+        self.robots = robots
+        self.flies = flies
+        self.mines = mines
+        self.coins = coins
+
+    def generate(self) -> List[str]:
+        """Returns rows of the level from the top to the bottom"""
+        rng = random.Random(self.seed)
+        grid = [[" "] * self.width for _ in range(self.height)]
+
+        # The ground is a random walk around the average height
+        average = round(self.height * self.terrain_density)
+        ground = average
+        surface: List[int] = []
+        for x in range(self.width):
+            ground += rng.randint(-self.roughness, self.roughness)
+            # Pull the ground back to the average height, so it won't leave the level
+            ground += (average > ground) - (average < ground) if rng.random() < 0.2 else 0
+            ground = min(max(ground, 1), self.height - 8)
+            surface.append(self.height - ground)
+            for y in range(self.height - ground, self.height):
+                grid[y][x] = "D"
+            grid[self.height - ground][x] = "G"
+
+        # Floating platforms of clouds and grass. They're kept a few tiles above the ground
+        # and below the top of the level, so entities can stand on them
+        for _ in range(round(self.width * self.platform_density)):
+            length = rng.randint(2, max(self.platform_length, 2))
+            x = rng.randrange(0, max(self.width - length, 1))
+            top = min(surface[x:x + length]) - 4
+            if top < 4:
+                continue
+            y = rng.randint(3, top)
+            char = rng.choice("OG")
+            for idx in range(x, min(x + length, self.width)):
+                grid[y][idx] = char
+
+        # Decorations on top of the grass
+        for x, y in enumerate(surface):
+            if y < 1 or grid[y - 1][x] != " ":
+                continue
+            value = rng.random()
+            for char, probability in self.tile_mix.items():
+                if value < probability:
+                    grid[y - 1][x] = char
+                    break
+                value -= probability
+
+        # The player spawns in the middle of the level
+        spawn_x = self.width // 2
+        grid[surface[spawn_x] - 2][spawn_x] = "P"
+
+        standing = [(x, y - 1) for y in range(1, self.height) for x in range(self.width)
+                    if grid[y][x] in "GOD" and grid[y - 1][x] == " "]
+        flying = [(x, y) for y in range(self.height) for x in range(self.width)
+                  if grid[y][x] == " " and y < surface[x] - 2]
+        self._place(rng, grid, standing, "R", self.robots)
+        self._place(rng, grid, standing, "M", self.mines)
+        self._place(rng, grid, standing, "C", self.coins)
+        self._place(rng, grid, flying, "F", self.flies)
+        return ["".join(row).rstrip() for row in grid]
+
+    def write(self, filepath: str):
+        with open(filepath, "w", encoding="utf-8") as file:
+            file.write("layer0:\n" + "\n".join(self.generate()) + "\n")
+
+    @classmethod
+    def _place(cls, rng: random.Random, grid: List[List[str]], positions: List[tuple], char: str, count: int):
+        free = [(x, y) for x, y in positions if grid[y][x] == " "]
+        for x, y in rng.sample(free, min(count, len(free))):
+            grid[y][x] = char
+
+
+def parse_tile_mix(value: str) -> Dict[str, float]:
+    """Parses the tile mix in the form of "B=0.15,T=0.04" """
+    tile_mix = {}
+    for item in filter(None, value.split(",")):
+        char, probability = item.split("=")
+        tile_mix[char.strip()] = float(probability)
+    return tile_mix
+
+
+def main(args: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m game.level_generator", description="Generates a level file")
+    parser.add_argument("output", help="level file to write")
+    parser.add_argument("--width", type=int, default=256)
+    parser.add_argument("--height", type=int, default=96)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--density", type=float, default=0.4, help="part of the level height filled with the ground")
+    parser.add_argument("--roughness", type=int, default=1, help="maximal change of the ground height per column")
+    parser.add_argument("--platforms", type=float, default=0.04, help="floating platforms per column")
+    parser.add_argument("--platform-length", type=int, default=6)
+    parser.add_argument("--mix", type=parse_tile_mix, default=None,
+                        help="decorations on the grass with their probabilities, e.g. B=0.15,T=0.04,K=0.02")
+    parser.add_argument("--robots", type=int, default=0)
+    parser.add_argument("--flies", type=int, default=0)
+    parser.add_argument("--mines", type=int, default=0)
+    parser.add_argument("--coins", type=int, default=0)
+    arguments = parser.parse_args(args)
+
+    generator = LevelGenerator(arguments.width, arguments.height, arguments.seed, arguments.density,
+                               arguments.roughness, arguments.platforms, arguments.platform_length, arguments.mix,
+                               arguments.robots, arguments.flies, arguments.mines, arguments.coins)
+    generator.write(arguments.output)
+    print(f"level_generator: saved {arguments.width}x{arguments.height} level to {arguments.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,12 +6,19 @@ from .tiles import DirtTile, CoinPowerupTile, GrassBladeTile, \
 from .gui import LevelGui
 from .powerup import PowerupTypes, PowerupProps
 from .enemies import FlyEnemy, RobotEnemy, Enemy
-from engine import Tile, Level, Entity
+from .scenario import Scenario
+from engine import Tile, Level, Entity, Timer
+
+from typing import Dict
 
 import random
 
 
 class MainLevel(Level):
+    # Most enemies spawned around the player late in the game. Enemies think only a few times per second,
+    # so more of them fit in a frame
+    MAX_NEARBY_ENEMIES = 30
+
     def __init__(self):
         super(MainLevel, self).__init__("main.level", Player([1024, 1024]))
         self.set_bg_color((65, 201, 226))
@@ -42,13 +49,35 @@ class MainLevel(Level):
         self.capture_entity(self._player)
         
         self.powerup_spawn_timeout = -1
-        self.enemy_spawn_timeout = -1
+        # Enemies are spawned right after the level starts
+        self.enemy_spawn_timer = self.schedule(0, self._spawn_enemies)
         self.total_kills = 0
         self.alive_time = 0
         self.best_time = 0
         self.coins = 10
         self.powerups = {}
         self.active_powerups = {}
+        # Timers removing each active powerup once it expires
+        self.powerup_timers: Dict[PowerupTypes, Timer] = {}
+        self._scenario: Scenario | None = None
+        self._scenario_started = False
+
+    def set_scenario(self, scenario: Scenario | None):
+        """Sets the stress scenario, which is started once the level is shown.
+        If the scenario has its own level file, it's loaded instead of the main level"""
+        self._scenario = scenario
+        self._scenario_started = False
+        if scenario is not None and scenario.level:
+            self._level_source_file = scenario.level
+
+    def get_scenario(self) -> Scenario | None:
+        return self._scenario
+
+    def shown(self, game) -> None:
+        super().shown(game)
+        if self._scenario is not None and not self._scenario_started:
+            self._scenario_started = True
+            self._scenario.start(self)
     
     def killed_entity(self, entity: Entity):
         # Player killed an entity
@@ -69,7 +98,11 @@ class MainLevel(Level):
         self._player.hp = self._player.max_hp
         self.alive_time = 0
         self.total_kills = 0
-        self.enemy_spawn_timeout = -1
+        self.enemy_spawn_timer.cancel()
+        self.enemy_spawn_timer = self.schedule(0, self._spawn_enemies)
+        for timer in self.powerup_timers.values():
+            timer.cancel()
+        self.powerup_timers = {}
         self.active_powerups = {}
         self.coins = 10
         self._gui.powerups = [
@@ -110,11 +143,14 @@ class MainLevel(Level):
             
             if powerup_type in self.active_powerups:
                 self.active_powerups[powerup_type][0] += duration
+                self.powerup_timers.pop(powerup_type).cancel()
             else:
                 self.active_powerups[powerup_type] = [
                     self._ticks + duration,
                     props.sprite,
                 ]
+            self.powerup_timers[powerup_type] = self.schedule(
+                self.active_powerups[powerup_type][0] - self._ticks, self._expire_powerup, powerup_type)
             collected = True
         
         if collected:
@@ -134,15 +170,17 @@ class MainLevel(Level):
     
     def has_powerup(self, powerup: PowerupTypes):
         return powerup in self.active_powerups
+
+    def _expire_powerup(self, powerup: PowerupTypes):
+        self.active_powerups.pop(powerup, None)
+        self.powerup_timers.pop(powerup, None)
     
     def update(self, game, dt) -> None:
         super().update(game, dt)
         
-        # Remove all expired active powerups
-        for key, powerup in self.active_powerups.copy().items():
-            if self._ticks > powerup[0]:
-                self.active_powerups.pop(key)
-        
+        if self._scenario is not None and self._scenario_started:
+            self._scenario.update(self, self._ticks)
+
         # Update the alive time if player is not dead
         if not self._is_paused:
             if self._player.hp > 0:
@@ -150,7 +188,6 @@ class MainLevel(Level):
             if self.alive_time > self.best_time:
                 self.best_time = self.alive_time
         
-        enemies = [RobotEnemy, FlyEnemy]
         powerups = [HpPowerupTile, CoinPowerupTile, DoubleFireballPowerupTile, ShieldPowerupTile, FastShootingPowerupTile]
         
         # Spawn powerup every 3 seconds randomly on the map
@@ -191,50 +228,51 @@ class MainLevel(Level):
 
             self.set_tile(powerup(), powerup_position, "layer0")
             self.powerups[powerup_position] = powerup
-                    
+
+    def _spawn_enemies(self):
         # Spawn enemies if none of them were found 30 tiles around the player.
         # Also calculate the timeout and about of entities that should be around the player based on kills amount
         spawn_timeout = max(3, 10 - (self.alive_time / 60))
-        amount_of_entities = min(20, 2 * round(self.alive_time / 60))
+        amount_of_entities = min(MainLevel.MAX_NEARBY_ENEMIES, 2 * round(self.alive_time / 60))
         entities = self.get_entities()
-        if self.enemy_spawn_timeout == -1 or self.enemy_spawn_timeout + spawn_timeout < self._ticks:
-            self.enemy_spawn_timeout = self._ticks
-            
-            min_distance = -1
-            near_entities = 0
-            for entity in entities:
-                if entity == self._player:
-                    continue
-                dst = entity.distance(self._player) / Tile.TILE_SIZE
-                if min_distance == -1 or min_distance > dst:
-                    min_distance = dst
-                if dst < 20:
-                    near_entities += 1
+        enemies = [RobotEnemy, FlyEnemy]
+        self.enemy_spawn_timer = self.schedule(spawn_timeout, self._spawn_enemies)
+        
+        min_distance = -1
+        near_entities = 0
+        for entity in entities:
+            if entity == self._player:
+                continue
+            dst = entity.distance(self._player) / Tile.TILE_SIZE
+            if min_distance == -1 or min_distance > dst:
+                min_distance = dst
+            if dst < 20:
+                near_entities += 1
+        
+        if min_distance > 20 or min_distance == -1 or near_entities < amount_of_entities:
+            enemy_instance = random.choice(enemies)()
             
-            if min_distance > 20 or min_distance == -1 or near_entities < amount_of_entities:
-                enemy_instance = random.choice(enemies)()
-                
-                # Find position around the player where we can place the enemy
-                player_position = list(self._player.get_position())
-                player_position[0] = int(player_position[0] / Tile.TILE_SIZE) * Tile.TILE_SIZE + random.randint(-3, 3) * Tile.TILE_SIZE
-                player_position[1] = int(player_position[1] / Tile.TILE_SIZE) * Tile.TILE_SIZE + random.randint(-3, 3) * Tile.TILE_SIZE
-                found_position = None
-                for x in range(-5, 5):
-                    for y in range(-6, 6):
-                        y *= -1
-                        pos = player_position[0] + x * Tile.TILE_SIZE, player_position[1] + y * Tile.TILE_SIZE
-                        if not self.get_tile(pos, "layer0"):
-                            # For the robot we also need to check that there's solid tile under it
-                            if isinstance(enemy_instance, RobotEnemy):
-                                if self.get_tile([pos[0], pos[1] - Tile.TILE_SIZE], "layer0"):
-                                    found_position = pos
-                                    break
-                            else:
+            # Find position around the player where we can place the enemy
+            player_position = list(self._player.get_position())
+            player_position[0] = int(player_position[0] / Tile.TILE_SIZE) * Tile.TILE_SIZE + random.randint(-3, 3) * Tile.TILE_SIZE
+            player_position[1] = int(player_position[1] / Tile.TILE_SIZE) * Tile.TILE_SIZE + random.randint(-3, 3) * Tile.TILE_SIZE
+            found_position = None
+            for x in range(-5, 5):
+                for y in range(-6, 6):
+                    y *= -1
+                    pos = player_position[0] + x * Tile.TILE_SIZE, player_position[1] + y * Tile.TILE_SIZE
+                    if not self.get_tile(pos, "layer0"):
+                        # For the robot we also need to check that there's solid tile under it
+                        if isinstance(enemy_instance, RobotEnemy):
+                            if self.get_tile([pos[0], pos[1] - Tile.TILE_SIZE], "layer0"):
                                 found_position = pos
                                 break
-                    if found_position:
-                        break
-                
+                        else:
+                            found_position = pos
+                            break
                 if found_position:
-                    enemy_instance.set_position(found_position)
-                    self.add_entity(enemy_instance)
+                    break
+            
+            if found_position:
+                enemy_instance.set_position(found_position)
+                self.add_entity(enemy_instance)
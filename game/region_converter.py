@@ -0,0 +1,30 @@
+"""Converts a level file into a region world, which the level streams around the camera instead of loading it whole.
+Run from the repository root: python -m game.region_converter main.level worlds/main
+The directory can then be used as the level source in place of the level file"""
+from typing import List
+
+import argparse
+import time
+import sys
+
+
+def main(args: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m game.region_converter",
+                                     description="Converts a level file into a region world")
+    parser.add_argument("level", help="level file to convert")
+    parser.add_argument("output", help="directory to write the region files to")
+    arguments = parser.parse_args(args)
+
+    # The objects map of the main level is used, so the world has the same tiles and entities
+    from engine.region import RegionWorld
+    from .main_level import MainLevel
+
+    start = time.perf_counter()
+    world = RegionWorld.convert_level(arguments.level, arguments.output, MainLevel().objects_map)
+    print(f"region_converter: converted {arguments.level} with {len(world.layers)} layer(s) to {arguments.output} "
+          f"in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+from typing import Dict, Any, List, Tuple
+
+from engine import Tile, Entity
+from .enemies import RobotEnemy, FlyEnemy
+from .weapon import Fireball
+
+import random
+import json
+
+
+class Scenario:
+    """Stress scenario which spawns entities around the spawn point once the level is shown.
+    It's loaded from a JSON file, for example:
+        {"level": "stress.level", "robots": 50, "flies": 50, "fireballs": 100, "radius": 20, "maintain": true}
+    In the maintain mode destroyed entities are spawned again, so the load stays the same during the whole run"""
+    # Seconds between checks of the maintain mode
+    MAINTAIN_INTERVAL = 0.5
+
+    def __init__(self,
+                 level: str | None = None,
+                 robots: int = 0,
+                 flies: int = 0,
+                 fireballs: int = 0,
+                 radius: int = 20,
+                 maintain: bool = False,
+                 seed: int = 0):
+        self.level = level
+        self.robots = robots
+        self.flies = flies
+        self.fireballs = fireballs
+        # Distance in tiles from the spawn point within which entities are spawned
+        self.radius = radius
+        self.maintain = maintain
+        self._rng = random.Random(seed)
+        self._spawned: Dict[type, List[Entity]] = {RobotEnemy: [], FlyEnemy: [], Fireball: []}
+        self._last_maintain = 0.0
+
+    @classmethod
+    def from_file(cls, filepath: str) -> "Scenario":
+        with open(filepath, "r", encoding="utf-8") as file:
+            spec: Dict[str, Any] = json.load(file)
+        return cls(spec.get("level"), spec.get("robots", 0), spec.get("flies", 0), spec.get("fireballs", 0),
+                   spec.get("radius", 20), spec.get("maintain", False), spec.get("seed", 0))
+
+    def get_counts(self) -> Dict[type, int]:
+        return {RobotEnemy: self.robots, FlyEnemy: self.flies, Fireball: self.fireballs}
+
+    def start(self, level):
+        """Spawns all entities of the scenario"""
+        for entity_class, count in self.get_counts().items():
+            self._spawn(level, entity_class, count)
+        print(f"scenario: spawned {sum(len(entities) for entities in self._spawned.values())} entities")
+
+    def update(self, level, ticks: float):
+        """Spawns the destroyed entities again in the maintain mode"""
+        if not self.maintain or ticks - self._last_maintain < Scenario.MAINTAIN_INTERVAL:
+            return
+        self._last_maintain = ticks
+        alive = set(id(entity) for entity in level.get_entities())
+        for entity_class, count in self.get_counts().items():
+            self._spawned[entity_class] = [entity for entity in self._spawned[entity_class] if id(entity) in alive]
+            self._spawn(level, entity_class, count - len(self._spawned[entity_class]))
+
+    def _spawn(self, level, entity_class: type, count: int):
+        positions = self._find_positions(level, count, on_ground=entity_class is RobotEnemy)
+        for position in positions:
+            if entity_class is Fireball:
+                direction = (self._rng.choice([-1, 1]) * self._rng.randint(2, 8), self._rng.randint(-2, 2))
+                entity = Fireball(level.get_player(), list(position), direction)
+            else:
+                entity = entity_class()
+                entity.set_position(list(position))
+            self._spawned[entity_class].append(level.add_entity(entity))
+
+    def _find_positions(self, level, count: int, on_ground: bool) -> List[Tuple[int, int]]:
+        """Returns free positions around the spawn point. Positions on the ground have a solid tile below them"""
+        center_x, center_y = level.get_spawn_point()
+        center_x = int(center_x) // Tile.TILE_SIZE * Tile.TILE_SIZE
+        center_y = int(center_y) // Tile.TILE_SIZE * Tile.TILE_SIZE
+        positions = []
+        for _ in range(count * 20):
+            if len(positions) >= count:
+                break
+            position = (center_x + self._rng.randint(-self.radius, self.radius) * Tile.TILE_SIZE,
+                        center_y + self._rng.randint(-self.radius, self.radius) * Tile.TILE_SIZE)
+            if level.get_tile(position, "layer0"):
+                continue
+            if on_ground and not level.get_tile((position[0], position[1] - Tile.TILE_SIZE), "layer0"):
+                continue
+            positions.append(position)
+        return positions
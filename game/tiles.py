@@ -1,6 +1,6 @@
 from pgzero.rect import Rect
 
-from engine import Tile, Entity, Sprite, AnimationPresets, PhysObject
+from engine import Tile, Entity, Sprite, AnimationPresets, PhysObject, Timer
 from .player import Player
 from .enemies import Enemy
 from .powerup import PowerupTypes
@@ -48,6 +48,8 @@ class ShieldPowerupTile(Powerup):
 
 
 class DirtTile(Tile):
+    FLYWEIGHT = True
+
     SPRITE_RULES = {
         "dirt_all_neighbours%0-1": ["AAA",
                                     "ACA",
@@ -152,24 +154,32 @@ class DirtTile(Tile):
 
 
 class GrassBladeTile(Tile):
+    FLYWEIGHT = True
+
     def __init__(self):
         super(GrassBladeTile, self).__init__(sprite=Sprite(["small_grass"]))
         self.has_collision = False
 
 
 class CactusTile(Tile):
+    FLYWEIGHT = True
+
     def __init__(self):
         super(CactusTile, self).__init__(sprite=Sprite(["small_cactus"]))
         self.has_collision = False
 
 
 class SmallTreeTile(Tile):
+    FLYWEIGHT = True
+
     def __init__(self):
         super(SmallTreeTile, self).__init__(sprite=Sprite(["small_tree"]))
         self.has_collision = False
 
 
 class GrassTile(Tile):
+    FLYWEIGHT = True
+
     SPRITE_RULES = {
         "dirt_all_neighbours%0-1": ["AAA",
                                     "ACA",
@@ -223,6 +233,8 @@ class GrassTile(Tile):
 
 
 class CloudTile(Tile):
+    FLYWEIGHT = True
+
     SPRITE_RULES = {
         "cloud_single": ["   ",
                          "0C0",
@@ -247,6 +259,8 @@ class CloudTile(Tile):
 
 
 class LeavesTile(Tile):
+    FLYWEIGHT = True
+
     SPRITE_RULES = {
         
         "leaves_all_neighbours": [" A ",
@@ -305,6 +319,8 @@ class LeavesTile(Tile):
 
 
 class WoodTile(Tile):
+    FLYWEIGHT = True
+
     SPRITE_RULES = {
         "wood_center": [" A ",
                         "0C0",
@@ -348,6 +364,8 @@ class WoodTile(Tile):
 
 
 class LeftSignTile(Tile):
+    FLYWEIGHT = True
+
     def __init__(self):
         super(LeftSignTile, self).__init__()
         self._sprite = Sprite(["left_sign"])
@@ -355,6 +373,8 @@ class LeftSignTile(Tile):
 
 
 class RightSignTile(Tile):
+    FLYWEIGHT = True
+
     def __init__(self):
         super(RightSignTile, self).__init__()
         self._sprite = Sprite(["right_sign"])
@@ -362,47 +382,58 @@ class RightSignTile(Tile):
 
 
 class MineTile(Tile):
+    EXPLOSION_DELAY = 0.7
+    SOUND_INTERVAL = 0.2
+    SOUNDS = 3
+    # Time after the explosion the mine doesn't react to the player
+    COOLDOWN = 1
+
     def __init__(self):
         super(MineTile, self).__init__()
         self._sprite = Sprite(["mine0"])
-        self.until_explosion = -1
-        self.next_sound = 0
+        self.explosion_timer: Timer | None = None
+        self.sound_timer: Timer | None = None
+        self.cooldown: Timer | None = None
         self.current_sound = 0
         self.has_collision = False
         self.colliding = False
-        self.timeout = 0
     
     def update(self, game, level, dt):
         super().update(game, level, dt)
         
-        if not self.colliding:
-            self.until_explosion = -1
-            self.current_sound = 0
-
-        if self.until_explosion != -1:
-            self._sprite.set_image(0, "mine1")
-            if self.next_sound + 0.2 < self._tick and self.current_sound <= 2:
-                self.next_sound = self._tick
-                game.get_sound_engine().play(f"mine{self.current_sound}")
-                self.current_sound += 1
-            
-            if self.until_explosion < self._tick:
-                self._level.add_entity(Explosion(None, self.get_position(), knockback=True))
-                self.timeout = self._tick + 1
-                self.until_explosion = -1
-        else:
-            self._sprite.set_image(0, "mine0")
+        # The mine is disarmed once the player leaves it
+        if not self.colliding and self.explosion_timer is not None:
+            self._disarm()
         self.colliding = False
+
+    def _disarm(self):
+        self.explosion_timer.cancel()
+        self.sound_timer.cancel()
+        self.explosion_timer = None
+        self._sprite.set_image(0, "mine0")
+
+    def _play_sound(self, game):
+        game.get_sound_engine().play(f"mine{self.current_sound}")
+        self.current_sound += 1
+        if self.current_sound < MineTile.SOUNDS:
+            self.sound_timer = self.schedule(MineTile.SOUND_INTERVAL, self._play_sound, game)
+
+    def _explode(self):
+        self._level.add_entity(Explosion(None, self.get_position(), knockback=True))
+        self.cooldown = self.schedule(MineTile.COOLDOWN)
+        self.explosion_timer = None
+        self._sprite.set_image(0, "mine0")
     
     def on_collision(self, game, obj, top, bottom, right, left):
         super().on_collision(game, obj, top, bottom, right, left)
         
-        if self.timeout > self._tick:
+        if self.cooldown is not None and not self.cooldown.is_fired():
             return
         
         if isinstance(obj, Player) and obj.hp > 0:
             self.colliding = True
-            if self.until_explosion == -1:
-                self.until_explosion = self._tick + 0.7
-                self.next_sound = 0
+            if self.explosion_timer is None:
+                self.explosion_timer = self.schedule(MineTile.EXPLOSION_DELAY, self._explode)
+                self._sprite.set_image(0, "mine1")
                 self.current_sound = 0
+                self._play_sound(game)
@@ -1,20 +1,34 @@
-from engine import Entity, Sprite, Tile
+from engine import Entity, Sprite, Tile, ParticleEmitter, Timer
 
 from typing import Tuple, List
 
 
 class Explosion(Entity):
+    PARTICLES = ParticleEmitter([(255, 220, 120), (255, 150, 40), (220, 70, 30), (90, 80, 80)],
+                                speed=(120, 420), life=(0.3, 0.9), size=(3, 7), gravity=0.4, drag=0.05)
+
     def __init__(self, source: Entity, position: List[float], knockback: bool = False):
         super().__init__(position, [96, 96], sprite=Sprite([f"explosion{i}" for i in range(7)], interval=0.05))
         self.has_collision = False
         self.is_static = True
         self.despawn_timeout = 0.05 * 7
+        # The explosion is played once, from the first frame
+        self.get_sprite().restart()
         self.initialized = False
         self.source = source
         self.knockback = knockback
+
+    def being_added(self, game, level):
+        super().being_added(game, level)
+        self.schedule(self.despawn_timeout, self.destroy)
     
     def update(self, game, level, dt):
         super().update(game, level, dt)
+
+        # Sparks fly out once, during the first update
+        if self._counter == 1:
+            rect = self.get_rect()
+            level.get_particles_engine().emit(Explosion.PARTICLES, (rect.centerx, rect.y - rect.height // 2), 80)
         
         if not self.initialized:
             self.initialized = False
@@ -42,12 +56,12 @@ class Explosion(Entity):
                 from .enemies import Enemy
                 if isinstance(self.source, Player) and isinstance(entity, Enemy) and entity.hp <= 0:
                     self._level.killed_entity(entity)
-        
-        if self.despawn_timeout < self._tick:
-            self.destroy()
 
 
 class Fireball(Entity):
+    TRAIL_PARTICLES = ParticleEmitter([(255, 200, 60), (255, 130, 30), (200, 60, 20)],
+                                      speed=(10, 50), life=(0.15, 0.35), size=(2, 5), gravity=0.05, spread=60)
+
     def __init__(self, source: Entity, position: List[float], direction: Tuple[int, int]):
         super().__init__(position, [32, 32], sprite=Sprite([f"fireball{i}" for i in range(5)], interval=0.1))
         self._x_vel_multiplier = 1
@@ -56,16 +70,25 @@ class Fireball(Entity):
         self.exploded = False
         self.despawn_timeout = 5
         self.no_collision_timeout = 0.2
+        # Fireballs don't explode on tiles right after they're shot
+        self.no_collision_cooldown: Timer | None = None
         self.source = source
         self.mass = 0
+
+    def being_added(self, game, level):
+        super().being_added(game, level)
+        self.no_collision_cooldown = self.schedule(self.no_collision_timeout)
+        self.schedule(self.despawn_timeout, self.destroy)
     
     def update(self, game, level, dt):
         super().update(game, level, dt)
         self._velocity[0] += self.fireball_direction[0] * 0.1
         self._velocity[1] += self.fireball_direction[1] * 0.1
-        
-        if self.despawn_timeout < self._tick:
-            self.destroy()
+
+        # The trail is left behind the fireball
+        rect = self.get_rect()
+        level.get_particles_engine().emit(Fireball.TRAIL_PARTICLES, (rect.centerx, rect.y - rect.height // 2), 2,
+                                          (-self._velocity[0], -self._velocity[1]))
 
     def on_collision(self, game, obj, top, bottom, right, left):
         if obj != self.source and obj.has_collision:
@@ -80,7 +103,7 @@ class Fireball(Entity):
                 from .enemies import Enemy
                 if isinstance(self.source, Player) and isinstance(obj, Enemy) and obj.hp <= 0:
                     self._level.killed_entity(obj)
-            elif not self.exploded and self.no_collision_timeout < self._tick:
+            elif not self.exploded and self.no_collision_cooldown.is_fired():
                 self.exploded = True
                 self._level.add_entity(Explosion(self.source, self.get_position()))
                 self.destroy()
@@ -4,23 +4,53 @@ from pgzero.screen import Screen
 from pgzero.rect import Rect
 from pgzero.clock import Clock
 from pgzero.loaders import SoundLoader
-from pgzero.keyboard import Keyboard
+from pgzero.keyboard import Keyboard, keys
 from pgzero import music
 from typing import Literal, Dict, Any, List, Tuple
 
-from game import MainLevel, MainMenu
-from engine import Level, AnimationPresets, AnimationProvider, Tile
+from game import MainLevel, MainMenu, Scenario
+from engine import Level, AnimationPresets, AnimationProvider, Tile, Chunk, FrameProfiler, Tracer, HitchDetector, \
+    MetricsRecorder, MemoryTracker, TimerWheel, Timer, perf_counters
 
 import sys
 import time
 import json
 import os
 
+SOUND_PLAYS = perf_counters.register("sound.plays", "Sounds played by the sound engine")
+# Starts tracing memory allocations and saves the memory report when the game exits, e.g.
+# "python main.py --memory-snapshot memory.json". The file can be omitted
+MEMORY_SNAPSHOT_FLAG = "--memory-snapshot"
+# Runs the stress scenario from the file in the main level, e.g. "python main.py --scenario stress.json"
+SCENARIO_FLAG = "--scenario"
+
+
+def get_argument(flag: str) -> str | None:
+    """Returns the value of the command line flag, an empty string if the flag has no value,
+    or None if the flag is not set"""
+    if flag not in sys.argv:
+        return None
+    idx = sys.argv.index(flag)
+    if idx + 1 < len(sys.argv) and not sys.argv[idx + 1].startswith("-"):
+        return sys.argv[idx + 1]
+    return ""
+
+
+def get_memory_snapshot_file() -> str | None:
+    """Returns the file of the memory report passed through the command line, or None if the flag is not set"""
+    filepath = get_argument(MEMORY_SNAPSHOT_FLAG)
+    if filepath == "":
+        return os.path.join("memory", time.strftime("memory_%Y%m%d_%H%M%S.json"))
+    return filepath
+
 
 class SoundEngine:
     def __init__(self, game):
         self._game = game
-        self._timeout = {}
+        # Sounds which are still playing, each one is removed by its timer once it ends
+        self._playing: Dict[str, Timer] = {}
+        self._timers = TimerWheel()
+        self._time = 0.0
         self._volume = 0.3
         self._is_enabled = game.get_options().is_sound_enabled()
 
@@ -37,6 +67,11 @@ class SoundEngine:
         else:
             music.play("music0")
 
+    def update(self, dt: float):
+        # Sounds play in the real time, even if the level is paused, so the engine has its own timers
+        self._time += dt
+        self._timers.advance(self._time)
+
     def set_volume(self, volume: float):
         self._volume = volume
         music.set_volume(self._volume / 3)
@@ -55,19 +90,13 @@ class SoundEngine:
             sound = random.choice(sound)
 
         # Check if the previous played sound (if any) has stopped playing
-        if self._check_timeout(sounds_list) or no_delay:
+        if no_delay or not any(name in self._playing for name in sounds_list):
             sounds.load(sound).set_volume(volume if volume else self._volume)
             sounds.load(sound).play()
-            self._timeout[sound] = time.time() + sounds.load(sound).get_length()
-
-    def _check_timeout(self, sound_list: List[str]):
-        for i in sound_list:
-            found_sound = self._timeout.get(i)
-            if found_sound is not None and found_sound > time.time():
-                return False
-            elif found_sound is not None:
-                self._timeout.pop(i)
-        return True
+            SOUND_PLAYS.value += 1
+            if (timer := self._playing.get(sound)) is not None:
+                timer.cancel()
+            self._playing[sound] = self._timers.schedule(sounds.load(sound).get_length(), self._playing.pop, sound)
 
 
 class Options:
@@ -76,7 +105,7 @@ class Options:
         self._options: Dict[str, Any] = {}
 
         # Try to load the settings from the file
-        if os.path.isfile("settings.json"):
+        if os.path.isfile("options.json"):
             with open("options.json", 'r', encoding='utf-8') as file:
                 self._options = json.load(file)
 
@@ -109,14 +138,79 @@ class Options:
     def is_sound_enabled(self) -> bool:
         return self._options.get("sound_enabled", True)
 
+    def is_trace_enabled(self) -> bool:
+        return self._options.get("trace", False)
+
+    def get_trace_directory(self) -> str:
+        return self._options.get("trace_directory", "traces")
+
+    def is_hitch_capture_enabled(self) -> bool:
+        return self._options.get("hitch_capture", False)
+
+    def get_hitch_budget(self) -> float:
+        """Returns the frame time in seconds, above which the frame is captured"""
+        return self._options.get("hitch_budget_ms", 50) / 1000
+
+    def get_hitch_mode(self) -> str:
+        return self._options.get("hitch_mode", "sampling")
+
+    def get_hitch_directory(self) -> str:
+        return self._options.get("hitch_directory", "hitches")
+
+    def is_metrics_enabled(self) -> bool:
+        return self._options.get("metrics", False)
+
+    def get_metrics_file(self) -> str:
+        """Returns the file which per-frame metrics are written to. The file format is chosen by its extension"""
+        return self._options.get("metrics_file", os.path.join("metrics", time.strftime("metrics_%Y%m%d_%H%M%S.jsonl")))
+
+    def get_scenario_file(self) -> str | None:
+        """Returns the stress scenario which is run in the main level"""
+        return self._options.get("scenario", None)
+
+    def is_memory_tracing_enabled(self) -> bool:
+        return self._options.get("memory_tracing", False)
+
+    def get_memory_directory(self) -> str:
+        return self._options.get("memory_directory", "memory")
+
 
 class Game:
+    # Time in seconds which can be spent on the level preparation each frame during levels switching
+    LOADING_TIME_BUDGET = 0.008
+    # Starts recording the trace, or saves it if it's being recorded
+    TRACE_KEY = keys.F9
+    # Saves the memory report
+    MEMORY_KEY = keys.F10
+
     def __init__(self):
         self._current_level: Level | None = None
         self._next_level: Level | None = None
         self._level_switch_animation = AnimationProvider(AnimationPresets.ZOOM, speed=2)
         self._options = Options(self)
         self._sound_engine = SoundEngine(self)
+        self._profiler = FrameProfiler()
+        self._tracer = Tracer()
+        self._tracer.set_enabled(self._options.is_trace_enabled())
+        self._trace_key_pressed = False
+        self._hitch_detector = HitchDetector(
+            self._options.get_hitch_directory(),
+            self._options.get_hitch_budget(),
+            self._options.get_hitch_mode())
+        self._hitch_detector.set_enabled(self._options.is_hitch_capture_enabled())
+        self._metrics_recorder: MetricsRecorder | None = None
+        if self._options.is_metrics_enabled():
+            self._metrics_recorder = MetricsRecorder(self._options.get_metrics_file())
+        # Start times of the current and the previous update, used by the metrics
+        self._update_start: float | None = None
+        self._last_update_start: float | None = None
+        # Tracing has to start before the levels are created, so their allocations are included
+        self._memory_tracker = MemoryTracker()
+        self._memory_key_pressed = False
+        self._memory_snapshot_file = get_memory_snapshot_file()
+        if self._memory_snapshot_file is not None or self._options.is_memory_tracing_enabled():
+            self._memory_tracker.start_tracing()
+        self._switch_start = 0.0
         self._fps = 0
         self._is_loading = False
         self._initialized = False
@@ -127,6 +221,8 @@ class Game:
             "main_menu": MainMenu(),
             "test_level": MainLevel()
         }
+        if scenario_file := get_argument(SCENARIO_FLAG) or self._options.get_scenario_file():
+            self._levels["test_level"].set_scenario(Scenario.from_file(scenario_file))
         self.switch_level("main_menu")
 
     def get_options(self) -> Options:
@@ -135,6 +231,48 @@ class Game:
     def get_sound_engine(self) -> SoundEngine:
         return self._sound_engine
 
+    def get_profiler(self) -> FrameProfiler:
+        return self._profiler
+
+    def get_tracer(self) -> Tracer:
+        return self._tracer
+
+    def get_hitch_detector(self) -> HitchDetector:
+        return self._hitch_detector
+
+    def get_metrics_recorder(self) -> MetricsRecorder | None:
+        return self._metrics_recorder
+
+    def get_memory_tracker(self) -> MemoryTracker:
+        return self._memory_tracker
+
+    def get_levels(self) -> Dict[str, Level]:
+        return self._levels
+
+    def save_memory_report(self, filepath: str | None = None) -> str | None:
+        """Saves the memory report to the file, or to the memory directory if it's not provided.
+        Returns the path of the file"""
+        if filepath is None:
+            filepath = os.path.join(self._options.get_memory_directory(), time.strftime("memory_%Y%m%d_%H%M%S.json"))
+        if not self._memory_tracker.dump(filepath, self._levels):
+            return None
+        return filepath
+
+    def close(self):
+        """Writes everything which is saved when the game exits"""
+        if self._metrics_recorder is not None:
+            self._metrics_recorder.close()
+        if self._memory_snapshot_file is not None:
+            self.save_memory_report(self._memory_snapshot_file)
+            self._memory_snapshot_file = None
+
+    def save_trace(self) -> str | None:
+        """Exports the recorded trace to the traces directory. Returns the path of the file"""
+        filepath = os.path.join(self._options.get_trace_directory(), time.strftime("trace_%Y%m%d_%H%M%S.json"))
+        if not self._tracer.export(filepath):
+            return None
+        return filepath
+
     @classmethod
     def _set_title(cls, title: str):
         # Sorry for this hacky way, but I've no clue how to do it differently
@@ -150,15 +288,26 @@ class Game:
             print(f"game: level '{level_name}' does not exist")
             return
         print(f"game: switching level to '{level_name}'")
-        if self._current_level is None:
-            self._current_level = level
-            level.shown(self)
-        else:
-            self._next_level = level
-            self._level_switch_animation.set_state(0.01)
+
+        # The level is prepared in the background while the switching animation is played.
+        # If there's no level yet, start with the screen covered until the level is prepared
+        self._next_level = level
+        self._level_switch_animation.set_state(1 if self._current_level is None else 0.01)
         self._is_loading = True
+        self._switch_start = time.perf_counter()
+
+    def is_loading(self) -> bool:
+        return self._is_loading
+
+    def get_loading_progress(self) -> float:
+        """Returns the preparation progress of the level we're switching to"""
+        if self._next_level is None:
+            return 1
+        return self._next_level.get_loading_progress()
 
     def draw(self):
+        self._tracer.begin("Game.draw")
+
         # Render the engine if any is set
         if self._current_level is not None:
             screen.fill(self._current_level.get_bg_color())
@@ -170,14 +319,20 @@ class Game:
             # Render the engine
             self._current_level.draw(self)
 
-        # Play level switching animation
+        # Play level switching animation. The level is switched when the screen is fully covered
+        # and the next level is prepared
         if self._next_level:
-            if self._level_switch_animation.get_state() >= 1:
-                self._current_level.hidden(self)
+            if self._level_switch_animation.get_state() >= 1 and self._next_level.is_prepared() \
+                    and self._current_level is not self._next_level:
+                if self._current_level is not None:
+                    self._current_level.hidden(self)
                 self._current_level = self._next_level
                 self._next_level.shown(self)
+                self._tracer.instant("Game.level_shown", args={"level": self._current_level.__class__.__name__})
 
             if self._level_switch_animation.get_state() <= 0:
+                self._tracer.add_span("Game.switch_level", self._switch_start, time.perf_counter() - self._switch_start,
+                                      args={"level": self._next_level.__class__.__name__})
                 self._next_level = None
                 self._is_loading = False
             else:
@@ -186,17 +341,75 @@ class Game:
                 )
                 screen.draw.filled_rect(rect, (0, 0, 0))
 
+                # Draw the loading bar while the next level is being prepared
+                if not self._next_level.is_prepared():
+                    bar = Rect(screen.width // 4, screen.height - 64, screen.width // 2, 12)
+                    screen.draw.rect(bar, (255, 255, 255))
+                    bar.width = round(bar.width * self.get_loading_progress())
+                    screen.draw.filled_rect(bar, (255, 255, 255))
+
+        self._tracer.end()
+
+        # The frame is measured from the start of the update until the level is drawn
+        self._profiler.end_frame()
+        perf_counters.end_frame()
+        if (hitch_path := self._hitch_detector.end_frame(self._current_level)) and self._tracer.is_enabled():
+            self._tracer.export(os.path.join(hitch_path, "trace.json"))
+        self._record_metrics()
+        if self._profiler.is_enabled():
+            if self._current_level is not None:
+                perf_counters.draw_heatmap(self, self._current_level, screen.surface, Tile.TILE_SIZE * Chunk.CHUNK_SIZE)
+            self._profiler.draw(self, screen.surface, Rect(screen.width // 2 - 320, 8, 640, 120))
+            perf_counters.draw(self, screen.surface, Rect(screen.width // 2 - 320, 136, 320, 120))
+            self._memory_tracker.draw(self, screen.surface, Rect(screen.width // 2, 136, 320, 240), self._levels)
+
+    def _record_metrics(self):
+        """Sends the times of the frame to the metrics recorder. The frame time is the time between two updates,
+        and the tick time is the time from the start of the update until the level is drawn"""
+        if self._metrics_recorder is None or self._update_start is None:
+            return
+        now = time.perf_counter()
+        tick_time = now - self._update_start
+        frame_time = self._update_start - self._last_update_start if self._last_update_start is not None else tick_time
+        self._metrics_recorder.record(now, frame_time, tick_time, self._current_level)
+        self._last_update_start = self._update_start
+        self._update_start = None
+
     def update(self, dt):
+        self._update_start = time.perf_counter()
         if not self._initialized:
             self._initialized = True
             self.get_options().init()
             self.get_sound_engine().init()
+        self.get_sound_engine().update(dt)
+
+        # Subsystems are profiled only in the debug mode
+        self._profiler.set_enabled(self.get_options().is_debug_enabled())
+        self._profiler.begin_frame()
+        self._hitch_detector.begin_frame(self._current_level)
+        self._tracer.begin("Game.update")
+
+        # Start recording the trace or save it
+        if self.get_keyboard()[Game.TRACE_KEY] and not self._trace_key_pressed:
+            if self._tracer.is_enabled():
+                self.save_trace()
+            else:
+                print("game: recording the trace")
+                self._tracer.set_enabled(True)
+        self._trace_key_pressed = self.get_keyboard()[Game.TRACE_KEY]
+
+        if self.get_keyboard()[Game.MEMORY_KEY] and not self._memory_key_pressed:
+            self.save_memory_report()
+        self._memory_key_pressed = self.get_keyboard()[Game.MEMORY_KEY]
         
-        # Limit the delta value to 0.016, because we might see some value spikes during the loading
-        if self._is_loading:
-            dt = 0.016
-        
-        self._level_switch_animation.update(self, dt)
+        # Prepare the next level step by step, so the switching animation keeps playing.
+        # The animation is held while the screen is covered until the level is prepared and switched
+        if self._next_level is not None:
+            with self._profiler.scope("loading"):
+                self._next_level.prepare(self, Game.LOADING_TIME_BUDGET)
+        if self._next_level is None or self._current_level is self._next_level \
+                or self._level_switch_animation.get_state() < 1:
+            self._level_switch_animation.update(self, dt)
 
         # Update the engine if any is set
         if self._current_level is not None:
@@ -207,6 +420,7 @@ class Game:
                 self._current_level.on_mouse_pressed(self, self._mouse_position, button)
 
         self._fps = 1 / dt
+        self._tracer.end()
     
     def get_fps(self):
         return round(self._fps, 2)
@@ -230,6 +444,7 @@ class Game:
             self._current_level.on_mouse_move(self, pos)
     
     def exit(self, code: int = 0):
+        self.close()
         sys.exit(code)
 
     @classmethod
@@ -294,5 +509,8 @@ if __name__ == "__main__":
 
     pgzrun.go()
 
+    # Write the remaining metrics and the memory report
+    game.close()
+
     # Save settings
     game.get_options().save()